@@ -0,0 +1,121 @@
+# SucculentPi Alert State
+## Remembers which alerts timestream-alerter-lambda.py has already sent, so
+## that it only sends a message when a measure starts breaking its alert rule
+## (OK to ALERT) or stops breaking it (ALERT to OK), rather than on every run
+## for as long as the problem lasts.
+##
+## Each measure which is currently alerting has an open incident, holding
+## when it started and what the alert said. The incidents are kept in a
+## DynamoDB table, whose partition key is the string attribute "measure", so
+## they're shared by every Lambda container. For testing, or running the
+## alerter outside AWS, they can be kept in a local SQLite file instead.
+
+import logging
+import sqlite3
+from datetime import datetime, timezone
+
+logger = logging.getLogger()
+
+
+class SQLiteAlertState:
+  # Open incidents kept in a local SQLite database
+  ## path: location of the SQLite database file
+  def __init__(self, path):
+    self.db = sqlite3.connect(path)
+    self.db.execute(
+      "CREATE TABLE IF NOT EXISTS incidents ("
+      "measure TEXT PRIMARY KEY, "
+      "since REAL NOT NULL, "
+      "message TEXT NOT NULL)"
+    )
+    self.db.commit()
+
+  def open_incidents(self):
+    # Return the open incidents, as {measure: {"since": epoch seconds, "message": alert}}
+    rows = self.db.execute("SELECT measure, since, message FROM incidents").fetchall()
+    return {measure: {"since": since, "message": message} for measure, since, message in rows}
+
+  def update(self, opened, closed):
+    # Open incidents for {measure: {"since": ..., "message": ...}}, and close
+    # those for the measures in 'closed', in one transaction
+    with self.db:
+      self.db.executemany("INSERT OR REPLACE INTO incidents (measure, since, message) VALUES (?, ?, ?)",
+                          [(measure, incident["since"], incident["message"])
+                           for measure, incident in opened.items()])
+      self.db.executemany("DELETE FROM incidents WHERE measure = ?",
+                          [(measure,) for measure in closed])
+
+
+class DynamoDBAlertState:
+  # Open incidents kept in a DynamoDB table
+  ## table_name: name of the table, with the string partition key "measure"
+  ## client:     boto3 DynamoDB client to use
+  def __init__(self, table_name, client):
+    self.table_name = table_name
+    self.client = client
+
+  def open_incidents(self):
+    incidents = {}
+    kwargs = {"TableName": self.table_name}
+    while True:
+      response = self.client.scan(**kwargs)
+      for item in response["Items"]:
+        incidents[item["measure"]["S"]] = {"since": float(item["since"]["N"]),
+                                           "message": item["message"]["S"]}
+      if "LastEvaluatedKey" not in response:
+        return incidents
+      kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+  def update(self, opened, closed):
+    ## BatchWriteItem takes at most 25 requests at a time
+    requests = [{"PutRequest": {"Item": {"measure": {"S": measure},
+                                         "since": {"N": str(incident["since"])},
+                                         "message": {"S": incident["message"]}}}}
+                for measure, incident in opened.items()]
+    requests += [{"DeleteRequest": {"Key": {"measure": {"S": measure}}}} for measure in closed]
+    for start in range(0, len(requests), 25):
+      unprocessed = {self.table_name: requests[start:start + 25]}
+      while unprocessed:
+        response = self.client.batch_write_item(RequestItems=unprocessed)
+        unprocessed = response.get("UnprocessedItems")
+
+
+def transitions(incidents, violations, measures, now):
+  # Compare the open incidents with the latest violations, as
+  # {measure: [alerts]}, returning the incidents which have opened, those
+  # which are still open and those which have recovered
+  ## Incidents for measures which no longer have a rule are dropped, without
+  ## being reported as recovered
+  opened = {measure: {"since": now, "message": "; ".join(alerts)}
+            for measure, alerts in violations.items() if measure not in incidents}
+  ongoing = {measure: incident for measure, incident in incidents.items() if measure in violations}
+  recovered = {measure: incident for measure, incident in incidents.items()
+               if measure not in violations and measure in measures}
+  dropped = [measure for measure in incidents if measure not in measures]
+  return opened, ongoing, recovered, dropped
+
+def format_since(since):
+  return datetime.fromtimestamp(since, timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+
+def digest(opened, ongoing, recovered):
+  # One message covering every alert which opened or recovered in a run,
+  # returned as (subject, message)
+  sections = []
+  if opened:
+    sections.append("ALERT: The SucculentPi sensor data is missing or out of range:\n"
+                    + "\n".join(f"  {incident['message']}" for incident in opened.values()))
+  if recovered:
+    sections.append("RECOVERED: The SucculentPi sensor data is OK again:\n"
+                    + "\n".join(f"  {measure} (alerting since {format_since(incident['since'])})"
+                                for measure, incident in recovered.items()))
+  if ongoing:
+    sections.append("Still alerting:\n"
+                    + "\n".join(f"  {incident['message']} (since {format_since(incident['since'])})"
+                                for incident in ongoing.values()))
+  if opened and recovered:
+    subject = f"Alert: {len(opened)} New SucculentPi Sensor Alerts, {len(recovered)} Recovered"
+  elif opened:
+    subject = f"Alert: {len(opened)} New SucculentPi Sensor Alerts"
+  else:
+    subject = f"Recovered: {len(recovered)} SucculentPi Sensor Alerts"
+  return subject, "\n\n".join(sections)
@@ -0,0 +1,85 @@
+# SucculentPi Anomaly Detection
+## Scores each numeric field of each reading by how far it is from what has
+## been usual for that field lately, on the Raspberry Pi, before the reading
+## is sent. This catches e.g. a probe coming loose or a sudden drop in
+## humidity without having to pick a fixed range for every measure.
+##
+## Each field (see readings_schema.py) keeps an exponentially weighted moving
+## mean and variance, so only three numbers are held per field however long
+## it has been running. A value's score is its z-score against them:
+##   (value - mean) / standard deviation
+## A field is only scored once it has seen 'warmup' values, and its standard
+## deviation is never taken as less than 'min_stddev', so that a field which
+## has held steady doesn't score a tiny change as a huge anomaly.
+##
+## data_capture.py adds the scores to each reading under "anomaly", and they
+## are written to Timestream alongside the readings' values (see
+## readings_schema.py).
+
+import logging
+import math
+import threading
+
+import readings_schema
+from reporting import is_number, read_json, write_json
+
+logger = logging.getLogger()
+
+
+class AnomalyDetector:
+  # Scores the fields of each reading against their recent history
+  ## state_path: location of the JSON file holding each field's statistics
+  ## alpha:      weight of each new value in the moving mean and variance;
+  ##             larger values forget the past sooner
+  ## warmup:     number of values a field must have seen before it is scored
+  ## min_stddev: smallest standard deviation a score is taken against
+
+  def __init__(self, state_path, alpha=0.1, warmup=20, min_stddev=1.0):
+    self.state_path = state_path
+    self.alpha = alpha
+    self.warmup = warmup
+    self.min_stddev = min_stddev
+    self.lock = threading.Lock()
+    ## {measure name: {"mean": ..., "variance": ..., "count": values seen}}
+    self.state = read_json(self.state_path, {})
+
+  def save(self):
+    try:
+      write_json(self.state_path, self.state)
+    except:
+      logger.error(f"Error saving anomaly detection state to {self.state_path}")
+
+  def update(self, field_state, value):
+    # Score a value against a field's statistics, and then add it to them
+    ## Returns None while the field is still warming up
+    score = None
+    if field_state["count"] >= self.warmup:
+      stddev = max(math.sqrt(field_state["variance"]), self.min_stddev)
+      score = round((value - field_state["mean"]) / stddev, 2)
+    difference = value - field_state["mean"]
+    increment = self.alpha * difference
+    field_state["mean"] += increment
+    field_state["variance"] = (1 - self.alpha) * (field_state["variance"] + difference * increment)
+    field_state["count"] += 1
+    return score
+
+  def score(self, data_dict):
+    # Return the score of each numeric field in a reading, as
+    # {measure name: score}, updating the fields' statistics with its values
+    ## Fields which are missing, couldn't be read, or aren't numbers are left
+    ## out, as are those which are still warming up
+    scores = {}
+    with self.lock:
+      for path, measure_name in readings_schema.fields:
+        value = readings_schema.get_field(data_dict, path)
+        if not is_number(value):
+          continue
+        if measure_name not in self.state:
+          ## Start from the first value, rather than from zero
+          self.state[measure_name] = {"mean": float(value), "variance": 0.0, "count": 1}
+          continue
+        score = self.update(self.state[measure_name], value)
+        if score is not None:
+          scores[measure_name] = score
+      self.save()
+    return scores
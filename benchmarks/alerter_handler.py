@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# SucculentPi Alerter Lambda Benchmark
+## Measures how long each invocation of timestream-alerter-lambda.py's
+## handler takes, and how many AWS API calls it makes, for the first
+## ("cold") invocation in a new Lambda container and for the invocations
+## which reuse that container afterwards ("warm").
+##
+## boto3 is replaced by a stand-in whose clients take a set time to create
+## and to answer each call, so no AWS account is needed and the results only
+## reflect the work the handler itself asks for. Run from anywhere:
+##   python3 benchmarks/alerter_handler.py [--containers 5] [--invocations 20]
+##
+## Another version of the Lambda can be compared with --lambda-file, e.g.
+##   git show HEAD~1:timestream-alerter-lambda.py > /tmp/alerter-old.py
+##   python3 benchmarks/alerter_handler.py --lambda-file /tmp/alerter-old.py
+
+import argparse
+import importlib.util
+import json
+import os
+import re
+import statistics
+import sys
+import time
+import types
+
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Number of clients created and API calls made, by "service.operation"
+calls = {}
+
+
+def count(name):
+  calls[name] = calls.get(name, 0) + 1
+
+class FakeClient:
+  # Stand-in for a boto3 client, answering each call after 'latency' seconds
+  def __init__(self, service, latency, value):
+    self.service = service
+    self.latency = latency
+    self.value = value
+
+  def call(self, operation, response):
+    count(f"{self.service}.{operation}")
+    time.sleep(self.latency)
+    return response
+
+  ## Only called by versions of the Lambda before endpoint discovery was
+  ## left to the client
+  def describe_endpoints(self):
+    return self.call("describe_endpoints", {"Endpoints": [
+      {"Address": "query-cell1.timestream.eu-central-1.amazonaws.com", "CachePeriodInMinutes": 1440}]})
+
+  def query(self, QueryString, **kwargs):
+    ## Aggregated queries get one row of min, max and count per measure
+    ## asked for; anything else gets one row with the value in column 4
+    if "GROUP BY" in QueryString:
+      columns = ["measure_name", "min_value", "max_value", "value_count"]
+      measures = re.search(r"IN \(([^)]*)\)", QueryString).group(1).replace("'", "").split(", ")
+      rows = [[measure, self.value, self.value, "5"] for measure in measures]
+    else:
+      columns = ["client_id", "measure_name", "time", "measure_value::double", "measure_value::bigint"]
+      rows = [["pi", "", "", "", self.value]]
+    return self.call("query", {
+      "ColumnInfo": [{"Name": column} for column in columns],
+      "Rows": [{"Data": [{"ScalarValue": datum} for datum in row]} for row in rows]})
+
+  def publish(self, **kwargs):
+    return self.call("publish", {"MessageId": "0"})
+
+def fake_boto3(client_latency, call_latency, value):
+  # A module to put in place of boto3, creating FakeClients
+  module = types.ModuleType("boto3")
+  def client(service, **kwargs):
+    count(f"{service}.client")
+    time.sleep(client_latency)
+    return FakeClient(service, call_latency, value)
+  module.client = client
+  return module
+
+def load_lambda(path):
+  # Import the Lambda's file as a new module, as a new container would
+  ## The file name has hyphens in it, so it can't be imported by name
+  spec = importlib.util.spec_from_file_location("alerter_lambda", path)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+def summary(label, times, invocations):
+  ms = [seconds * 1000 for seconds in times]
+  per_invocation = ", ".join(f"{name} {number / invocations:.2f}"
+                             for name, number in sorted(calls.items()))
+  print(f"{label:<5} {len(ms):>5} invocations  mean {statistics.mean(ms):8.2f} ms"
+        f"  median {statistics.median(ms):8.2f} ms  max {max(ms):8.2f} ms")
+  print(f"      calls per invocation: {per_invocation}")
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark the alerter Lambda's handler")
+  parser.add_argument("--lambda-file", default=os.path.join(repo_dir, "timestream-alerter-lambda.py"),
+                      help="Lambda source file to benchmark")
+  parser.add_argument("--containers", type=int, default=5,
+                      help="Number of new containers to start, each with one cold invocation")
+  parser.add_argument("--invocations", type=int, default=20,
+                      help="Warm invocations per container")
+  parser.add_argument("--client-latency", type=float, default=0.05,
+                      help="Seconds taken to create each client")
+  parser.add_argument("--call-latency", type=float, default=0.02,
+                      help="Seconds taken by each API call")
+  parser.add_argument("--value", default="500",
+                      help="Value of the measures returned by the query")
+  parser.add_argument("--measures", type=int, default=1,
+                      help="Number of measures to give alert rules for, from the default sensor map")
+  args = parser.parse_args()
+
+  ## The Lambda imports alert_state.py from alongside it
+  sys.path.insert(0, repo_dir)
+  import readings_schema
+  measures = [measure_name for _, measure_name in readings_schema.fields][:args.measures]
+
+  os.environ.setdefault("SUCCULENTPI_DATABASE", "succulentpi")
+  os.environ.setdefault("SUCCULENTPI_TABLE", "sensordata")
+  os.environ.setdefault("VALUE_NAME", measures[0])
+  os.environ.setdefault("SNS_TOPIC", "arn:aws:sns:eu-central-1:000000000000:succulentpi")
+  ## Each container starts with no alerts open, as its state is only kept in memory
+  os.environ.setdefault("ALERT_STATE_PATH", ":memory:")
+  if args.measures > 1:
+    os.environ["ALERT_RULES"] = json.dumps([{"measure": measure, "min": 0, "max": 950}
+                                            for measure in measures])
+  sys.modules["boto3"] = fake_boto3(args.client_latency, args.call_latency, args.value)
+
+  cold_times = []
+  warm_times = []
+  cold_calls = {}
+  for _ in range(args.containers):
+    calls.clear()
+    ## A cold invocation includes loading the module, which is when a new
+    ## container runs the code outside the handler
+    start = time.perf_counter()
+    alerter = load_lambda(args.lambda_file)
+    alerter.lambda_handler({}, None)
+    cold_times.append(time.perf_counter() - start)
+    for name, number in calls.items():
+      cold_calls[name] = cold_calls.get(name, 0) + number
+    calls.clear()
+    for _ in range(args.invocations):
+      start = time.perf_counter()
+      alerter.lambda_handler({}, None)
+      warm_times.append(time.perf_counter() - start)
+    warm_calls = dict(calls)
+
+  calls.clear()
+  calls.update(cold_calls)
+  summary("cold", cold_times, args.containers)
+  calls.clear()
+  calls.update(warm_calls)
+  summary("warm", warm_times, args.invocations)
+
+if __name__ == "__main__":
+  main()
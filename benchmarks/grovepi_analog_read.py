@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# SucculentPi GrovePi Analog Read Benchmark
+## Measures how many analog reads per second the GrovePi library achieves
+## reading the soil moisture probes one at a time with analogRead(), compared
+## with batching them with analogReadMany().
+##
+## Run on the Raspberry Pi with the GrovePi+ attached, from the repository's
+## top level directory:
+##   python3 benchmarks/grovepi_analog_read.py [--pins 0 1 2] [--seconds 10]
+## or anywhere against the GrovePi emulator, e.g. with 1 ms per command:
+##   python3 benchmarks/grovepi_analog_read.py --simulated --latency 0.001
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+# Imported in main(), once the bus to use is known
+grovepi = None
+
+
+def bench(label, read, pins, seconds):
+  # Call 'read' repeatedly for 'seconds', reporting the reads per second
+  reads = 0
+  start = time.perf_counter()
+  while time.perf_counter() - start < seconds:
+    read(pins)
+    reads += len(pins)
+  elapsed = time.perf_counter() - start
+  print(f"{label:<16} {reads:>7} reads in {elapsed:6.2f}s  {reads / elapsed:8.1f} reads/s")
+  return reads / elapsed
+
+def read_one_at_a_time(pins):
+  return [grovepi.analogRead(pin) for pin in pins]
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark GrovePi analog reads")
+  parser.add_argument("--pins", type=int, nargs="+", default=[0, 1, 2],
+                      help="Analog pins to read (default: 0 1 2)")
+  parser.add_argument("--seconds", type=float, default=10,
+                      help="How long to run each benchmark for")
+  parser.add_argument("--simulated", action="store_true",
+                      help="Use the GrovePi emulator rather than the real bus")
+  parser.add_argument("--latency", type=float, default=0.0,
+                      help="Emulated seconds per command, with --simulated")
+  parser.add_argument("--error-rate", type=float, default=0.0,
+                      help="Emulated chance of a bus error, with --simulated")
+  parser.add_argument("--adaptive", action="store_true",
+                      help="Turn on grovepi's adaptive I2C timing")
+  args = parser.parse_args()
+
+  global grovepi
+  if args.simulated:
+    os.environ["GROVEPI_BUS"] = "SIM"
+  import grovepi
+  if args.simulated:
+    emulator = grovepi.get_bus()
+    emulator.latency = args.latency
+    emulator.error_rate = args.error_rate
+    for pin in args.pins:
+      emulator.set_analog(pin, 512)
+  grovepi.set_adaptive_timing(args.adaptive)
+
+  before = bench("analogRead", read_one_at_a_time, args.pins, args.seconds)
+  after = bench("analogReadMany", grovepi.analogReadMany, args.pins, args.seconds)
+  print(f"Speed-up: {after / before:.2f}x")
+
+if __name__ == "__main__":
+  main()
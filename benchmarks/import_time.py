@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# SucculentPi Import Time Benchmark
+## Summarises 'python -X importtime' for the start of the data capture script
+## and for the GrovePi library, to keep track of how long each run spends
+## importing modules before it takes its first reading.
+##
+## Run from the repository's top level directory, ideally on the Raspberry Pi:
+##   python3 benchmarks/import_time.py [--runs 5] [--output /tmp/import_time.txt]
+## Results depend heavily on the hardware and on which of the deferred modules
+## are installed, so compare runs on the same Raspberry Pi, e.g. against a
+## checkout of an earlier commit, rather than keeping a report in the repo.
+##
+## The data capture script is started with --help, which exits straight after
+## its top level imports. Modules it imports later, when they are first used,
+## are reported separately as "deferred" so that their cost is still visible.
+
+import argparse
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# (label, python arguments)
+targets = [
+  ("grovepi", ["-c", "import grovepi"]),
+  ("data_capture.py", ["data_capture.py", "--help"]),
+]
+
+# Modules data_capture.py only imports when it first uses them
+deferred_modules = ["numpy", "requests", "boto3", "awscrt", "awsiot",
+                    "seeed_si114x", "PIL"]
+
+
+def import_times(python_args):
+  # Run Python with -X importtime, returning {top level module: cumulative us}
+  environment = dict(os.environ, GROVEPI_BUS=os.environ.get("GROVEPI_BUS", "SIM"))
+  result = subprocess.run([sys.executable, "-X", "importtime"] + python_args,
+                          cwd=repo_dir, env=environment,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          text=True)
+  times = {}
+  for line in result.stderr.splitlines():
+    if not line.startswith("import time:") or "cumulative" in line:
+      continue
+    _, cumulative, name = line[len("import time:"):].split("|")
+    ## Nested imports are indented under the module which imported them;
+    ## only count the top level ones so nothing is counted twice
+    if name.startswith("  "):
+      continue
+    times[name.strip()] = int(cumulative)
+  return times
+
+def summarise(label, python_args, runs, top):
+  # Median import times over several runs
+  samples = [import_times(python_args) for _ in range(runs)]
+  totals = [sum(sample.values()) for sample in samples]
+  modules = {}
+  for sample in samples:
+    for name, cumulative in sample.items():
+      modules.setdefault(name, []).append(cumulative)
+  slowest = sorted(((statistics.median(times), name) for name, times in modules.items()),
+                   reverse=True)[:top]
+  lines = [f"{label}: {statistics.median(totals) / 1000:.1f} ms total (median of {runs} runs)"]
+  for cumulative, name in slowest:
+    lines.append(f"  {cumulative / 1000:8.1f} ms  {name}")
+  return lines
+
+def installed(module):
+  result = subprocess.run([sys.executable, "-c", f"import {module}"],
+                          cwd=repo_dir, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.DEVNULL)
+  return result.returncode == 0
+
+def main():
+  parser = argparse.ArgumentParser(description="Summarise module import times")
+  parser.add_argument("--runs", type=int, default=5,
+                      help="Runs of each target, the median is reported")
+  parser.add_argument("--top", type=int, default=10,
+                      help="Number of slowest top level imports to list")
+  parser.add_argument("--output", help="Also write the report to this file")
+  args = parser.parse_args()
+
+  report = [f"Python {sys.version.split()[0]} on {platform.machine()} {sys.platform}", ""]
+  for label, python_args in targets:
+    report += summarise(label, python_args, args.runs, args.top) + [""]
+  report.append("Deferred until first use:")
+  for module in deferred_modules:
+    if installed(module):
+      median = statistics.median(
+        sum(import_times(["-c", f"import {module}"]).values()) for _ in range(args.runs))
+      report.append(f"  {median / 1000:8.1f} ms  {module}")
+    else:
+      report.append(f"  {'n/a':>8}     {module} (not installed)")
+
+  print("\n".join(report))
+  if args.output:
+    with open(args.output, "w") as output_file:
+      output_file.write("\n".join(report) + "\n")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,203 @@
+# SucculentPi Counter Sensors
+## Sensors which are read by counting pulses, or timing low pulses, on one of
+## the GrovePi's digital pins, such as water flow meters, rain gauges and the
+## Grove dust sensor.
+##
+## Rather than polling the pin, each sensor's pin interrupt is armed on the
+## GrovePi firmware with grovepi.set_pin_interrupt(). The firmware then counts
+## by itself, and reports the count for the last complete period (in ms) with
+## grovepi.read_interrupt_state(). In daemon mode the counters are drained
+## once per period on a background thread and added up, so that a reading
+## covers everything counted since the one before it. When run once per
+## reading, the count for the last period is read instead.
+##
+## The sensors are declared in the sensor map (see readings_schema.py), with
+## their type (see 'counter_types') and pin, e.g.:
+##   [garden.env]
+##   water_flow = flow pin=D3
+## Their period, and any options of their type, can be set in config.ini, in
+## a section named 'COUNTER' followed by the sensor's measure name, e.g.:
+##   [COUNTER garden_env_water_flow]
+##   period = 2000
+##   units_per_pulse = 0.00222
+##
+## To add a new kind of counter sensor, subclass CounterSensor, add it to
+## 'counter_types' and add the names of its readings to
+## readings_schema.counter_readings.
+
+import abc
+import logging
+import threading
+import time
+
+import grovepi
+
+logger = logging.getLogger()
+
+
+class CounterSensor(abc.ABC):
+  # A sensor whose pin interrupt counts pulses on the GrovePi
+  ## name:   measure name of the sensor
+  ## pin:    digital pin the sensor is connected to (D2-D8)
+  ## period: length in ms of the period the firmware counts over
+  ftype = grovepi.COUNT_CHANGES
+  interrupt_mode = grovepi.RISING
+  default_period = 1000
+
+  def __init__(self, name, pin, period=None):
+    self.name = name
+    self.pin = pin
+    self.period = period or self.default_period
+    self.counts = []
+    self.next_drain = 0
+
+  def arm(self):
+    # Attach the interrupt to the sensor's pin
+    grovepi.set_pin_interrupt(self.pin, self.ftype, self.interrupt_mode, self.period)
+
+  @abc.abstractmethod
+  def readings(self, counts):
+    # Convert the counts for a number of periods into the sensor's readings,
+    # as {reading name: value}, with the names in readings_schema.counter_readings
+    pass
+
+
+class PulseCounter(CounterSensor):
+  # Counts rising edges, e.g. the tips of a tipping bucket rain gauge
+  ## units_per_pulse: quantity measured per pulse, e.g. mm of rain per tip
+  def __init__(self, name, pin, period=None, units_per_pulse=1):
+    super().__init__(name, pin, period)
+    self.units_per_pulse = units_per_pulse
+
+  def readings(self, counts):
+    pulses = sum(counts)
+    minutes = len(counts) * self.period / 60000
+    return {
+      "pulses": pulses,
+      "total": round(pulses * self.units_per_pulse, 3),
+      # Quantity per minute, over the periods counted
+      "rate": round(pulses * self.units_per_pulse / minutes, 3) if minutes else None
+    }
+
+
+class FlowSensor(PulseCounter):
+  # Grove water flow sensor; the YF-S201 gives 450 pulses per litre
+  default_period = 2000
+
+  def __init__(self, name, pin, period=None, units_per_pulse=1 / 450):
+    super().__init__(name, pin, period, units_per_pulse)
+
+
+class DustSensor(CounterSensor):
+  # Grove dust sensor, which holds its output low for longer the more dust
+  # there is; the firmware reports the total low time, in ms, per period
+  ftype = grovepi.COUNT_LOW_DURATION
+  interrupt_mode = grovepi.CHANGE
+  default_period = 30000
+
+  def readings(self, counts):
+    ## Same calculation as grovepi.dust_sensor_read(), averaged over the
+    ## periods counted
+    low_pulse_occupancy = sum(counts) / len(counts)
+    percentage = 100.0 * low_pulse_occupancy / self.period
+    concentration = 1.1 * percentage ** 3 - 3.8 * percentage ** 2 + 520 * percentage + 0.62
+    return {
+      "low_pulse_occupancy": round(low_pulse_occupancy),
+      "ratio": round(percentage, 3),
+      # Particles over 1 micron per 0.01 cubic foot
+      "concentration": round(concentration, 2)
+    }
+
+
+# Kinds of counter sensor, by their sensor type in the sensor map
+counter_types = {
+  "pulse": PulseCounter,
+  "flow": FlowSensor,
+  "dust": DustSensor,
+}
+
+def create_sensor(sensor, options):
+  # Create a counter sensor from its entry in the sensor map and its
+  # config.ini options, if any
+  options = dict(options)
+  period = int(options.pop("period", 0))
+  extra = {key: float(value) for key, value in options.items()}
+  return counter_types[sensor.sensor_type](sensor.measure_name, sensor.pin, period, **extra)
+
+
+class CounterRegistry:
+  # The counter sensors in use, and the thread which drains their counts
+  def __init__(self, sensors):
+    self.sensors = sensors
+    self.lock = threading.Lock()
+    self.armed = False
+    self.thread = None
+
+  def arm(self):
+    # Attach the interrupts for any sensors which don't have one
+    ## The firmware keeps interrupts attached between runs, but loses them
+    ## if the GrovePi resets, so check which are active first
+    with grovepi.bus_lock:
+      active = grovepi.get_active_interrupts()
+      for sensor in self.sensors:
+        if sensor.pin not in active:
+          logger.info(f"Attaching interrupt on pin D{sensor.pin} for {sensor.name}")
+          sensor.arm()
+    self.armed = True
+
+  def drain(self, sensors):
+    # Read the count for the last period from each of the sensors
+    batch = grovepi.CommandBatch()
+    for sensor in sensors:
+      batch.add(grovepi.isr_read_cmd + [sensor.pin, grovepi.unused, grovepi.unused],
+                no_bytes=4, identified=True,
+                decode=lambda data: data[0] + (data[1] << 8) + (data[2] << 16) + (data[3] << 24))
+    return batch.execute()
+
+  def run(self, stop_event):
+    # Drain each sensor's count once per period until stop_event is set
+    while not stop_event.is_set():
+      now = time.monotonic()
+      due = [sensor for sensor in self.sensors if sensor.next_drain <= now]
+      if due:
+        try:
+          counts = self.drain(due)
+          with self.lock:
+            for sensor, count in zip(due, counts):
+              sensor.counts.append(count)
+        except:
+          logger.error("Error reading counter sensors")
+        for sensor in due:
+          sensor.next_drain = now + sensor.period / 1000
+      stop_event.wait(max(0, min(sensor.next_drain for sensor in self.sensors) - time.monotonic()))
+
+  def start(self, stop_event):
+    # Start draining the counts on a background thread
+    try:
+      self.arm()
+    except:
+      ## collect() tries again with the next reading
+      logger.error("Error attaching interrupts for counter sensors")
+    ## Wait a full period before the first drain, so the first count read
+    ## isn't from before the interrupt was attached
+    for sensor in self.sensors:
+      sensor.next_drain = time.monotonic() + sensor.period / 1000
+    self.thread = threading.Thread(target=self.run, args=(stop_event,),
+                                   name="counters", daemon=True)
+    self.thread.start()
+
+  def collect(self):
+    # Return the readings of each sensor since the last call, as {name: readings}
+    ## If nothing has been drained yet (e.g. when run once per reading), the
+    ## count for the last period is read now
+    if not self.armed:
+      self.arm()
+    with self.lock:
+      drained = {sensor.name: sensor.counts for sensor in self.sensors}
+      for sensor in self.sensors:
+        sensor.counts = []
+    undrained = [sensor for sensor in self.sensors if not drained[sensor.name]]
+    if undrained:
+      for sensor, count in zip(undrained, self.drain(undrained)):
+        drained[sensor.name] = [count]
+    return {sensor.name: sensor.readings(drained[sensor.name]) for sensor in self.sensors}
@@ -6,33 +6,62 @@
 ## Please note that this script is not intended to be a enterprise-grade
 ## production-ready implementation of the AWS SDKs, and is instead intended
 ## as a easy to use example for learning purposes.
+##
+## The script can be run in two ways:
+##   data_capture.py [verbose]
+##     Take a single reading, send it and exit (e.g. from cron)
+##   data_capture.py [verbose] --daemon [--interval SECONDS]
+##     Keep running, taking a reading every sample interval and reusing a
+##     single MQTT connection to AWS IoT Core for all of them
 
 # Import the required modules
-import sys
-import seeed_si114x
+## The AWS IoT SDK, requests and the sunlight sensor module are slow to import
+## on a Raspberry Pi, so they are only imported where they are first used.
+## This lets a run start taking readings sooner.
 import time
 import signal
 import grovepi
-import requests
 import json
+import copy
 from datetime import datetime
 import configparser
-from awscrt import io, mqtt, auth, http
-from awsiot import mqtt_connection_builder
-import boto3
+import argparse
+import threading
+import subprocess
+import concurrent.futures
 import os
 import logging
+from reading_queue import ReadingQueue
+from image_uploader import ImageUploader
+from reporting import ChangeReporter
+from anomaly_detection import AnomalyDetector
+from scheduler import Scheduler
+import counter_sensors
+import image_encoding
+import payload_codec
+import readings_schema
+import reading_cache
+import metrics
+
+# Parse the command line arguments
+## 'verbose' is kept as a bare positional argument so existing cron entries
+## continue to work unchanged
+parser = argparse.ArgumentParser(description="SucculentPi data capture")
+parser.add_argument("verbose", nargs="?", choices=["verbose"],
+                    help="Enable debug logging")
+parser.add_argument("--daemon", action="store_true",
+                    help="Run continuously, reusing one MQTT connection")
+parser.add_argument("--interval", type=int,
+                    help="Seconds between readings in daemon mode")
+args = parser.parse_args()
 
 # Create and configure the logger
 ## This will be used throughout the code to log status messages
 logging.basicConfig(filename="data_capture.log",
                     format='%(asctime)s %(message)s')
 logger = logging.getLogger()
-if len(sys.argv) > 1:
-  if sys.argv[1] == "verbose":
-    logger.setLevel(logging.DEBUG)
-  else:
-    logger.setLevel(logging.INFO)
+if args.verbose == "verbose":
+  logger.setLevel(logging.DEBUG)
 else:
   logger.setLevel(logging.INFO)
 
@@ -54,187 +83,948 @@ aws_access_key = config['AWS_S3_IMAGES']['access_key']
 aws_secret_key = config['AWS_S3_IMAGES']['secret_key']
 s3_upload_path = config['AWS_S3_IMAGES']['s3_upload_path']
 s3_bucket = config['AWS_S3_IMAGES']['s3_bucket_name']
+s3_region = config.get('AWS_S3_IMAGES', 's3_region', fallback="eu-central-1")
+image_spool_dir = config.get('AWS_S3_IMAGES', 'spool_dir', fallback="image_spool")
+upload_drain_timeout = config.getint('AWS_S3_IMAGES', 'upload_drain_timeout', fallback=60)
+upload_max_backoff = config.getint('AWS_S3_IMAGES', 'upload_max_backoff', fallback=300)
+multipart_threshold = config.getint('AWS_S3_IMAGES', 'multipart_threshold', fallback=8)
+upload_max_concurrency = config.getint('AWS_S3_IMAGES', 'max_concurrency', fallback=4)
 awair_api_url = config['AWAIR']['local_api_url']
-timestamp = datetime.now().strftime('%Y-%m-%d-%H%M%S')
+## The settings below are optional so that existing config.ini files, which
+## pre-date them, still work
+sample_interval = config.getint('DAEMON', 'sample_interval', fallback=300)
+reconnect_min_backoff = config.getint('DAEMON', 'reconnect_min_backoff', fallback=1)
+reconnect_max_backoff = config.getint('DAEMON', 'reconnect_max_backoff', fallback=128)
+if args.interval:
+  sample_interval = args.interval
+queue_path = config.get('QUEUE', 'path', fallback="reading_queue.db")
+queue_max_readings = config.getint('QUEUE', 'max_readings', fallback=10000)
+queue_sync_batch = config.getint('QUEUE', 'sync_batch', fallback=10)
+queue_drain_batch = config.getint('QUEUE', 'drain_batch', fallback=50)
+publish_timeout = config.getint('QUEUE', 'publish_timeout', fallback=10)
+image_format = config.get('CAMERA', 'format', fallback="png")
+image_quality = config.getint('CAMERA', 'quality', fallback=85)
+image_width = config.getint('CAMERA', 'width', fallback=0)
+image_height = config.getint('CAMERA', 'height', fallback=0)
+image_roi = config.get('CAMERA', 'roi', fallback="")
+dedup_threshold = config.getint('CAMERA', 'dedup_threshold', fallback=0)
+batch_size = config.getint('PUBLISHING', 'batch_size', fallback=1)
+batch_window = config.getint('PUBLISHING', 'batch_window', fallback=60)
+batch_max_bytes = config.getint('PUBLISHING', 'batch_max_bytes', fallback=120000)
+batch_topic = config.get('PUBLISHING', 'batch_topic', fallback=f"{topic}/batch")
+payload_format = config.get('PUBLISHING', 'payload_format', fallback="json")
+payload_layout = config.get('PUBLISHING', 'payload_layout', fallback="nested")
+encoded_topic = config.get('PUBLISHING', 'encoded_topic', fallback=f"{topic}/encoded")
+bus_lock_file = config.get('GROVEPI', 'bus_lock_file', fallback="")
+adaptive_timing = config.getboolean('GROVEPI', 'adaptive_timing', fallback=False)
+i2c_write_retries = config.getint('GROVEPI', 'write_retries', fallback=3)
+i2c_read_retries = config.getint('GROVEPI', 'read_retries', fallback=3)
+i2c_response_retries = config.getint('GROVEPI', 'response_retries', fallback=10)
+grove_timeout = config.getint('CAPTURE', 'grove_timeout', fallback=10)
+awair_timeout = config.getint('CAPTURE', 'awair_timeout', fallback=10)
+camera_timeout = config.getint('CAPTURE', 'camera_timeout', fallback=60)
+moisture_samples = config.getint('CAPTURE', 'moisture_samples', fallback=1)
+moisture_outlier_threshold = config.getfloat('CAPTURE', 'moisture_outlier_threshold', fallback=2)
+reporting_state_path = config.get('REPORTING', 'state_path', fallback="reporting_state.json")
+## The alerter reports a measure as missing if it has no data within its
+## window. A field's heartbeat is checked when a reading is filtered, so one
+## which just misses it waits a sample interval longer, and capture times vary
+## from reading to reading; the heartbeat must be shorter than the window by a
+## sample interval, and some slack, for steady sensors not to be reported
+## missing.
+reporting_alert_window = config.getint('REPORTING', 'alert_window', fallback=300)
+reporting_heartbeat_slack = config.getint('REPORTING', 'heartbeat_slack', fallback=60)
+reporting_heartbeat_limit = max(0, reporting_alert_window - sample_interval - reporting_heartbeat_slack)
+reporting_heartbeat = config.getint('REPORTING', 'heartbeat', fallback=reporting_heartbeat_limit)
+reporting_window = config.getint('REPORTING', 'window', fallback=1)
+## The smallest change worth sending for each field, by Timestream measure name
+deadbands = {measure_name: float(deadband) for measure_name, deadband in config.items('DEADBANDS')} \
+  if config.has_section('DEADBANDS') else {}
+awair_connect_timeout = config.getfloat('AWAIR', 'connect_timeout', fallback=3)
+awair_read_timeout = config.getfloat('AWAIR', 'read_timeout', fallback=5)
+## Long enough to cover one missed poll in daemon mode, but not to carry
+## readings over from one run to the next when run once per reading
+awair_cache_ttl = config.getint('AWAIR', 'cache_ttl', fallback=120)
+awair_cache_path = config.get('AWAIR', 'cache_path', fallback="awair_cache.json")
+awair_poll_interval = config.getint('AWAIR', 'poll_interval', fallback=60)
+sensor_map_path = config.get('SENSORS', 'map', fallback="")
+## Seconds between readings of each sensor group in daemon mode, if not
+## sample_interval
+schedule_intervals = {group: config.getint('SCHEDULE', group)
+                      for group in ["moisture", "light", "awair", "camera", "counters"]
+                      if config.get('SCHEDULE', group, fallback="")}
+schedule_jitter = config.getfloat('SCHEDULE', 'jitter', fallback=0)
+## Largest random delay for each sensor group, e.g. camera_jitter, if not jitter
+schedule_jitters = {group: config.getfloat('SCHEDULE', f"{group}_jitter")
+                    for group in ["moisture", "light", "awair", "camera", "counters"]
+                    if config.get('SCHEDULE', f"{group}_jitter", fallback="")}
+anomaly_detection = config.getboolean('ANOMALIES', 'enabled', fallback=False)
+anomaly_state_path = config.get('ANOMALIES', 'state_path', fallback="anomaly_state.json")
+anomaly_alpha = config.getfloat('ANOMALIES', 'alpha', fallback=0.1)
+anomaly_warmup = config.getint('ANOMALIES', 'warmup', fallback=20)
+anomaly_min_stddev = config.getfloat('ANOMALIES', 'min_stddev', fallback=1.0)
+## Fields scoring at least this far from their usual values are sent even if
+## they haven't changed by their deadband
+anomaly_threshold = config.getfloat('ANOMALIES', 'threshold', fallback=3)
+## Fields scoring at least this far from their usual values are also sent
+## straight away on priority_topic; 0 sends none
+anomaly_urgent_score = config.getfloat('ANOMALIES', 'urgent_score', fallback=0)
+anomaly_priority_topic = config.get('ANOMALIES', 'priority_topic', fallback=f"{topic}/anomaly")
+## Recent readings are kept on the Pi in daemon mode if a cache path is given
+cache_path = config.get('CACHE', 'path', fallback="")
+cache_capacity = config.getint('CACHE', 'capacity', fallback=10080)
+cache_port = config.getint('CACHE', 'port', fallback=0)
+cache_socket = config.get('CACHE', 'socket', fallback="")
+metrics_file = config.get('METRICS', 'file', fallback="")
+metrics_port = config.getint('METRICS', 'port', fallback=0)
+metrics_diag = config.getboolean('METRICS', 'diag', fallback=False)
+## Options of the counter sensors in the sensor map, each in a section named
+## after the sensor's measure name, e.g. [COUNTER garden_env_water_flow]
+counter_sensor_options = {section[len("COUNTER "):]: dict(config.items(section))
+                          for section in config.sections() if section.startswith("COUNTER ")}
+
+# Set when SIGTERM or SIGINT is received in daemon mode, to end the main loop
+shutdown_event = threading.Event()
+
+# Set while the MQTT connection to AWS IoT Core is up
+mqtt_connected = threading.Event()
+
+# Whether the MQTT connection has been opened, and so needs closing on exit
+mqtt_session_open = False
+
+# Serialises sending readings, so that queued readings are always sent
+# before newer ones
+send_lock = threading.RLock()
+
+# When the last batch of readings was sent, in batching mode
+last_batch_sent = time.monotonic()
+
+# The sunlight sensor instance is created on first use and then reused
+sunlight_sensor = None
+
+# HTTP session for the Awair local API, created on first use so that the
+# connection to the Awair is kept open and reused between readings
+awair_session = None
+
+# The last good readings from the Awair, as (epoch seconds, readings), and
+# whether it is being polled by its own thread (in daemon mode)
+awair_cache = None
+awair_lock = threading.Lock()
+awair_polling = False
+awair_polled = threading.Event()
+
+# Thread pool used to run the acquisition stages concurrently
+## Sized to allow for each stage overrunning into the next reading
+stage_executor = concurrent.futures.ThreadPoolExecutor(max_workers=6,
+                                                       thread_name_prefix="stage")
+
+
+def on_connection_interrupted(connection, error, **kwargs):
+  # Callback for when the MQTT connection to AWS IoT Core drops
+  ## The AWS CRT will automatically try to reconnect, backing off between
+  ## reconnect_min_backoff and reconnect_max_backoff seconds
+  logger.error(f"MQTT connection interrupted: {error}")
+  mqtt_connected.clear()
 
+def on_connection_resumed(connection, return_code, session_present, **kwargs):
+  # Callback for when the MQTT connection to AWS IoT Core is re-established
+  logger.info(f"MQTT connection resumed with return code {return_code}, session present {session_present}")
+  from awscrt import mqtt
+  if return_code != mqtt.ConnectReturnCode.ACCEPTED:
+    return
+  mqtt_connected.set()
+  ## If the broker didn't keep our session, any subscriptions were lost with
+  ## it and need to be made again
+  if not session_present:
+    logger.info("Session was not persisted; resubscribing to existing topics")
+    try:
+      resubscribe_future, _ = connection.resubscribe_existing_topics()
+      resubscribe_future.add_done_callback(on_resubscribe_complete)
+    except:
+      logger.error("Error resubscribing to existing topics")
+  ## Send anything queued while the connection was down. This can't be done
+  ## on the AWS CRT's own thread, as it has to wait for the publishes to be
+  ## acknowledged.
+  if len(reading_queue):
+    threading.Thread(target=send_queued_readings, daemon=True).start()
 
-def close_mqtt():
+def on_resubscribe_complete(resubscribe_future):
+  # Callback to log the outcome of a resubscribe
+  try:
+    resubscribe_results = resubscribe_future.result()
+    for resubscribe_topic, qos in resubscribe_results['topics']:
+      if qos is None:
+        logger.error(f"Server rejected resubscribe to topic {resubscribe_topic}")
+  except:
+    logger.error("Error resubscribing to existing topics")
+
+def build_mqtt_connection():
+  # Function to define a MQTT connection to AWS IoT Core over mTLS
+  global mqtt_connection
+  from awscrt import io
+  from awsiot import mqtt_connection_builder
+  event_loop_group = io.EventLoopGroup(1)
+  host_resolver = io.DefaultHostResolver(event_loop_group)
+  client_bootstrap = io.ClientBootstrap(event_loop_group, host_resolver)
+  mqtt_connection = mqtt_connection_builder.mtls_from_path(
+    endpoint=mqtt_endpoint,
+    cert_filepath=mqtt_certificate,
+    pri_key_filepath=mqtt_private_key,
+    client_bootstrap=client_bootstrap,
+    ca_filepath=mqtt_root_ca,
+    client_id=mqtt_client_id,
+    on_connection_interrupted=on_connection_interrupted,
+    on_connection_resumed=on_connection_resumed,
+    reconnect_min_timeout_secs=reconnect_min_backoff,
+    reconnect_max_timeout_secs=reconnect_max_backoff,
+    clean_session=False,
+    keep_alive_secs=6
+  )
+
+def connect_mqtt(retry=False):
+  # Function to open the MQTT connection to AWS IoT Core
+  ## When 'retry' is set, keep trying with an exponential backoff until the
+  ## connection succeeds or a shutdown is requested. Returns True if the
+  ## connection was established.
+  global mqtt_session_open
+  backoff = reconnect_min_backoff
+  while True:
+    try:
+      if mqtt_connection is None:
+        build_mqtt_connection()
+      logger.info(f"Connecting to MQTT endpoint {mqtt_endpoint} with client ID {mqtt_client_id}")
+      connect_future = mqtt_connection.connect()
+      connect_future.result()
+      logger.info(f"Successfully established MQTT connection to {mqtt_endpoint} with client ID {mqtt_client_id}")
+      mqtt_session_open = True
+      mqtt_connected.set()
+      return True
+    except:
+      logger.error("MQTT connection failed")
+      if not retry:
+        return False
+    logger.info(f"Retrying MQTT connection in {backoff} seconds")
+    if shutdown_event.wait(backoff):
+      return False
+    backoff = min(backoff * 2, reconnect_max_backoff)
+
+def shutdown():
   # Function to terminate the MQTT connection with AWS IoT Core
-  ## One way in which this script is not production-grade is the lack of 
-  ## (re)connection management and connection reuse. Opening a new connection 
-  ## for each run of the script is not the most efficent approach!
+  ## Used both at the end of a single run and when the daemon is asked to
+  ## stop by SIGTERM or SIGINT
+
+  ## Commit anything still waiting in the reading queue, once any send in
+  ## progress has finished with it
+  with send_lock:
+    reading_queue.close()
+
+  ## Nothing to close if we never managed to connect
+  if not mqtt_session_open:
+    return
 
   ## Use a simple 'try' block to catch any exceptions which may occur
   try:
+    mqtt_connected.clear()
     logger.info(f"Closing MQTT connection to {mqtt_endpoint} with client ID {mqtt_client_id}")
     disconnect_future = mqtt_connection.disconnect()
     disconnect_future.result()
   except:
     logger.error("Error closing MQTT disconnection")
 
-def awair_sensors_null():
+def handle_shutdown_signal(signum, frame):
+  # Signal handler for SIGTERM and SIGINT in daemon mode
+  ## Only flag the shutdown here; the main loop finishes the reading it is
+  ## working on and then disconnects cleanly
+  logger.info(f"Received signal {signal.Signals(signum).name}; shutting down")
+  shutdown_event.set()
+
+def null_readings(*sensor_types):
+  # Function to set the values of every field from the given types of sensor to null
+  readings = {}
+  for sensor in readings_schema.sensors_of_type(readings_schema.sensors, *sensor_types):
+    if sensor.sensor_type in readings_schema.counter_readings:
+      for reading in readings_schema.counter_readings[sensor.sensor_type]:
+        readings_schema.set_field(readings, readings_schema.counter_path(sensor, reading), None)
+    else:
+      readings_schema.set_field(readings, sensor.path, None)
+  return readings
+
+def grove_sensors_null(groups):
+  # Function to set the values for all readings from the Grove sensors to null
+  logger.debug("Setting Grove readings to null")
+  return null_readings(*group_sensor_types(groups))
+
+def awair_sensors_null(groups):
   # Function to set the values for all readings from an Awair device to null
   logger.debug("Setting Awair readings to null")
-  data_dict['room']['env']['dew_point'] = None
-  data_dict['room']['env']['temp'] = None
-  data_dict['room']['env']['rel_humid'] = None
-  data_dict['room']['env']['abs_humid'] = None
-  data_dict['room']['env']['co2'] = None
-  data_dict['room']['env']['voc_total'] = None
-  data_dict['room']['env']['voc_h2'] = None
-  data_dict['room']['env']['voc_ethanol'] = None
-  data_dict['room']['env']['pm25'] = None
-
-# Define a MQTT connection to AWS IoT Core over mTLS
-event_loop_group = io.EventLoopGroup(1)
-host_resolver = io.DefaultHostResolver(event_loop_group)
-client_bootstrap = io.ClientBootstrap(event_loop_group, host_resolver)
-mqtt_connection = mqtt_connection_builder.mtls_from_path(
-  endpoint=mqtt_endpoint,
-  cert_filepath=mqtt_certificate,
-  pri_key_filepath=mqtt_private_key,
-  client_bootstrap=client_bootstrap,
-  ca_filepath=mqtt_root_ca,
-  client_id=mqtt_client_id,
-  clean_session=False,
-  keep_alive_secs=6
-)
-
-# Attempt to open an MQTT connection to AWS IoT Core
-## In the event this fails for any reason terminate the script as there's no
-## point in collecting sensor data if we can't send it.
-## This is one area where this script is not production-grade; it does not
-## provide for local storage and delayed transmission of captured data
-try:
-  logger.info(f"Connecting to MQTT endpoint {mqtt_endpoint} with client ID {mqtt_client_id}")
-  connect_future = mqtt_connection.connect()
-  connect_future.result()
-  logger.info(f"Successfully established MQTT connection to {mqtt_endpoint} with client ID {mqtt_client_id}")
-except:
-  logger.error("MQTT connection failed")
-  quit()
-
-# Create an empty Python dictionary to store our readings
-## This reflects the structure of the JSON object which will be sent via MQTT
-data_dict = {
-    "timestamp": timestamp,
-    "plant": {
-      "pot": {
-        "soil": {}
-      },
-      "env": {},
-      "images": {}
-    },
-    "room" :{
-      "env": {}
-    }
-  }
-
-# Attempt to read the GrovePi+ sensors and add those readings to the dictionary
-try:
-  logger.debug("Attempting to read Grove sensors")
+  return null_readings("awair")
+
+def camera_null(groups):
+  # Function to set the image URL to null
+  logger.debug("Setting camera image URL to null")
+  return null_readings("camera")
+
+def read_sunlight(key):
+  # Function to read one of the sunlight sensor's values
+  if key == "visible":
+    return sunlight_sensor.ReadVisible
+  if key == "uv":
+    # The seeed_si114x module states that to obtain the correct value, the
+    # return from the .ReadUV function must be divided by 100.
+    return sunlight_sensor.ReadUV/100
+  return sunlight_sensor.ReadIR
+
+def read_grove_sensors(timestamp, groups):
+  # Function to read the GrovePi+ sensors in the sensor map
+  ## Only the sensors in the groups which are due are read. When both are
+  ## due, they're read one after the other while holding the bus lock once.
+  global sunlight_sensor
+  logger.debug(f"Attempting to read Grove sensors: {', '.join(sorted(groups))}")
+  analog_sensors = readings_schema.sensors_of_type(readings_schema.sensors, *group_sensor_types(groups & {"moisture"}))
+  light_sensors = readings_schema.sensors_of_type(readings_schema.sensors, *group_sensor_types(groups & {"light"}))
 
   # Create an instance of the class needed to read the sunlight sensor
-  sunlight_sensor = seeed_si114x.grove_si114x()
-
-  # Moisture sensor values reference table, for ease of future use:
-  ## Min  Typ  Max  Condition
-  ## ---  ---  ---  ---------
-  ## 0    0    0    sensor in open air
-  ## 0    20   300  sensor in dry soil
-  ## 300  580  700  sensor in humid soil
-  ## 700  940  950  sensor in water
-
-  data_dict['plant']['pot']['soil']['moisture_top_a0'] = grovepi.analogRead(0)
-  data_dict['plant']['pot']['soil']['moisture_middle_a1'] = grovepi.analogRead(1)
-  data_dict['plant']['pot']['soil']['moisture_bottom_a2'] = grovepi.analogRead(2)
-  data_dict['plant']['env']['visible_light'] = sunlight_sensor.ReadVisible
-  # The seeed_si114x module states that to obtain the correct value, the return
-  # from the .ReadUV function must be divided by 100.
-  data_dict['plant']['env']['uv_light'] = sunlight_sensor.ReadUV/100
-  data_dict['plant']['env']['ir_light'] = sunlight_sensor.ReadIR
-except:
-  # If we failed to read any of the sensors, assume all the values are faulty
-  # and return null readings.
-  logger.error("Error reading Grove sensors; setting sensor readings to null")
-  data_dict['plant']['pot']['soil']['moisture_top_a0'] = None
-  data_dict['plant']['pot']['soil']['moisture_middle_a1'] = None
-  data_dict['plant']['pot']['soil']['moisture_bottom_a2'] = None
-  data_dict['plant']['env']['visible_light'] = None
-  data_dict['plant']['env']['uv_light'] = None
-  data_dict['plant']['env']['ir_light'] = None
-
-# Attempt to read the Awair device's local API
-try:
+  if light_sensors and sunlight_sensor is None:
+    import seeed_si114x
+    with grovepi.bus_lock:
+      sunlight_sensor = seeed_si114x.grove_si114x()
+
+  ## The sunlight sensor shares the I2C bus with the GrovePi, so hold the
+  ## GrovePi's bus lock while reading it too
+  readings = {}
+  with grovepi.bus_lock:
+    with metrics.timer("grove_moisture"):
+      ## The analog pins of every pot are read together, in one batch
+      pins = list(dict.fromkeys(sensor.pin for sensor in analog_sensors))
+      if moisture_samples > 1:
+        values = read_analog_oversampled(pins)
+      else:
+        values = {pin: (value, None) for pin, value in zip(pins, grovepi.analogReadMany(pins))}
+      for sensor in analog_sensors:
+        value, statistics = values[sensor.pin]
+        readings_schema.set_field(readings, sensor.path, value)
+        if statistics and sensor.sensor_type == "moisture":
+          for statistic, statistic_value in statistics.items():
+            readings_schema.set_field(readings, readings_schema.statistics_path(sensor, statistic),
+                                      statistic_value)
+    with metrics.timer("grove_si114x"):
+      for sensor in light_sensors:
+        readings_schema.set_field(readings, sensor.path, read_sunlight(sensor.key))
+  return readings
+
+def read_analog_oversampled(pins):
+  # Function to read each analog pin several times and filter the samples
+  ## Returns {pin: (value, statistics of the samples)}
+  import numpy
+  logger.debug(f"Taking {moisture_samples} samples from each analog pin")
+  if not pins:
+    return {}
+
+  ## Read the pins in turn, round robin, in a single batch on the bus, so
+  ## that each pin's samples are spread over the time the batch takes
+  samples = numpy.array(grovepi.analogReadMany(pins * moisture_samples))
+  samples = samples.reshape(moisture_samples, len(pins))
+
+  values = {}
+  for index, pin in enumerate(pins):
+    pin_samples = samples[:, index]
+    kept = grovepi.statisticalNoiseReductionArray(pin_samples, moisture_outlier_threshold)
+    ## A threshold below 1 can reject every sample, in which case use them all
+    if kept.size == 0:
+      kept = pin_samples
+    ## The reading itself stays a whole number, as it is without oversampling
+    values[pin] = (int(round(kept.mean())), {
+      "median": float(numpy.median(kept)),
+      "mean": round(float(kept.mean()), 2),
+      "stddev": round(float(kept.std()), 2),
+      "samples": int(kept.size),
+      "rejected": int(pin_samples.size - kept.size)
+    })
+  return values
+
+def fetch_awair():
+  # Function to read the Awair device's local API
+  ## Returns the Awair's readings, or None if the Awair returned no data. Good
+  ## readings are cached, to fall back on if a later request returns nothing.
+  global awair_session, awair_cache
+  if awair_session is None:
+    import requests
+    awair_session = requests.Session()
+    ## One kept-alive connection to the Awair is all that is needed
+    awair_session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1))
   logger.debug("Attempting to acquire data from the Awair API")
-  awair_raw = requests.get(awair_api_url)
+  with metrics.timer("awair_api"):
+    awair_raw = awair_session.get(awair_api_url, timeout=(awair_connect_timeout, awair_read_timeout))
 
   # Check if the Awair Local API returned content
   ## NB: Sometimes it returns HTTP200 with no content
-  if awair_raw.text:
-    awair_json = json.loads(awair_raw.text)
-    # Dew point in ºC
-    data_dict['room']['env']['dew_point'] = awair_json['dew_point']
-    # Temperature in ºC
-    data_dict['room']['env']['temp'] = awair_json['temp']
-    # Relative humidity in %
-    data_dict['room']['env']['rel_humid'] = awair_json['humid']
-    # Absolute humidity in g/m³
-    data_dict['room']['env']['abs_humid'] = awair_json['abs_humid']
-    # CO2 in ppm
-    data_dict['room']['env']['co2'] = awair_json['co2']
-    # Total VOCs in ppb
-    data_dict['room']['env']['voc_total'] = awair_json['voc']
-    # Hydrogen sensor signal (unitless)
-    data_dict['room']['env']['voc_h2'] = awair_json['voc_h2_raw']
-    # Ethanol sensor signal (unitless)
-    data_dict['room']['env']['voc_ethanol'] = awair_json['voc_ethanol_raw']
-    # Particulates < 2.5 microns in size in µg/m³
-    data_dict['room']['env']['pm25'] = awair_json['pm25']
-  else:
-    # If the Awair local APi returned no data, set all readings to null
-    awair_sensors_null()
-except:
-  # If any errors occurred while trying to query the Awair local API,
-  # set all readings to null
-  logger.error("Error reading Awair API")
-  awair_sensors_null()
-  
-# Attempt to acquire an image using the IR camera
-try:
+  if not awair_raw.text:
+    return None
+
+  awair_json = json.loads(awair_raw.text)
+  readings = {}
+  for sensor in readings_schema.sensors_of_type(readings_schema.sensors, "awair"):
+    readings_schema.set_field(readings, sensor.path, awair_json[sensor.key])
+  with awair_lock:
+    awair_cache = (time.time(), readings)
+  ## When run once per reading, keep the cache on disk for the next run
+  if not awair_polling:
+    save_awair_cache()
+  return readings
+
+def save_awair_cache():
+  # Function to write the Awair cache to disk
+  try:
+    with open(awair_cache_path, "w") as cache_file:
+      json.dump(awair_cache, cache_file)
+  except:
+    logger.error(f"Error saving the Awair cache to {awair_cache_path}")
+
+def load_awair_cache():
+  # Function to read the Awair cache written by an earlier run, if any
+  global awair_cache
+  try:
+    with open(awair_cache_path) as cache_file:
+      fetched, readings = json.load(cache_file)
+    awair_cache = (fetched, readings)
+  except FileNotFoundError:
+    pass
+  except:
+    logger.error(f"Error loading the Awair cache from {awair_cache_path}")
+
+def cached_awair(fresh_for=0):
+  # Function to return the cached Awair readings, if not older than cache_ttl
+  ## Readings older than 'fresh_for' seconds are flagged as stale
+  with awair_lock:
+    if awair_cache is None:
+      return None
+    fetched, readings = awair_cache
+  age = time.time() - fetched
+  if age > awair_cache_ttl:
+    return None
+  readings = copy.deepcopy(readings)
+  if age > fresh_for:
+    logger.info(f"Using the last good Awair readings, from {round(age)} seconds ago")
+    readings["awair"] = {"stale": True, "age": round(age)}
+  return readings
+
+def poll_awair():
+  # Function to poll the Awair every poll_interval seconds in daemon mode
+  ## This keeps the Awair's readings up to date independently of the sample
+  ## interval; each reading then uses the latest of them
+  while not shutdown_event.is_set():
+    try:
+      if fetch_awair() is None:
+        logger.error("The Awair API returned no data")
+    except:
+      logger.error("Error reading Awair API")
+    awair_polled.set()
+    shutdown_event.wait(awair_poll_interval)
+
+def read_awair(timestamp, groups):
+  # Function to get the Awair device's readings for a reading
+  ## If the Awair returns no data, or can't be reached, the last good readings
+  ## are used instead for up to cache_ttl seconds, flagged as stale
+  if awair_polling:
+    ## The first reading may be taken before the first poll has finished
+    awair_polled.wait(awair_timeout)
+    ## A poll which is late by more than a request's timeouts has failed
+    cached = cached_awair(awair_poll_interval + awair_connect_timeout + awair_read_timeout)
+    if cached is None:
+      raise RuntimeError("No recent readings from the Awair API")
+    return cached
+  try:
+    readings = fetch_awair()
+  except:
+    cached = cached_awair()
+    if cached is None:
+      raise
+    logger.error("Error reading Awair API")
+    return cached
+  if readings is None:
+    # If the Awair local API returned no data, fall back to the last good
+    # readings, or set all readings to null
+    return cached_awair() or awair_sensors_null(groups)
+  return readings
+
+def counters_null(groups):
+  # Function to set the readings of all counter sensors to null
+  logger.debug("Setting counter sensor readings to null")
+  return null_readings(*readings_schema.counter_readings)
+
+def read_counters(timestamp, groups):
+  # Function to read the counter sensors, e.g. flow meters and the dust sensor
+  logger.debug("Attempting to read counter sensors")
+  readings = {}
+  counter_readings = counter_registry.collect()
+  for sensor in readings_schema.sensors_of_type(readings_schema.sensors, *readings_schema.counter_readings):
+    for reading, value in counter_readings[sensor.measure_name].items():
+      readings_schema.set_field(readings, readings_schema.counter_path(sensor, reading), value)
+  return readings
+
+def capture_image(timestamp, groups):
+  # Function to acquire an image using the IR camera
+  ## The image is handed to the image uploader, which uploads it to S3 in the
+  ## background. Its URL is sent in a follow-up message once the upload has
+  ## been confirmed; see image_uploaded().
   logger.debug("Attempting to capture camera image")
-  # Due to the switch to libcamera in Raspberry Pi OS Bullseye, the Python 
-  # PiCamera module no longer works. Just make a system/CLI call instead
-  os.system(f"libcamera-still -e png -o /tmp/{timestamp}.png")
-  # Attempt to upload the image to S3
-  ## Another area where this script is not production-grade; no error checking
-  ## or resiliency measures for the upload.
-  s3 = boto3.client('s3', aws_access_key_id=aws_access_key, aws_secret_access_key=aws_secret_key)
-  temp = s3.upload_file(f"/tmp/{timestamp}.png", s3_bucket, f"{s3_upload_path}/{timestamp}.png")
-  # Add the S3 URL of the image to the dictionary
-  data_dict['plant']['images']['infrared'] = f"https://{s3_bucket}.s3.eu-central-1.amazonaws.com/{s3_upload_path}/{timestamp}.png"
-  # Delete the local copy of the image
-  os.system(f"rm -f /tmp/{timestamp}.png")
-except:
-  # If any errors occured while trying to acquire the image, set the
-  # image URL in the dictionary to null.
-  logger.error("Error capturing or uploading camera image")
-  data_dict['plant']['images']['infrared'] = None
-
-# Attempt to send the dictionary via the MQTT connection to AWS IoT Core
-try:
-  logger.info("Attempting to send data via MQTT connection")
-  # Convert the Python dictionary to a JSON object
-  data_json = json.dumps(data_dict, default=str)
-  logger.debug(f"Sending: {data_json}")
-  # Send the JSON object via the MQTT Connection
-  mqtt_connection.publish(topic=topic, payload=data_json, qos=mqtt.QoS.AT_LEAST_ONCE)
-  logger.info("Data sent successfully via MQTT connection")
-except:
-  # If any errors occurred, close the MQTT connection and terminate the script
-  logger.error("Error sending data via the MQTT connection")
-  close_mqtt()
-  quit()
-
-# If everything worked OK, close the MQTT connection
-close_mqtt()
\ No newline at end of file
+  file_name = f"{timestamp}.{image_encoding.file_extension(image_format)}"
+  image_path = image_uploader.capture_path(file_name)
+  capture_path = image_path
+  if image_format == "webp":
+    capture_path = image_uploader.capture_path(f"{timestamp}.png")
+  images = {"format": image_format}
+  try:
+    # Due to the switch to libcamera in Raspberry Pi OS Bullseye, the Python
+    # PiCamera module no longer works. Just make a system/CLI call instead
+    ## The call is made with a timeout, so that a hung camera doesn't leave a
+    ## stray process holding it once the stage has been given up on
+    with metrics.timer("camera_capture"):
+      subprocess.run(image_encoding.libcamera_command(capture_path, image_format, image_quality,
+                                                      image_width, image_height, image_roi),
+                     check=True, timeout=camera_timeout)
+    if capture_path != image_path:
+      with metrics.timer("camera_convert"):
+        image_encoding.convert_image(capture_path, image_path, image_format, image_quality)
+
+    # Skip uploading the image if it's nearly identical to the last one
+    if dedup_threshold and image_encoding.HAVE_PILLOW:
+      image_hash = image_encoding.image_hash(image_path)
+      last_hash = image_encoding.load_hash(image_hash_path)
+      if last_hash is not None and image_encoding.hash_distance(image_hash, last_hash) <= dedup_threshold:
+        logger.info("Camera image is unchanged since the last upload; skipping upload")
+        os.remove(image_path)
+        images["dedup"] = "skipped"
+        return camera_readings(images)
+      image_encoding.save_hash(image_hash_path, image_hash)
+      images["dedup"] = "uploaded"
+  except:
+    # Don't leave a partly written image behind
+    for path in (capture_path, image_path):
+      if os.path.exists(path):
+        os.remove(path)
+    raise
+  image_uploader.spool(file_name)
+  return camera_readings(images)
+
+def camera_readings(images):
+  # Function to place the details of a camera image alongside the image's field
+  readings = {}
+  camera = readings_schema.sensors_of_type(readings_schema.sensors, "camera")[0]
+  for key, value in images.items():
+    readings_schema.set_field(readings, f"{camera.path.rsplit('.', 1)[0]}.{key}", value)
+  return readings
+
+def image_uploaded(timestamp, url):
+  # Callback from the image uploader once an image is in S3
+  ## Send the image's URL with the timestamp of the reading it was taken
+  ## with. The message only contains the image, so the routing rule only
+  ## writes that one measure for it.
+  readings = {"timestamp": timestamp}
+  camera = readings_schema.sensors_of_type(readings_schema.sensors, "camera")[0]
+  readings_schema.set_field(readings, camera.path, url)
+  send_readings(readings)
+
+# The groups of sensors which can each be read at their own interval in
+# daemon mode, and the types of sensor in the sensor map belonging to each
+sensor_groups = {
+  "moisture": ("moisture", "analog"),
+  "light": ("si114x",),
+  "awair": ("awair",),
+  "camera": ("camera",),
+  "counters": tuple(readings_schema.counter_readings),
+}
+
+def group_sensor_types(groups):
+  # Function to list the types of sensor in the given groups
+  return [sensor_type for group in groups for sensor_type in sensor_groups[group]]
+
+# The acquisition stages making up each reading
+## Each stage runs concurrently with the others and returns its part of the
+## readings dictionary. A stage which fails, or doesn't finish within its
+## deadline, has its readings set to null by its null function instead.
+## Stages are passed the groups they read which are due, and are only run
+## when at least one of them is.
+## Columns: name, function, null function, deadline in seconds, error
+## message, sensor groups
+capture_stages = [
+  ("grove", read_grove_sensors, grove_sensors_null, grove_timeout,
+   "Error reading Grove sensors; setting sensor readings to null", {"moisture", "light"}),
+  ("awair", read_awair, awair_sensors_null, awair_timeout,
+   "Error reading Awair API", {"awair"}),
+  ("camera", capture_image, camera_null, camera_timeout,
+   "Error capturing camera image", {"camera"}),
+  ("counters", read_counters, counters_null, grove_timeout,
+   "Error reading counter sensors; setting their readings to null", {"counters"}),
+]
+
+# Futures for stages which are still running from an earlier reading
+## A stage which overran its deadline keeps running in the background. It is
+## not started again until it has finished, so that e.g. two Grove reads never
+## use the I2C bus at the same time.
+stages_in_progress = {}
+
+def merge_readings(data_dict, readings):
+  # Function to merge a stage's part of the readings into the dictionary
+  for key, value in readings.items():
+    if isinstance(value, dict):
+      merge_readings(data_dict.setdefault(key, {}), value)
+    else:
+      data_dict[key] = value
+
+def run_stage(name, stage, timestamp, groups):
+  # Function to run an acquisition stage, recording how long it takes
+  with metrics.timer(f"stage_{name}"):
+    return stage(timestamp, groups)
+
+def capture_readings(groups=None):
+  # Function to read the sensors and the camera
+  ## Returns a Python dictionary which reflects the structure of the JSON
+  ## object which will be sent via MQTT. The stages are run concurrently, so a
+  ## reading takes as long as the slowest stage rather than the sum of them.
+  ## Only the sensor groups in 'groups' are read, or all of them if None.
+  timestamp = datetime.now().strftime('%Y-%m-%d-%H%M%S')
+
+  # Create a Python dictionary to store our readings
+  data_dict = {"timestamp": timestamp}
+
+  # Start each stage which isn't still busy with an earlier reading
+  cycle_start = time.monotonic()
+  started = {}
+  due = {}
+  for name, stage, _, _, _, stage_groups in capture_stages:
+    due[name] = stage_groups if groups is None else stage_groups & groups
+    if not due[name]:
+      continue
+    if name in stages_in_progress and not stages_in_progress[name].done():
+      logger.error(f"The {name} stage is still running from an earlier reading")
+      continue
+    started[name] = stages_in_progress[name] = stage_executor.submit(run_stage, name, stage,
+                                                                     timestamp, due[name])
+
+  # Collect each stage's readings, or null them if it failed or overran
+  for name, _, stage_null, deadline, error_message, _ in capture_stages:
+    if not due[name]:
+      continue
+    try:
+      future = started[name]
+      remaining = max(0, deadline - (time.monotonic() - cycle_start))
+      merge_readings(data_dict, future.result(timeout=remaining))
+    except concurrent.futures.TimeoutError:
+      logger.error(f"The {name} stage did not finish within {deadline} seconds")
+      logger.error(error_message)
+      merge_readings(data_dict, stage_null(due[name]))
+    except:
+      logger.error(error_message)
+      merge_readings(data_dict, stage_null(due[name]))
+
+  metrics.observe("capture", time.monotonic() - cycle_start)
+  return data_dict
+
+def batch_payloads(readings):
+  # Function to pack a list of readings into as few batch messages as possible
+  ## Each message is a JSON object holding an array of readings, and is kept
+  ## under batch_max_bytes so that it fits within the AWS IoT Core limit of
+  ## 128 KB per message. Each reading is only converted to JSON once.
+  envelope_start = '{"client_id": ' + json.dumps(mqtt_client_id) + ', "readings": ['
+  envelope_end = ']}'
+  payloads = []
+  batch = []
+  batch_bytes = len(envelope_start) + len(envelope_end)
+  for data_dict in readings:
+    data_json = json.dumps(data_dict, default=str)
+    reading_bytes = len(data_json.encode()) + 2
+    if batch and batch_bytes + reading_bytes > batch_max_bytes:
+      payloads.append(envelope_start + ", ".join(batch) + envelope_end)
+      batch = []
+      batch_bytes = len(envelope_start) + len(envelope_end)
+    batch.append(data_json)
+    batch_bytes += reading_bytes
+  if batch:
+    payloads.append(envelope_start + ", ".join(batch) + envelope_end)
+  return payloads
+
+def publish_readings(readings):
+  # Function to send a list of readings via the MQTT connection to AWS IoT Core
+  ## All of the readings are published before waiting for any of them to be
+  ## acknowledged, so a backlog is sent in bulk rather than one round trip at
+  ## a time. Returns True if every reading was acknowledged.
+  ## With a compact payload format or layout, the readings are packed into
+  ## encoded messages on encoded_topic (see payload_codec.py). In batching
+  ## mode they are packed into batch messages on batch_topic. Otherwise each
+  ## one is sent as its own message on topic.
+  from awscrt import mqtt
+  try:
+    logger.info(f"Attempting to send {len(readings)} reading(s) via MQTT connection")
+    if payload_format != "json" or payload_layout == "flat":
+      messages = [(encoded_topic, payload) for payload in
+                  payload_codec.encode(readings, payload_format, mqtt_client_id, batch_max_bytes)]
+    elif batch_size > 1:
+      messages = [(batch_topic, payload) for payload in batch_payloads(readings)]
+    else:
+      # Convert the Python dictionaries to JSON objects
+      messages = [(topic, json.dumps(data_dict, default=str)) for data_dict in readings]
+    with metrics.timer("mqtt_publish"):
+      publish_futures = []
+      for message_topic, payload in messages:
+        logger.debug(f"Sending to {message_topic}: {payload}")
+        # Send the JSON object via the MQTT Connection
+        publish_future, _ = mqtt_connection.publish(topic=message_topic, payload=payload, qos=mqtt.QoS.AT_LEAST_ONCE)
+        publish_futures.append(publish_future)
+      for publish_future in publish_futures:
+        publish_future.result(publish_timeout)
+    logger.info(f"Data sent successfully via MQTT connection in {len(messages)} message(s)")
+    return True
+  except:
+    logger.error("Error sending data via the MQTT connection")
+    return False
+
+def send_queued_readings():
+  # Function to send the readings held in the reading queue, oldest first
+  ## Returns True once the queue is empty
+  global last_batch_sent
+  with send_lock:
+    while len(reading_queue):
+      if not mqtt_connected.is_set():
+        return False
+      queued = reading_queue.peek(max(queue_drain_batch, batch_size))
+      if not queued:
+        break
+      logger.info(f"Sending {len(queued)} of {len(reading_queue)} queued readings")
+      if not publish_readings([data_dict for _, data_dict in queued]):
+        return False
+      reading_queue.remove([row_id for row_id, _ in queued])
+    last_batch_sent = time.monotonic()
+    return True
+
+def publish_anomalies(data_dict, urgent):
+  # Function to send the fields of a reading which are far from their usual
+  # values on the priority topic, ahead of the reading itself
+  ## This is only tried once; if the connection is down, the scores still go
+  ## with the reading, via the queue
+  from awscrt import mqtt
+  if not mqtt_connected.is_set():
+    logger.error("Not connected; unable to send urgent anomalies on the priority topic")
+    return
+  paths = {measure_name: path for path, measure_name in readings_schema.fields}
+  payload = json.dumps({
+    "client_id": mqtt_client_id,
+    "timestamp": data_dict["timestamp"],
+    "anomalies": {measure_name: {"value": readings_schema.get_field(data_dict, paths[measure_name]),
+                                 "score": score}
+                  for measure_name, score in urgent.items()}
+  })
+  try:
+    logger.info(f"Sending {len(urgent)} urgent anomalies to {anomaly_priority_topic}")
+    publish_future, _ = mqtt_connection.publish(topic=anomaly_priority_topic, payload=payload,
+                                                qos=mqtt.QoS.AT_LEAST_ONCE)
+    publish_future.result(publish_timeout)
+  except:
+    logger.error("Error sending urgent anomalies via the MQTT connection")
+
+def tag_anomalies(data_dict):
+  # Function to add each field's anomaly score to a reading, under "anomaly"
+  ## Fields scoring at least anomaly_urgent_score are also sent at once
+  scores = anomaly_detector.score(data_dict)
+  if not scores:
+    return
+  data_dict["anomaly"] = scores
+  if anomaly_urgent_score:
+    urgent = {measure_name: score for measure_name, score in scores.items()
+              if abs(score) >= anomaly_urgent_score}
+    if urgent:
+      metrics.increment("anomalies_urgent", len(urgent))
+      publish_anomalies(data_dict, urgent)
+
+def send_readings(data_dict):
+  # Function to send a new reading, or queue it if it can't be sent now
+  ## Any queued readings are sent first so that they arrive in order
+  ## With anomaly detection, the reading is scored before anything is left
+  ## out of it. With change reporting, fields which haven't changed enough
+  ## are left out, unless they're anomalous, and if none have, nothing is
+  ## sent at all
+  if anomaly_detector:
+    tag_anomalies(data_dict)
+  if change_reporter:
+    anomalous = [measure_name for measure_name, score in data_dict.get("anomaly", {}).items()
+                 if abs(score) >= anomaly_threshold]
+    data_dict = change_reporter.filter(data_dict, always=anomalous)
+    if data_dict is None:
+      return
+  with send_lock:
+    if batch_size > 1 and args.daemon:
+      # In batching mode, every reading goes via the queue, and the queue is
+      # sent once it holds batch_size readings or batch_window has passed
+      reading_queue.append(data_dict)
+      if len(reading_queue) >= batch_size or time.monotonic() - last_batch_sent >= batch_window:
+        send_queued_readings()
+      return
+    if mqtt_connected.is_set() and send_queued_readings():
+      if publish_readings([data_dict]):
+        return
+    logger.info("Storing reading in the local queue for later transmission")
+    metrics.increment("readings_queued")
+    reading_queue.append(data_dict)
+
+def run_once():
+  # Take a single reading, send it and disconnect
+  ## In the event the connection fails, the reading is kept in the local
+  ## reading queue and is sent the next time a connection can be made.
+  ## The connection is made while the sensors are being read, rather than
+  ## before, so the mTLS handshake doesn't add to the time the run takes.
+  connect_thread = threading.Thread(target=connect_mqtt)
+  connect_thread.start()
+  image_uploader.start()
+  load_awair_cache()
+  data_dict = capture_readings()
+  if metrics_diag:
+    data_dict["diag"] = metrics.diag()
+  connect_thread.join()
+  send_readings(data_dict)
+  ## Give the image a chance to upload before exiting. If it doesn't, it is
+  ## uploaded on the next run.
+  image_uploader.stop(upload_drain_timeout)
+  if metrics_file:
+    metrics.write_file(metrics_file)
+  shutdown()
+
+def run_daemon():
+  # Keep taking readings until SIGTERM/SIGINT
+  ## The MQTT connection is opened once and reused for every reading, saving
+  ## a full mTLS handshake per reading. Dropped connections are re-established
+  ## by the AWS CRT in the background.
+  global awair_polling
+  signal.signal(signal.SIGTERM, handle_shutdown_signal)
+  signal.signal(signal.SIGINT, handle_shutdown_signal)
+  logger.info(f"Starting in daemon mode with a sample interval of {sample_interval} seconds")
+
+  ## Connect in the background so that readings are still taken, and queued,
+  ## if AWS IoT Core can't be reached when the daemon starts
+  threading.Thread(target=connect_mqtt, kwargs={'retry': True}, daemon=True).start()
+  image_uploader.start()
+  ## Poll the Awair on its own schedule, if configured
+  if awair_poll_interval > 0:
+    awair_polling = True
+    threading.Thread(target=poll_awair, name="awair", daemon=True).start()
+  ## Drain the counter sensors' counts once per period in the background
+  if counter_registry:
+    counter_registry.start(shutdown_event)
+  if metrics_port:
+    metrics.serve(metrics_port)
+  ## Keep recent readings to be queried locally, if configured
+  recent_readings = None
+  if cache_path:
+    recent_readings = reading_cache.ReadingCache(cache_path, cache_capacity)
+    if cache_port or cache_socket:
+      reading_cache.serve(recent_readings, port=cache_port, socket_path=cache_socket)
+
+  ## Each group of sensors is read on its own schedule. Groups without their
+  ## own interval are read every sample_interval seconds.
+  schedule = Scheduler({group: schedule_intervals.get(group) or sample_interval
+                        for stage in capture_stages for group in stage[5]},
+                       jitter=schedule_jitter, jitters=schedule_jitters)
+
+  while not shutdown_event.is_set():
+    data_dict = capture_readings(schedule.due())
+    if recent_readings is not None:
+      recent_readings.append(data_dict)
+    ## The diagnostics cover this reading's capture, and the latest S3 upload
+    ## and MQTT publish before it
+    if metrics_diag:
+      data_dict["diag"] = metrics.diag()
+    send_readings(data_dict)
+    if metrics_file:
+      metrics.write_file(metrics_file)
+    # Sleep until the next reading is due, waking early on shutdown
+    shutdown_event.wait(schedule.wait_time())
+
+  image_uploader.stop(0)
+  ## Send any partly filled batch before disconnecting
+  if batch_size > 1:
+    send_queued_readings()
+  if recent_readings is not None:
+    recent_readings.close()
+  shutdown()
+
+# Lock the I2C bus against other processes using it too, if configured
+if bus_lock_file:
+  grovepi.set_bus_lock_file(bus_lock_file)
+
+# Configure the GrovePi's I2C timing and retries
+grovepi.set_adaptive_timing(adaptive_timing)
+grovepi.set_retry_budget(write=i2c_write_retries, read=i2c_read_retries,
+                         identified=i2c_response_retries)
+
+# Open the local queue of readings waiting to be sent
+reading_queue = ReadingQueue(queue_path, max_readings=queue_max_readings,
+                             sync_batch=queue_sync_batch)
+
+# Fall back to JSON if the binary payload format's module isn't installed
+if not payload_codec.is_available(payload_format):
+  logger.error(f"Payload format {payload_format} is not available; using json")
+  payload_format = "json"
+
+# WebP images and skipping unchanged images both need Pillow
+if image_format not in image_encoding.image_formats:
+  logger.error(f"Unknown camera image format {image_format}; using png")
+  image_format = "png"
+if image_format == "webp" and not image_encoding.HAVE_PILLOW:
+  logger.error("Pillow is not installed; using jpeg in place of webp")
+  image_format = "jpeg"
+if dedup_threshold and not image_encoding.HAVE_PILLOW:
+  logger.error("Pillow is not installed; camera images will not be deduplicated")
+
+# Use the sensor map from its file, if there is one
+if sensor_map_path:
+  readings_schema.load_sensor_map(sensor_map_path)
+
+# Only run the acquisition stages, and read the groups, which have sensors in
+# the sensor map
+for stage in capture_stages:
+  for group in list(stage[5]):
+    if not readings_schema.sensors_of_type(readings_schema.sensors, *sensor_groups[group]):
+      stage[5].discard(group)
+capture_stages = [stage for stage in capture_stages if stage[5]]
+
+# Set up the counter sensors in the sensor map, if there are any
+counter_registry = None
+counter_map = readings_schema.sensors_of_type(readings_schema.sensors, *readings_schema.counter_readings)
+if counter_map:
+  counter_registry = counter_sensors.CounterRegistry(
+    [counter_sensors.create_sensor(sensor, counter_sensor_options.get(sensor.measure_name, {}))
+     for sensor in counter_map])
+for name in set(counter_sensor_options) - {sensor.measure_name for sensor in counter_map}:
+  logger.error(f"There is no counter sensor {name} in the sensor map; ignoring [COUNTER {name}]")
+
+# Only send fields which have changed, if deadbands or a window are configured
+change_reporter = None
+if deadbands or reporting_window > 1:
+  if reporting_heartbeat > reporting_heartbeat_limit:
+    logger.warning(f"The reporting heartbeat of {reporting_heartbeat} seconds is longer than "
+                   f"{reporting_heartbeat_limit} seconds, the alert window less the sample interval "
+                   f"and slack; the alerter may report steady sensors as missing")
+  change_reporter = ChangeReporter(reporting_state_path, deadbands=deadbands,
+                                   heartbeat=reporting_heartbeat, window=reporting_window)
+
+# Score each reading against the recent history of its fields, if enabled
+anomaly_detector = None
+if anomaly_detection:
+  anomaly_detector = AnomalyDetector(anomaly_state_path, alpha=anomaly_alpha,
+                                     warmup=anomaly_warmup, min_stddev=anomaly_min_stddev)
+
+# Create the background uploader for camera images
+image_uploader = ImageUploader(image_spool_dir, s3_bucket, s3_upload_path, s3_region,
+                               aws_access_key, aws_secret_key, image_uploaded,
+                               min_backoff=reconnect_min_backoff,
+                               max_backoff=upload_max_backoff,
+                               multipart_threshold=multipart_threshold,
+                               max_concurrency=upload_max_concurrency)
+image_hash_path = os.path.join(image_spool_dir, ".last_hash")
+
+# The MQTT connection to AWS IoT Core is created on first use
+mqtt_connection = None
+
+if args.daemon:
+  run_daemon()
+else:
+  run_once()
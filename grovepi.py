@@ -45,21 +45,53 @@ THE SOFTWARE.
 
 __version__ = '1.4.1'
 
+import os
 import sys
 import time
 import math
 import struct
-import numpy
-
-import di_i2c
-
+import random
+import threading
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+# Select the I2C bus the GrovePi is on
+# "SIM" selects the software emulator in grovepi_emulator.py, for use without a
+# Raspberry Pi
+# The bus isn't opened until it is first used; see get_bus()
 def set_bus(bus):
+	global i2c, bus_name
+	bus_name = bus
+	i2c = None
+
+# Use any object as the I2C bus
+# It needs the write_reg_list(reg, data) and read_list(reg, len) methods of
+# di_i2c.DI_I2C
+def set_backend(backend):
 	global i2c
-	i2c = di_i2c.DI_I2C(bus = bus, address = address)
+	i2c = backend
+
+# Return the I2C bus, opening it if this is its first use
+def get_bus():
+	global i2c
+	if i2c is None:
+		with bus_lock:
+			if i2c is None:
+				if bus_name == "SIM":
+					import grovepi_emulator
+					i2c = grovepi_emulator.GrovePiEmulator()
+				else:
+					import di_i2c
+					i2c = di_i2c.DI_I2C(bus = bus_name, address = address)
+	return i2c
 
 address = 0x04
 max_recv_size = 10
-set_bus("RPI_1SW")
+# The bus can be chosen with the GROVEPI_BUS environment variable, e.g. "SIM"
+set_bus(os.environ.get("GROVEPI_BUS", "RPI_1SW"))
 
 if sys.version_info<(3,0):
 	p_version = 2
@@ -83,6 +115,8 @@ RISING = 3
 # This allows us to be more specific about which commands contain unused bytes
 unused = 0
 retries = 10
+write_retries = 3
+read_retries = 3
 additional_waiting = 0
 
 # Get firmware version
@@ -192,89 +226,331 @@ encoder_dis_cmd = [15]
 # flow_en_cmd=[18]
 
 
+# Locking of the I2C bus
+# A GrovePi command is a write followed by a read of the response. The bus lock
+# is held across both so that another thread, or another process if a lock file
+# is set with set_bus_lock_file(), can't interleave its own frames in between.
+# The lock is reentrant, so a thread holding it can make further calls.
+class BusLock(object):
+	def __init__(self):
+		self.lock = threading.RLock()
+		self.depth = 0
+		self.lock_file_path = None
+		self.lock_file = None
+
+	def set_lock_file(self, path):
+		with self.lock:
+			if self.lock_file is not None:
+				self.lock_file.close()
+				self.lock_file = None
+			self.lock_file_path = path
+
+	def __enter__(self):
+		self.lock.acquire()
+		self.depth += 1
+		if self.depth == 1 and self.lock_file_path is not None and fcntl is not None:
+			try:
+				if self.lock_file is None:
+					self.lock_file = open(self.lock_file_path, "a")
+				fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+			except:
+				self.depth -= 1
+				self.lock.release()
+				raise
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.depth -= 1
+		if self.depth == 0 and self.lock_file is not None:
+			fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+		self.lock.release()
+		return False
+
+bus_lock = BusLock()
+
+# Also lock the bus against other processes, using an flock() on the given file
+# Every process sharing the bus must use the same file; None turns this off
+def set_bus_lock_file(path):
+	bus_lock.set_lock_file(path)
+
+# Counts of I2C bus operations, for monitoring how healthy the bus is
+# writes/reads: successful bus operations
+# write_errors/read_errors: failed bus operations which were retried
+# write_failures: writes which failed even after retrying
+# not_ready: reads where the GrovePi's response wasn't ready yet
+# response_failures: commands whose response never arrived
+i2c_stats = {
+	"writes": 0,
+	"write_errors": 0,
+	"write_failures": 0,
+	"reads": 0,
+	"read_errors": 0,
+	"not_ready": 0,
+	"response_failures": 0,
+}
+
+# Guards i2c_stats on its own, so that reading the counts (e.g. for a metrics
+# scrape) never waits on the bus lock, or holds up another process's I2C
+# traffic with it
+i2c_stats_lock = threading.Lock()
+
+# Add one to an I2C operation count
+def count_i2c(name):
+	with i2c_stats_lock:
+		i2c_stats[name] += 1
+
+# Return a copy of the I2C operation counts
+def get_i2c_stats():
+	with i2c_stats_lock:
+		return dict(i2c_stats)
+
 # Function declarations of the various functions used for encoding and sending
 # data from RPi to Arduino
 
+# Adaptive I2C timing
+# The GrovePi needs a little time after a command is written before its response
+# can be read. By default a fixed 2 ms is waited after every write and read.
+# When enabled, the wait after writing each command is instead learnt from how
+# the GrovePi responds: it is shortened a little after a run of responses that
+# were ready first time, and doubled whenever the GrovePi replies that the data
+# isn't available yet. Failed bus operations are retried after an exponential
+# backoff with jitter, rather than a fixed 3 ms.
+class AdaptiveTiming(object):
+	def __init__(self, minimum = 0.0005, maximum = 0.05, step_down = 0.9,
+			successes_to_step_down = 10, backoff_base = 0.003, backoff_max = 0.1):
+		self.enabled = False
+		self.minimum = minimum
+		self.maximum = maximum
+		self.step_down = step_down
+		self.successes_to_step_down = successes_to_step_down
+		self.backoff_base = backoff_base
+		self.backoff_max = backoff_max
+		self.settle = {}
+		self.successes = {}
+		self.last_command = None
+
+	# Seconds to wait after writing a command
+	def write_settle(self, command):
+		if not self.enabled:
+			return 0.002 + additional_waiting
+		return self.settle.get(command, 0.002) + additional_waiting
+
+	# Seconds to wait after reading a response
+	# The wait before the next command is covered by that command's write_settle
+	def read_settle(self):
+		if not self.enabled:
+			return 0.002 + additional_waiting
+		return additional_waiting
+
+	# Record whether a command's response was ready on the first read
+	def record(self, command, ready):
+		if not self.enabled or command is None:
+			return
+		settle = self.settle.get(command, 0.002)
+		if ready:
+			self.successes[command] = self.successes.get(command, 0) + 1
+			if self.successes[command] >= self.successes_to_step_down:
+				self.settle[command] = max(self.minimum, settle * self.step_down)
+				self.successes[command] = 0
+		else:
+			self.settle[command] = min(self.maximum, settle * 2)
+			self.successes[command] = 0
+
+	# Seconds to wait before retrying after the given number of failed attempts
+	def backoff(self, attempt):
+		if not self.enabled:
+			return 0.003
+		delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+		return random.uniform(delay / 2, delay)
+
+timing = AdaptiveTiming()
+
+# Turn adaptive I2C timing on or off
+def set_adaptive_timing(enabled):
+	timing.enabled = enabled
+
+# Set how many times a failed bus operation is retried
+# write: retries of a failed write
+# read: retries of a failed read
+# identified: attempts at reading a command's response before giving up
+def set_retry_budget(write = None, read = None, identified = None):
+	global write_retries, read_retries, retries
+	if write is not None:
+		write_retries = write
+	if read is not None:
+		read_retries = read
+	if identified is not None:
+		retries = identified
+
 # Write I2C block to the GrovePi
 def write_i2c_block(block, custom_timing = None):
 	'''
 	Now catches and raises Keyboard Interrupt that the user is responsible to catch.
+
+	custom_timing - seconds to wait after the write, in place of the default
 	'''
 	counter = 0
 	reg = block[0]
 	data = block[1:]
-	while counter < 3:
-		try:
-			i2c.write_reg_list(reg, data)
-			time.sleep(0.002 + additional_waiting)
-			return
-		except KeyboardInterrupt:
-			raise KeyboardInterrupt
-		except:
-			counter += 1
-			time.sleep(0.003)
-			continue
+	if custom_timing is None:
+		custom_timing = timing.write_settle(reg)
+	with bus_lock:
+		bus = get_bus()
+		timing.last_command = reg
+		while counter < write_retries:
+			try:
+				bus.write_reg_list(reg, data)
+				count_i2c("writes")
+				time.sleep(custom_timing)
+				return
+			except KeyboardInterrupt:
+				raise KeyboardInterrupt
+			except:
+				count_i2c("write_errors")
+				counter += 1
+				time.sleep(timing.backoff(counter))
+				continue
+		count_i2c("write_failures")
 
 # Read I2C block from the GrovePi
-def read_i2c_block(no_bytes = max_recv_size):
+def read_i2c_block(no_bytes = max_recv_size, custom_timing = None):
 	'''
 	Now catches and raises Keyboard Interrupt that the user is responsible to catch.
+
+	custom_timing - seconds to wait after a ready response, in place of the default
 	'''
+	if custom_timing is None:
+		custom_timing = timing.read_settle()
 	data = data_not_available_cmd
 	counter = 0
-	while data[0] in [data_not_available_cmd[0], 255] and counter < 3:
-		try:
-			data = i2c.read_list(reg = None, len = no_bytes)
-			time.sleep(0.002 + additional_waiting)
-			if counter > 0:
-				counter = 0
-		except KeyboardInterrupt:
-			raise KeyboardInterrupt
-		except:
-			counter += 1
-			time.sleep(0.003)
-			
+	first_read = True
+	with bus_lock:
+		bus = get_bus()
+		while data[0] in [data_not_available_cmd[0], 255] and counter < read_retries:
+			try:
+				data = bus.read_list(reg = None, len = no_bytes)
+				count_i2c("reads")
+				ready = data[0] not in [data_not_available_cmd[0], 255]
+				if first_read:
+					timing.record(timing.last_command, ready)
+					first_read = False
+				if ready:
+					time.sleep(custom_timing)
+				else:
+					count_i2c("not_ready")
+					# Always give the GrovePi more time before asking again,
+					# even when no wait after the read was asked for
+					time.sleep(max(custom_timing, timing.write_settle(timing.last_command)))
+				if counter > 0:
+					counter = 0
+			except KeyboardInterrupt:
+				raise KeyboardInterrupt
+			except:
+				count_i2c("read_errors")
+				counter += 1
+				time.sleep(timing.backoff(counter))
+				
 	return data
 
-def read_identified_i2c_block(read_command_id, no_bytes):
+def read_identified_i2c_block(read_command_id, no_bytes, custom_timing = None):
 	data = [-1]
-	while len(data) <= 1:
-		data = read_i2c_block(no_bytes + 1)
+	attempts = 0
+	with bus_lock:
+		while len(data) <= 1:
+			if attempts >= retries:
+				count_i2c("response_failures")
+				raise IOError("No response from the GrovePi")
+			data = read_i2c_block(no_bytes + 1, custom_timing)
+			attempts += 1
 
 	return data[1:]
 
+# Send a command to the GrovePi and read back its response, as one transaction
+# Nothing else can use the bus between the command and the response
+# no_bytes: size of the response
+# identified: whether the response is prefixed by the command's id
+def transaction(block, no_bytes = 1, identified = False):
+	with bus_lock:
+		write_i2c_block(block)
+		if identified:
+			return read_identified_i2c_block(block[:1], no_bytes)
+		return read_i2c_block(no_bytes)
+
+# Queue of GrovePi commands to be sent as a single batch
+# The bus is locked once for the whole batch and the commands are sent back to
+# back. The GrovePi only needs time to act on a command after it is written, so
+# within a batch there is no wait after reading each response; the next command
+# is written straight away.
+#
+#	batch = CommandBatch()
+#	batch.add(aRead_cmd + [0, unused, unused], no_bytes = 2, identified = True)
+#	batch.add(dRead_cmd + [4, unused, unused], no_bytes = 1, identified = True)
+#	a0, d4 = batch.execute()
+class CommandBatch(object):
+	def __init__(self):
+		self.commands = []
+
+	def __len__(self):
+		return len(self.commands)
+
+	# Add a command to the batch
+	# decode: optional function applied to the response's bytes
+	def add(self, block, no_bytes = 1, identified = False, decode = None):
+		self.commands.append((block, no_bytes, identified, decode))
+
+	# Send every command and return the list of responses, in order
+	def execute(self):
+		results = []
+		with bus_lock:
+			for block, no_bytes, identified, decode in self.commands:
+				write_i2c_block(block)
+				if identified:
+					data = read_identified_i2c_block(block[:1], no_bytes, custom_timing = 0)
+				else:
+					data = read_i2c_block(no_bytes, custom_timing = 0)
+				results.append(decode(data) if decode else data)
+		self.commands = []
+		return results
+
 # Arduino Digital Read
 def digitalRead(pin):
-	write_i2c_block(dRead_cmd + [pin, unused, unused])
-	data = read_identified_i2c_block( dRead_cmd, no_bytes = 1)[0]
+	data = transaction(dRead_cmd + [pin, unused, unused], no_bytes = 1, identified = True)[0]
 	return data
 
 # Arduino Digital Write
 def digitalWrite(pin, value):
-	write_i2c_block(dWrite_cmd + [pin, value, unused])
-	read_i2c_block(no_bytes = 1)
+	transaction(dWrite_cmd + [pin, value, unused], no_bytes = 1)
 	return 1
 
 # Read analog value from Pin
 def analogRead(pin):
-	write_i2c_block(aRead_cmd + [pin, unused, unused])
-	number = read_identified_i2c_block(aRead_cmd, no_bytes = 2)
+	number = transaction(aRead_cmd + [pin, unused, unused], no_bytes = 2, identified = True)
 	return number[0] * 256 + number[1]
 
+# Read analog values from several pins in one batch
+# pins: list of pins, which may repeat a pin to take several readings from it
+# Returns the values in the same order as pins
+def analogReadMany(pins):
+	batch = CommandBatch()
+	for pin in pins:
+		batch.add(aRead_cmd + [pin, unused, unused], no_bytes = 2, identified = True,
+			decode = lambda number: number[0] * 256 + number[1])
+	return batch.execute()
+
 
 # Write PWM
 def analogWrite(pin, value):
-	write_i2c_block(aWrite_cmd + [pin, value, unused])
-	read_i2c_block(no_bytes = 1)
+	transaction(aWrite_cmd + [pin, value, unused], no_bytes = 1)
 	return 1
 
 # Setting Up Pin mode on Arduino
 def pinMode(pin, mode):
-	if mode == "OUTPUT":
-		write_i2c_block(pMode_cmd + [pin, 1, unused])
-	elif mode == "INPUT":
-		write_i2c_block(pMode_cmd + [pin, 0, unused])
-	read_i2c_block(no_bytes = 1)
+	with bus_lock:
+		if mode == "OUTPUT":
+			write_i2c_block(pMode_cmd + [pin, 1, unused])
+		elif mode == "INPUT":
+			write_i2c_block(pMode_cmd + [pin, 0, unused])
+		read_i2c_block(no_bytes = 1)
 	return 1
 
 
@@ -295,15 +571,13 @@ def temp(pin, model = '1.0'):
 
 # Read value from Grove Ultrasonic
 def ultrasonicRead(pin):
-	write_i2c_block(uRead_cmd + [pin, unused, unused])
-	number = read_identified_i2c_block(uRead_cmd, no_bytes = 2)
+	number = transaction(uRead_cmd + [pin, unused, unused], no_bytes = 2, identified = True)
 	return (number[0] * 256 + number[1])
 
 
 # Read the firmware version
 def version():
-	write_i2c_block(version_cmd + [unused, unused, unused])
-	number = read_identified_i2c_block(version_cmd, no_bytes = 3)
+	number = transaction(version_cmd + [unused, unused, unused], no_bytes = 3, identified = True)
 	return "%s.%s.%s" % (number[0], number[1], number[2])
 
 
@@ -311,8 +585,7 @@ def version():
 # Need to investigate why this reports what was read with the previous command
 # Doesn't look to be implemented on the GrovePi
 def acc_xyz():
-	write_i2c_block(acc_xyz_cmd + [unused, unused, unused])
-	number = read_identified_i2c_block(acc_xyz_cmd, no_bytes = 3)
+	number = transaction(acc_xyz_cmd + [unused, unused, unused], no_bytes = 3, identified = True)
 	if number[1] > 32:
 		number[1] = - (number[1] - 224)
 	if number[2] > 32:
@@ -325,14 +598,12 @@ def acc_xyz():
 # Read from Grove RTC
 # Doesn't look to be implemented on the GrovePi
 def rtc_getTime():
-	write_i2c_block(rtc_getTime_cmd + [unused, unused, unused])
-	number = read_i2c_block()
+	number = transaction(rtc_getTime_cmd + [unused, unused, unused], no_bytes = max_recv_size)
 	return number
 
 # Read and return temperature and humidity from Grove DHT Pro
 def dht(pin, module_type):
-	write_i2c_block(dht_temp_cmd + [pin, module_type, unused])
-	number = read_identified_i2c_block(dht_temp_cmd, no_bytes = 8)
+	number = transaction(dht_temp_cmd + [pin, module_type, unused], no_bytes = 8, identified = True)
 
 	if p_version==2:
 		h=''
@@ -360,8 +631,7 @@ def dht(pin, module_type):
 
 # Grove - Infrared Receiver - get the commands received from the Grove IR sensor
 def ir_read_signal():
-	write_i2c_block(ir_read_cmd + [unused, unused, unused])
-	data_back = read_identified_i2c_block(ir_read_cmd, no_bytes = 7)
+	data_back = transaction(ir_read_cmd + [unused, unused, unused], no_bytes = 7, identified = True)
 
 	return (data_back[0],
 			data_back[1] + data_back[2] * 256,
@@ -369,13 +639,11 @@ def ir_read_signal():
 
 # Grove - Infrared Receiver - set the pin on which the Grove IR sensor is connected
 def ir_recv_pin(pin):
-	write_i2c_block(ir_recv_pin_cmd + [pin, unused, unused])
-	read_i2c_block(no_bytes = 1)
+	transaction(ir_recv_pin_cmd + [pin, unused, unused], no_bytes = 1)
 
 # Grove - Infrared Receiver - check if there's any data that hasn't been read so far
 def ir_is_data():
-	write_i2c_block(ir_read_isdata + 3 * [unused])
-	number = read_identified_i2c_block(ir_read_isdata, no_bytes = 1)
+	number = transaction(ir_read_isdata + 3 * [unused], no_bytes = 1, identified = True)
 
 	return number[0] != 0
 
@@ -386,53 +654,58 @@ def ir_is_data():
 def statisticalNoiseReduction(values, std_factor_threshold = 2):
 	if len(values) == 0:
 		return []
+	return statisticalNoiseReductionArray(values, std_factor_threshold).tolist()
 
-	mean = numpy.mean(values)
-	standard_deviation = numpy.std(values)
+# as statisticalNoiseReduction, but takes and returns a numpy array, for callers
+# which go on to work on the values with numpy
+def statisticalNoiseReductionArray(values, std_factor_threshold = 2):
+	# numpy is slow to import, so only import it when it's needed
+	import numpy
 
-	if standard_deviation == 0:
+	values = numpy.asarray(values)
+	if values.size == 0:
 		return values
 
-	filtered_values = [element for element in values if element > mean - std_factor_threshold * standard_deviation]
-	filtered_values = [element for element in filtered_values if element < mean + std_factor_threshold * standard_deviation]
+	mean = values.mean()
+	standard_deviation = values.std()
+
+	if standard_deviation == 0:
+		return values
 
-	return filtered_values
+	# keep the values within std_factor_threshold standard deviations of the mean, in one pass
+	keep = numpy.abs(values - mean) < std_factor_threshold * standard_deviation
+	return values[keep]
 
 
 # Grove LED Bar - initialise
 # orientation: (0 = red to green, 1 = green to red)
 def ledBar_init(pin, orientation):
-	write_i2c_block(ledBarInit_cmd + [pin, orientation, unused])
-	read_i2c_block(no_bytes = 1)
+	transaction(ledBarInit_cmd + [pin, orientation, unused], no_bytes = 1)
 	return 1
 
 # Grove LED Bar - set orientation
 # orientation: (0 = red to green,  1 = green to red)
 def ledBar_orientation(pin, orientation):
-	write_i2c_block(ledBarOrient_cmd + [pin, orientation, unused])
-	read_i2c_block(no_bytes = 1)
+	transaction(ledBarOrient_cmd + [pin, orientation, unused], no_bytes = 1)
 	return 1
 
 # Grove LED Bar - set level
 # level: (0-10)
 def ledBar_setLevel(pin, level):
-	write_i2c_block(ledBarLevel_cmd + [pin, level, unused])
-	read_i2c_block(no_bytes = 1)
+	transaction(ledBarLevel_cmd + [pin, level, unused], no_bytes = 1)
 	return 1
 
 # Grove LED Bar - set single led
 # led: which led (1-10)
 # state: off or on (0-1)
 def ledBar_setLed(pin, led, state):
-	write_i2c_block(ledBarSetOne_cmd + [pin, led, state])
-	read_i2c_block(no_bytes = 1)
+	transaction(ledBarSetOne_cmd + [pin, led, state], no_bytes = 1)
 	return 1
 
 # Grove LED Bar - toggle single led
 # led: which led (1-10)
 def ledBar_toggleLed(pin, led):
-	write_i2c_block(ledBarToggleOne_cmd + [pin, led, unused])
-	read_i2c_block(no_bytes = 1)
+	transaction(ledBarToggleOne_cmd + [pin, led, unused], no_bytes = 1)
 	return 1
 
 # Grove LED Bar - set all leds
@@ -440,22 +713,19 @@ def ledBar_toggleLed(pin, led):
 def ledBar_setBits(pin, state):
 	byte1 = state & 255
 	byte2 = state >> 8
-	write_i2c_block(ledBarSet_cmd + [pin, byte1, byte2])
-	read_i2c_block(no_bytes = 1)
+	transaction(ledBarSet_cmd + [pin, byte1, byte2], no_bytes = 1)
 	return 1
 
 # Grove LED Bar - get current state
 # state: (0-1023) a bit for each of the 10 LEDs
 def ledBar_getBits(pin):
-	write_i2c_block(ledBarGet_cmd + [pin, unused, unused])
-	block = read_identified_i2c_block(ledBarGet_cmd, no_bytes = 2)
+	block = transaction(ledBarGet_cmd + [pin, unused, unused], no_bytes = 2, identified = True)
 	return block[0] ^ (block[1] << 8)
 
 
 # Grove 4 Digit Display - initialise
 def fourDigit_init(pin):
-	write_i2c_block(fourDigitInit_cmd + [pin, unused, unused])
-	read_i2c_block(no_bytes = 1)
+	transaction(fourDigitInit_cmd + [pin, unused, unused], no_bytes = 1)
 	return 1
 
 # Grove 4 Digit Display - set numeric value with or without leading zeros
@@ -466,34 +736,30 @@ def fourDigit_number(pin, value, leading_zero):
 	byte2 = value >> 8
 	# separate commands to overcome current 4 bytes per command limitation
 	if (leading_zero):
-		write_i2c_block(fourDigitValue_cmd + [pin, byte1, byte2])
+		transaction(fourDigitValue_cmd + [pin, byte1, byte2], no_bytes = 1)
 	else:
-		write_i2c_block(fourDigitValueZeros_cmd + [pin, byte1, byte2])
-	read_i2c_block(no_bytes = 1)
+		transaction(fourDigitValueZeros_cmd + [pin, byte1, byte2], no_bytes = 1)
 	return 1
 
 # Grove 4 Digit Display - set brightness
 # brightness: (0-7)
 def fourDigit_brightness(pin, brightness):
 	# not actually visible until next command is executed
-	write_i2c_block(fourDigitBrightness_cmd + [pin, brightness, unused])
-	read_i2c_block(no_bytes = 1)
+	transaction(fourDigitBrightness_cmd + [pin, brightness, unused], no_bytes = 1)
 	return 1
 
 # Grove 4 Digit Display - set individual segment (0-9,A-F)
 # segment: (0-3)
 # value: (0-15) or (0-F)
 def fourDigit_digit(pin, segment, value):
-	write_i2c_block(fourDigitIndividualDigit_cmd + [pin, segment, value])
-	read_i2c_block(no_bytes = 1)
+	transaction(fourDigitIndividualDigit_cmd + [pin, segment, value], no_bytes = 1)
 	return 1
 
 # Grove 4 Digit Display - set 7 individual leds of a segment
 # segment: (0-3)
 # leds: (0-255) or (0-0xFF) one bit per led, segment 2 is special, 8th bit is the colon
 def fourDigit_segment(pin, segment, leds):
-	write_i2c_block(fourDigitIndividualLeds_cmd + [pin, segment, leds])
-	read_i2c_block(no_bytes = 1)
+	transaction(fourDigitIndividualLeds_cmd + [pin, segment, leds], no_bytes = 1)
 	return 1
 
 # Grove 4 Digit Display - set left and right values (0-99), with leading zeros and a colon
@@ -501,29 +767,25 @@ def fourDigit_segment(pin, segment, leds):
 # right: (0-255) or (0-FF)
 # colon will be lit
 def fourDigit_score(pin, left, right):
-	write_i2c_block(fourDigitScore_cmd + [pin, left, right])
-	read_i2c_block(no_bytes = 1)
+	transaction(fourDigitScore_cmd + [pin, left, right], no_bytes = 1)
 	return 1
 
 # Grove 4 Digit Display - display analogRead value for n seconds, 4 samples per second
 # analog: analog pin to read
 # duration: analog read for this many seconds
 def fourDigit_monitor(pin, analog, duration):
-	write_i2c_block(fourDigitAnalogRead_cmd + [pin, analog, duration])
-	read_i2c_block(no_bytes = 1)
+	transaction(fourDigitAnalogRead_cmd + [pin, analog, duration], no_bytes = 1)
 	time.sleep(duration)
 	return 1
 
 # Grove 4 Digit Display - turn entire display on (88:88)
 def fourDigit_on(pin):
-	write_i2c_block(fourDigitAllOn_cmd + [pin, unused, unused])
-	read_i2c_block(no_bytes = 1)
+	transaction(fourDigitAllOn_cmd + [pin, unused, unused], no_bytes = 1)
 	return 1
 
 # Grove 4 Digit Display - turn entire display off
 def fourDigit_off(pin):
-	write_i2c_block(fourDigitAllOff_cmd + [pin, unused, unused])
-	read_i2c_block(no_bytes = 1)
+	transaction(fourDigitAllOff_cmd + [pin, unused, unused], no_bytes = 1)
 	return 1
 
 # Grove Chainable RGB LED - store a color for later use
@@ -531,15 +793,13 @@ def fourDigit_off(pin):
 # green: 0-255
 # blue: 0-255
 def storeColor(red, green, blue):
-	write_i2c_block(storeColor_cmd + [red, green, blue])
-	read_i2c_block(no_bytes = 1)
+	transaction(storeColor_cmd + [red, green, blue], no_bytes = 1)
 	return 1
 
 # Grove Chainable RGB LED - initialise
 # numLeds: how many leds do you have in the chain
 def chainableRgbLed_init(pin, numLeds):
-	write_i2c_block(chainableRgbLedInit_cmd + [pin, numLeds, unused])
-	read_i2c_block(no_bytes = 1)
+	transaction(chainableRgbLedInit_cmd + [pin, numLeds, unused], no_bytes = 1)
 	return 1
 
 # Grove Chainable RGB LED - initialise and test with a simple color
@@ -547,32 +807,28 @@ def chainableRgbLed_init(pin, numLeds):
 # testColor: (0-7) 3 bits in total - a bit for red, green and blue, eg. 0x04 == 0b100 (0bRGB) == rgb(255, 0, 0) == #FF0000 == red
 #            ie. 0 black, 1 blue, 2 green, 3 cyan, 4 red, 5 magenta, 6 yellow, 7 white
 def chainableRgbLed_test(pin, numLeds, testColor):
-	write_i2c_block(chainableRgbLedTest_cmd + [pin, numLeds, testColor])
-	read_i2c_block(no_bytes = 1)
+	transaction(chainableRgbLedTest_cmd + [pin, numLeds, testColor], no_bytes = 1)
 	return 1
 
 # Grove Chainable RGB LED - set one or more leds to the stored color by pattern
 # pattern: (0-3) 0 = this led only, 1 all leds except this led, 2 this led and all leds inwards, 3 this led and all leds outwards
 # whichLed: index of led you wish to set counting outwards from the GrovePi, 0 = led closest to the GrovePi
 def chainableRgbLed_pattern(pin, pattern, whichLed):
-	write_i2c_block(chainableRgbLedSetPattern_cmd + [pin, pattern, whichLed])
-	read_i2c_block(no_bytes = 1)
+	transaction(chainableRgbLedSetPattern_cmd + [pin, pattern, whichLed], no_bytes = 1)
 	return 1
 
 # Grove Chainable RGB LED - set one or more leds to the stored color by modulo
 # offset: index of led you wish to start at, 0 = led closest to the GrovePi, counting outwards
 # divisor: when 1 (default) sets stored color on all leds >= offset, when 2 sets every 2nd led >= offset and so on
 def chainableRgbLed_modulo(pin, offset, divisor):
-	write_i2c_block(chainableRgbLedSetModulo_cmd + [pin, offset, divisor])
-	read_i2c_block(no_bytes = 1)
+	transaction(chainableRgbLedSetModulo_cmd + [pin, offset, divisor], no_bytes = 1)
 	return 1
 
 # Grove Chainable RGB LED - sets leds similar to a bar graph, reversible
 # level: (0-10) the number of leds you wish to set to the stored color
 # reversible (0-1) when 0 counting outwards from GrovePi, 0 = led closest to the GrovePi, otherwise counting inwards
 def chainableRgbLed_setLevel(pin, level, reverse):
-	write_i2c_block(chainableRgbLedSetLevel_cmd + [pin, level, reverse])
-	read_i2c_block(no_bytes = 1)
+	transaction(chainableRgbLedSetLevel_cmd + [pin, level, reverse], no_bytes = 1)
 	return 1
 
 def set_pin_interrupt(pin, ftype, interrupt_mode, period):
@@ -587,8 +843,7 @@ def set_pin_interrupt(pin, ftype, interrupt_mode, period):
 	period_high = period >> 8
 	period_low = period & 0xff
 	combined_params = (pin & 0x0f) + ((ftype & 0x03) << 4) + ((interrupt_mode & 0x03) << 6)
-	write_i2c_block(isr_set_cmd + [combined_params, period_high, period_low])
-	read_i2c_block(no_bytes = 1)
+	transaction(isr_set_cmd + [combined_params, period_high, period_low], no_bytes = 1)
 
 def unset_pin_interrupt(pin):
 	'''
@@ -596,8 +851,7 @@ def unset_pin_interrupt(pin):
 
 	pin - D2-D8 pins
 	'''
-	write_i2c_block(isr_unset_cmd + [pin, unused, unused])
-	read_i2c_block(no_bytes = 1)
+	transaction(isr_unset_cmd + [pin, unused, unused], no_bytes = 1)
 
 def unset_all_interrupts():
 	'''
@@ -605,12 +859,10 @@ def unset_all_interrupts():
 
 	pin - D2-D8 pins
 	'''
-	write_i2c_block(isr_clear_cmd + 3 * [unused])
-	read_i2c_block(no_bytes = 1)
+	transaction(isr_clear_cmd + 3 * [unused], no_bytes = 1)
 
 def is_interrupt_active(pin):
-	write_i2c_block(isr_active_cmd + [pin, unused, unused])
-	data = read_identified_i2c_block(isr_active_cmd, no_bytes = 2)
+	data = transaction(isr_active_cmd + [pin, unused, unused], no_bytes = 2, identified = True)
 	value  = data[1] >> pin
 	return value != 0
 
@@ -621,8 +873,7 @@ def get_active_interrupts():
 	pin - D2-D8 pins; if it's 255 return the state of all pins
 	'''
 	pin = 255
-	write_i2c_block(isr_active_cmd + [pin, unused, unused])
-	data = read_identified_i2c_block(isr_active_cmd, no_bytes = 2)
+	data = transaction(isr_active_cmd + [pin, unused, unused], no_bytes = 2, identified = True)
 	value = data[0] + (data[1] << 8)
 	active_interrupts = [i for i in range(2 * 8) if ((value >> i) & 0x01)]
 	return active_interrupts
@@ -633,8 +884,7 @@ def read_interrupt_state(pin):
 
 	pin - D2-D8 pins
 	'''
-	write_i2c_block(isr_read_cmd + [pin, unused, unused])
-	data = read_identified_i2c_block(isr_read_cmd, no_bytes = 4)
+	data = transaction(isr_read_cmd + [pin, unused, unused], no_bytes = 4, identified = True)
 	value = data[0] + (data[1] << 8) + (data[2] << 16) + (data[3] << 24)
 	return value
 
@@ -660,16 +910,13 @@ def dust_sensor_read(pin = 2, period = 30000):
 	return lpo, percentage, concentration
 
 def encoder_en(pin = 2, steps = 32):
-	write_i2c_block(encoder_en_cmd + [pin, steps, unused])
-	read_i2c_block(no_bytes = 1)
+	transaction(encoder_en_cmd + [pin, steps, unused], no_bytes = 1)
 
 def encoder_dis(pin = 2):
-	write_i2c_block(encoder_dis_cmd + [pin, unused, unused])
-	read_i2c_block(no_bytes = 1)
+	transaction(encoder_dis_cmd + [pin, unused, unused], no_bytes = 1)
 
 def encoderRead(pin = 2):
-	write_i2c_block(encoder_read_cmd + [pin, unused, unused])
-	data = read_identified_i2c_block(encoder_read_cmd, no_bytes = 4)
+	data = transaction(encoder_read_cmd + [pin, unused, unused], no_bytes = 4, identified = True)
 	value = data[0] + (data[1] << 8) + (data[2] << 16) + (data[3] << 24)
 	return value
 
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+#
+# GrovePi emulator
+#
+# A software stand-in for a GrovePi+ board, for running and load testing code
+# which uses the GrovePi library without a Raspberry Pi. It behaves like the
+# I2C bus object the library normally uses (di_i2c.DI_I2C), answering the
+# GrovePi firmware's command set with scripted sensor values.
+#
+# Select it with grovepi.set_bus("SIM"), or by setting the GROVEPI_BUS
+# environment variable to SIM before grovepi is imported, then script it:
+#
+#	emulator = grovepi.get_bus()
+#	emulator.set_analog(0, 512)                       # constant value
+#	emulator.set_analog(1, [300, 310, 320])           # sequence, last one repeats
+#	emulator.set_analog(2, lambda: random.randint(0, 950))
+#	emulator.latency = 0.002                          # seconds per command
+#	emulator.error_rate = 0.01                        # chance of a bus error
+#
+
+import random
+import struct
+import time
+
+# GrovePi firmware command ids
+VERSION = 8
+DIGITAL_READ = 1
+DIGITAL_WRITE = 2
+ANALOG_READ = 3
+ANALOG_WRITE = 4
+PIN_MODE = 5
+ULTRASONIC_READ = 7
+DHT_READ = 40
+IR_READ = 21
+IR_RECV_PIN = 22
+IR_IS_DATA = 24
+ISR_SET = 6
+ISR_UNSET = 9
+ISR_READ = 10
+ISR_CLEAR = 11
+ISR_ACTIVE = 12
+ENCODER_READ = 13
+ENCODER_ENABLE = 14
+ENCODER_DISABLE = 15
+
+# Reply while a command's response isn't ready yet
+DATA_NOT_AVAILABLE = 23
+
+
+# Produce the next value from a scripted source
+# A source is a constant (which may be a tuple), a function called for each
+# value, or a list of values which are returned in turn, with the last value
+# then repeating
+class ValueSource(object):
+	def __init__(self, source):
+		self.source = source
+		self.index = 0
+
+	def next(self):
+		if callable(self.source):
+			return self.source()
+		if isinstance(self.source, list):
+			value = self.source[min(self.index, len(self.source) - 1)]
+			self.index += 1
+			return value
+		return self.source
+
+
+class GrovePiEmulator(object):
+	def __init__(self, latency = 0.0, error_rate = 0.0, firmware = (1, 4, 0), seed = None):
+		# seconds after a command is written before its response is ready
+		self.latency = latency
+		# extra latency for particular commands, e.g. {DHT_READ: 0.03}
+		self.command_latency = {}
+		# probability of each bus operation raising an IOError
+		self.error_rate = error_rate
+		self.firmware = firmware
+		self.random = random.Random(seed)
+
+		self.analog = {}
+		self.digital = {}
+		self.ultrasonic = {}
+		self.dht = {}
+		self.interrupt_counts = {}
+		self.encoders = {}
+		self.ir = ValueSource((0, 0, 0))
+
+		self.pin_modes = {}
+		self.outputs = {}
+		self.interrupts = {}
+		self.enabled_encoders = set()
+		self.ir_pin = None
+
+		# number of times each command has been received, for load tests
+		self.command_counts = {}
+		self.response = [DATA_NOT_AVAILABLE]
+		self.ready_at = 0
+
+	# Scripting of sensor values
+
+	def set_analog(self, pin, source):
+		self.analog[pin] = ValueSource(source)
+
+	def set_digital(self, pin, source):
+		self.digital[pin] = ValueSource(source)
+
+	def set_ultrasonic(self, pin, source):
+		self.ultrasonic[pin] = ValueSource(source)
+
+	# source yields (temperature, humidity) tuples
+	def set_dht(self, pin, source):
+		self.dht[pin] = ValueSource(source)
+
+	# count of pulses, or of low duration in ms, reported for an interrupt pin
+	def set_interrupt_count(self, pin, source):
+		self.interrupt_counts[pin] = ValueSource(source)
+
+	def set_encoder(self, pin, source):
+		self.encoders[pin] = ValueSource(source)
+
+	# source yields (has data, button, event) tuples
+	def set_ir(self, source):
+		self.ir = ValueSource(source)
+
+	@staticmethod
+	def value(sources, pin, default = 0):
+		if pin in sources:
+			return sources[pin].next()
+		return default
+
+	def maybe_fail(self):
+		if self.error_rate and self.random.random() < self.error_rate:
+			raise IOError("Emulated I2C bus error")
+
+	# I2C bus interface, as used by the GrovePi library
+
+	def write_reg_list(self, reg, data):
+		self.maybe_fail()
+		self.command_counts[reg] = self.command_counts.get(reg, 0) + 1
+		self.response = self.execute(reg, list(data) + [0, 0, 0])
+		self.ready_at = time.monotonic() + self.latency + self.command_latency.get(reg, 0)
+
+	def read_list(self, reg = None, len = 1):
+		self.maybe_fail()
+		if time.monotonic() < self.ready_at:
+			response = [DATA_NOT_AVAILABLE]
+		else:
+			response = self.response
+		return (response + [0] * len)[:len]
+
+	# GrovePi firmware command set
+
+	def execute(self, command, data):
+		pin = data[0]
+		if command == VERSION:
+			return [command] + list(self.firmware)
+		if command == DIGITAL_READ:
+			return [command, self.value(self.digital, pin, self.outputs.get(pin, 0)) & 0x01]
+		if command == DIGITAL_WRITE:
+			self.outputs[pin] = data[1]
+			return [command]
+		if command == ANALOG_READ:
+			value = int(self.value(self.analog, pin)) & 0xffff
+			return [command, value >> 8, value & 0xff]
+		if command == ANALOG_WRITE:
+			self.outputs[pin] = data[1]
+			return [command]
+		if command == PIN_MODE:
+			self.pin_modes[pin] = "OUTPUT" if data[1] else "INPUT"
+			return [command]
+		if command == ULTRASONIC_READ:
+			value = int(self.value(self.ultrasonic, pin)) & 0xffff
+			return [command, value >> 8, value & 0xff]
+		if command == DHT_READ:
+			temperature, humidity = self.value(self.dht, pin, (float('nan'), float('nan')))
+			return [command] + list(bytearray(struct.pack('f', temperature))) + \
+				list(bytearray(struct.pack('f', humidity)))
+		if command == ISR_SET:
+			self.interrupts[data[0] & 0x0f] = {
+				"ftype": (data[0] >> 4) & 0x03,
+				"mode": (data[0] >> 6) & 0x03,
+				"period": (data[1] << 8) + data[2],
+			}
+			return [command]
+		if command == ISR_UNSET:
+			self.interrupts.pop(pin, None)
+			return [command]
+		if command == ISR_CLEAR:
+			self.interrupts = {}
+			return [command]
+		if command == ISR_READ:
+			value = int(self.value(self.interrupt_counts, pin)) if pin in self.interrupts else 0
+			return [command] + list(bytearray(struct.pack('<I', value & 0xffffffff)))
+		if command == ISR_ACTIVE:
+			if pin != 255:
+				# is_interrupt_active() tests the second byte shifted right by the pin
+				return [command, 0, 0xff if pin in self.interrupts else 0]
+			mask = 0
+			for interrupt_pin in self.interrupts:
+				mask |= 1 << interrupt_pin
+			return [command, mask & 0xff, mask >> 8]
+		if command == ENCODER_ENABLE:
+			self.enabled_encoders.add(pin)
+			return [command]
+		if command == ENCODER_DISABLE:
+			self.enabled_encoders.discard(pin)
+			return [command]
+		if command == ENCODER_READ:
+			value = int(self.value(self.encoders, pin)) if pin in self.enabled_encoders else 0
+			return [command] + list(bytearray(struct.pack('<I', value & 0xffffffff)))
+		if command == IR_RECV_PIN:
+			self.ir_pin = pin
+			return [command]
+		if command == IR_IS_DATA:
+			return [command, 1 if self.ir.next()[0] else 0]
+		if command == IR_READ:
+			has_data, button, event = self.ir.next()
+			return [command, 1 if has_data else 0, button & 0xff, button >> 8] + \
+				list(bytearray(struct.pack('<I', event & 0xffffffff)))
+		# LED bar, 4 digit display, RGB LED etc. just acknowledge the command
+		return [command]
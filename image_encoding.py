@@ -0,0 +1,88 @@
+# SucculentPi Image Encoding
+## Helpers for keeping camera images small before they are uploaded:
+##  - building the libcamera-still command line, so that scaling, cropping to
+##    the pot and JPEG compression are all done on the camera's ISP
+##  - converting to WebP, which libcamera-still can't write itself
+##  - a perceptual 'difference hash' of each image, so that frames which are
+##    nearly identical to the last uploaded one can be skipped
+##
+## Pillow is only needed for WebP and for the perceptual hash. If it isn't
+## installed, those features are unavailable and HAVE_PILLOW is False. It is
+## only imported when one of those features is actually used.
+
+import importlib.util
+import logging
+import os
+
+HAVE_PILLOW = importlib.util.find_spec("PIL") is not None
+
+logger = logging.getLogger()
+
+# File extension, and libcamera-still encoding, for each output format
+## WebP images are captured as PNG and then converted
+image_formats = {
+  "png": ("png", "png"),
+  "jpeg": ("jpg", "jpg"),
+  "webp": ("webp", "png"),
+}
+
+
+def file_extension(image_format):
+  # File extension to use for an image format
+  return image_formats[image_format][0]
+
+def libcamera_command(path, image_format, quality, width=0, height=0, roi=None):
+  # Build the libcamera-still command to capture an image to 'path'
+  ## width/height: scale the image to this size (0 for the full resolution)
+  ## roi:          'x,y,w,h' region of the sensor to use, as fractions of the
+  ##               full frame, e.g. to crop to the pot
+  command = ["libcamera-still", "-e", image_formats[image_format][1],
+             "-o", path]
+  if image_format == "jpeg":
+    command += ["-q", str(quality)]
+  if width and height:
+    command += ["--width", str(width), "--height", str(height)]
+  if roi:
+    command += ["--roi", roi]
+  return command
+
+def convert_image(source, destination, image_format, quality):
+  # Re-encode a captured image in a format libcamera-still can't write
+  from PIL import Image
+  with Image.open(source) as image:
+    image.save(destination, format=image_format.upper(), quality=quality)
+  os.remove(source)
+
+def image_hash(path):
+  # 64 bit difference hash of an image
+  ## The image is reduced to a 9x8 greyscale thumbnail and each bit records
+  ## whether a pixel is brighter than its right hand neighbour, so the hash
+  ## only changes when the structure of the image changes, not with noise or
+  ## compression artefacts
+  from PIL import Image
+  with Image.open(path) as image:
+    pixels = list(image.convert("L").resize((9, 8)).getdata())
+  value = 0
+  for row in range(8):
+    for column in range(8):
+      left = pixels[row * 9 + column]
+      right = pixels[row * 9 + column + 1]
+      value = (value << 1) | (left > right)
+  return value
+
+def hash_distance(first, second):
+  # Number of bits which differ between two image hashes
+  return bin(first ^ second).count("1")
+
+def load_hash(path):
+  # Read the hash of the last uploaded image, if there is one
+  try:
+    with open(path) as hash_file:
+      return int(hash_file.read().strip(), 16)
+  except (OSError, ValueError):
+    return None
+
+def save_hash(path, value):
+  # Record the hash of the image which is about to be uploaded
+  with open(path, "w") as hash_file:
+    hash_file.write(f"{value:016x}\n")
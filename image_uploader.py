@@ -0,0 +1,148 @@
+# SucculentPi Image Uploader
+## A background worker which uploads camera images to S3, so that a slow
+## uplink doesn't hold back sending the sensor readings.
+##
+## Images are placed in a spool directory and stay there until they have been
+## uploaded successfully. Failed uploads are retried with an exponential
+## backoff, and as the spool directory is on disk, images which haven't been
+## uploaded when the script exits are picked up again on the next run.
+
+import logging
+import mimetypes
+import os
+import random
+import threading
+
+import metrics
+
+logger = logging.getLogger()
+
+
+class ImageUploader(threading.Thread):
+  # Thread which uploads every image in the spool directory to S3
+  ## on_uploaded is called with the image's name (without extension) and its
+  ## S3 URL once each upload has been confirmed
+
+  def __init__(self, spool_dir, bucket, upload_path, region, access_key,
+               secret_key, on_uploaded, min_backoff=1, max_backoff=300,
+               multipart_threshold=8, max_concurrency=4):
+    super().__init__(name="image-uploader", daemon=True)
+    self.spool_dir = spool_dir
+    self.bucket = bucket
+    self.upload_path = upload_path
+    self.region = region
+    self.on_uploaded = on_uploaded
+    self.access_key = access_key
+    self.secret_key = secret_key
+    self.multipart_threshold = multipart_threshold
+    self.max_concurrency = max_concurrency
+    self.min_backoff = min_backoff
+    self.max_backoff = max_backoff
+    self.wake = threading.Event()
+    self.stopping = threading.Event()
+    self.idle = threading.Event()
+    self.s3 = None
+    os.makedirs(spool_dir, exist_ok=True)
+
+  def create_client(self):
+    # Create the S3 client
+    ## One client, and its pool of HTTPS connections, is used for every upload.
+    ## Images above multipart_threshold MB are uploaded in parts, several at
+    ## a time. boto3 is slow to import, so this is done on the uploader's own
+    ## thread rather than when the script starts.
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
+    self.s3 = boto3.client(
+      's3',
+      aws_access_key_id=self.access_key,
+      aws_secret_access_key=self.secret_key,
+      region_name=self.region,
+      config=Config(max_pool_connections=self.max_concurrency,
+                    retries={'max_attempts': 3, 'mode': 'standard'})
+    )
+    self.transfer_config = TransferConfig(
+      multipart_threshold=self.multipart_threshold * 1024 * 1024,
+      multipart_chunksize=self.multipart_threshold * 1024 * 1024,
+      max_concurrency=self.max_concurrency,
+      use_threads=True
+    )
+
+  def spool_path(self, file_name):
+    # Path of an image waiting to be uploaded
+    return os.path.join(self.spool_dir, file_name)
+
+  def capture_path(self, file_name):
+    # Path at which to write a new image before it is spooled
+    ## Hidden files are ignored by the uploader, so it never sees a partly
+    ## written image
+    return os.path.join(self.spool_dir, f".{file_name}")
+
+  def spool(self, file_name):
+    # Move a newly written image into the spool directory and wake the uploader
+    os.replace(self.capture_path(file_name), self.spool_path(file_name))
+    self.idle.clear()
+    self.wake.set()
+
+  def pending(self):
+    # List the images waiting to be uploaded, oldest first
+    return sorted(name for name in os.listdir(self.spool_dir)
+                  if not name.startswith('.'))
+
+  def url(self, file_name):
+    # Public S3 URL of an uploaded image
+    return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{self.upload_path}/{file_name}"
+
+  def upload(self, file_name):
+    # Upload a single image, returning True if it succeeded
+    try:
+      logger.debug(f"Uploading image {file_name} to S3")
+      if self.s3 is None:
+        self.create_client()
+      with metrics.timer("s3_upload"):
+        self.s3.upload_file(self.spool_path(file_name), self.bucket,
+                            f"{self.upload_path}/{file_name}",
+                            ExtraArgs={'ContentType': mimetypes.guess_type(file_name)[0] or 'application/octet-stream'},
+                            Config=self.transfer_config)
+    except:
+      logger.error(f"Error uploading image {file_name} to S3")
+      return False
+    logger.info(f"Uploaded image {file_name} to S3")
+    os.remove(self.spool_path(file_name))
+    try:
+      self.on_uploaded(os.path.splitext(file_name)[0], self.url(file_name))
+    except:
+      logger.error(f"Error reporting the upload of image {file_name}")
+    return True
+
+  def run(self):
+    backoff = self.min_backoff
+    while not self.stopping.is_set():
+      self.wake.clear()
+      for file_name in self.pending():
+        if self.stopping.is_set():
+          return
+        if not self.upload(file_name):
+          break
+        backoff = self.min_backoff
+      else:
+        # Everything has been uploaded; wait for the next image
+        self.idle.set()
+        self.wake.wait()
+        continue
+      # An upload failed; back off, with some jitter, before trying again
+      delay = backoff * random.uniform(0.5, 1.5)
+      logger.info(f"Retrying image upload in {delay:.1f} seconds")
+      self.stopping.wait(delay)
+      backoff = min(backoff * 2, self.max_backoff)
+
+  def stop(self, timeout):
+    # Stop the uploader, allowing up to 'timeout' seconds for the images
+    # already in the spool directory to be uploaded
+    ## Anything still not uploaded is left in the spool directory for the
+    ## next run
+    if self.is_alive():
+      self.idle.wait(timeout)
+    self.stopping.set()
+    self.wake.set()
+    self.join(timeout)
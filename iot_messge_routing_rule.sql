@@ -14,6 +14,15 @@ SELECT
   room.env.voc_total AS room_env_voctotal,
   room.env.voc_h2 AS room_env_voch2,
   room.env.voc_ethanol AS room_env_vocethanol,
-  room.env.pm25 AS room_env_pm25
+  room.env.pm25 AS room_env_pm25,
+  plant.pot.soil.filtering.moisture_top_a0.median AS plant_pot_soil_moisture_top_median,
+  plant.pot.soil.filtering.moisture_top_a0.mean AS plant_pot_soil_moisture_top_mean,
+  plant.pot.soil.filtering.moisture_top_a0.stddev AS plant_pot_soil_moisture_top_stddev,
+  plant.pot.soil.filtering.moisture_middle_a1.median AS plant_pot_soil_moisture_middle_median,
+  plant.pot.soil.filtering.moisture_middle_a1.mean AS plant_pot_soil_moisture_middle_mean,
+  plant.pot.soil.filtering.moisture_middle_a1.stddev AS plant_pot_soil_moisture_middle_stddev,
+  plant.pot.soil.filtering.moisture_bottom_a2.median AS plant_pot_soil_moisture_bottom_median,
+  plant.pot.soil.filtering.moisture_bottom_a2.mean AS plant_pot_soil_moisture_bottom_mean,
+  plant.pot.soil.filtering.moisture_bottom_a2.stddev AS plant_pot_soil_moisture_bottom_stddev
 FROM
   'succulentpi/readings'
\ No newline at end of file
@@ -0,0 +1,29 @@
+SELECT
+  anomaly.plant_pot_soil_moisture_top AS plant_pot_soil_moisture_top_anomaly,
+  anomaly.plant_pot_soil_moisture_middle AS plant_pot_soil_moisture_middle_anomaly,
+  anomaly.plant_pot_soil_moisture_bottom AS plant_pot_soil_moisture_bottom_anomaly,
+  anomaly.plant_env_visiblelight AS plant_env_visiblelight_anomaly,
+  anomaly.plant_env_uvlight AS plant_env_uvlight_anomaly,
+  anomaly.plant_env_irlight AS plant_env_irlight_anomaly,
+  anomaly.room_env_dewpoint AS room_env_dewpoint_anomaly,
+  anomaly.room_env_temperature AS room_env_temperature_anomaly,
+  anomaly.room_env_relativehumidity AS room_env_relativehumidity_anomaly,
+  anomaly.room_env_absolutehumidty AS room_env_absolutehumidty_anomaly,
+  anomaly.room_env_co2 AS room_env_co2_anomaly,
+  anomaly.room_env_voctotal AS room_env_voctotal_anomaly,
+  anomaly.room_env_voch2 AS room_env_voch2_anomaly,
+  anomaly.room_env_vocethanol AS room_env_vocethanol_anomaly,
+  anomaly.room_env_pm25 AS room_env_pm25_anomaly,
+  anomaly.plant_pot_soil_moisture_top_median AS plant_pot_soil_moisture_top_median_anomaly,
+  anomaly.plant_pot_soil_moisture_top_mean AS plant_pot_soil_moisture_top_mean_anomaly,
+  anomaly.plant_pot_soil_moisture_top_stddev AS plant_pot_soil_moisture_top_stddev_anomaly,
+  anomaly.plant_pot_soil_moisture_middle_median AS plant_pot_soil_moisture_middle_median_anomaly,
+  anomaly.plant_pot_soil_moisture_middle_mean AS plant_pot_soil_moisture_middle_mean_anomaly,
+  anomaly.plant_pot_soil_moisture_middle_stddev AS plant_pot_soil_moisture_middle_stddev_anomaly,
+  anomaly.plant_pot_soil_moisture_bottom_median AS plant_pot_soil_moisture_bottom_median_anomaly,
+  anomaly.plant_pot_soil_moisture_bottom_mean AS plant_pot_soil_moisture_bottom_mean_anomaly,
+  anomaly.plant_pot_soil_moisture_bottom_stddev AS plant_pot_soil_moisture_bottom_stddev_anomaly
+FROM
+  'succulentpi/readings'
+WHERE
+  isUndefined(anomaly) = false
\ No newline at end of file
@@ -0,0 +1,7 @@
+SELECT
+  awair.stale AS awair_stale,
+  awair.age AS awair_age
+FROM
+  'succulentpi/readings'
+WHERE
+  isUndefined(awair) = false
\ No newline at end of file
@@ -0,0 +1,5 @@
+SELECT
+  client_id,
+  readings
+FROM
+  'succulentpi/readings/batch'
\ No newline at end of file
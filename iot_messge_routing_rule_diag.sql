@@ -0,0 +1,24 @@
+SELECT
+  diag.capture_ms AS diag_capture_ms,
+  diag.stage_grove_ms AS diag_stage_grove_ms,
+  diag.stage_awair_ms AS diag_stage_awair_ms,
+  diag.stage_camera_ms AS diag_stage_camera_ms,
+  diag.grove_moisture_ms AS diag_grove_moisture_ms,
+  diag.grove_si114x_ms AS diag_grove_si114x_ms,
+  diag.awair_api_ms AS diag_awair_api_ms,
+  diag.camera_capture_ms AS diag_camera_capture_ms,
+  diag.s3_upload_ms AS diag_s3_upload_ms,
+  diag.mqtt_publish_ms AS diag_mqtt_publish_ms,
+  diag.i2c_writes AS diag_i2c_writes,
+  diag.i2c_reads AS diag_i2c_reads,
+  diag.i2c_write_errors AS diag_i2c_write_errors,
+  diag.i2c_write_failures AS diag_i2c_write_failures,
+  diag.i2c_read_errors AS diag_i2c_read_errors,
+  diag.i2c_not_ready AS diag_i2c_not_ready,
+  diag.i2c_response_failures AS diag_i2c_response_failures,
+  diag.stage_counters_ms AS diag_stage_counters_ms,
+  diag.camera_convert_ms AS diag_camera_convert_ms
+FROM
+  'succulentpi/readings'
+WHERE
+  isUndefined(diag) = false
\ No newline at end of file
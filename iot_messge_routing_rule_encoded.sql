@@ -0,0 +1,4 @@
+SELECT
+  encode(*, 'base64') AS data
+FROM
+  'succulentpi/readings/encoded'
\ No newline at end of file
@@ -0,0 +1,53 @@
+SELECT
+  window.plant_pot_soil_moisture_top.min AS plant_pot_soil_moisture_top_min,
+  window.plant_pot_soil_moisture_top.max AS plant_pot_soil_moisture_top_max,
+  window.plant_pot_soil_moisture_middle.min AS plant_pot_soil_moisture_middle_min,
+  window.plant_pot_soil_moisture_middle.max AS plant_pot_soil_moisture_middle_max,
+  window.plant_pot_soil_moisture_bottom.min AS plant_pot_soil_moisture_bottom_min,
+  window.plant_pot_soil_moisture_bottom.max AS plant_pot_soil_moisture_bottom_max,
+  window.plant_env_visiblelight.min AS plant_env_visiblelight_min,
+  window.plant_env_visiblelight.max AS plant_env_visiblelight_max,
+  window.plant_env_uvlight.min AS plant_env_uvlight_min,
+  window.plant_env_uvlight.max AS plant_env_uvlight_max,
+  window.plant_env_irlight.min AS plant_env_irlight_min,
+  window.plant_env_irlight.max AS plant_env_irlight_max,
+  window.room_env_dewpoint.min AS room_env_dewpoint_min,
+  window.room_env_dewpoint.max AS room_env_dewpoint_max,
+  window.room_env_temperature.min AS room_env_temperature_min,
+  window.room_env_temperature.max AS room_env_temperature_max,
+  window.room_env_relativehumidity.min AS room_env_relativehumidity_min,
+  window.room_env_relativehumidity.max AS room_env_relativehumidity_max,
+  window.room_env_absolutehumidty.min AS room_env_absolutehumidty_min,
+  window.room_env_absolutehumidty.max AS room_env_absolutehumidty_max,
+  window.room_env_co2.min AS room_env_co2_min,
+  window.room_env_co2.max AS room_env_co2_max,
+  window.room_env_voctotal.min AS room_env_voctotal_min,
+  window.room_env_voctotal.max AS room_env_voctotal_max,
+  window.room_env_voch2.min AS room_env_voch2_min,
+  window.room_env_voch2.max AS room_env_voch2_max,
+  window.room_env_vocethanol.min AS room_env_vocethanol_min,
+  window.room_env_vocethanol.max AS room_env_vocethanol_max,
+  window.room_env_pm25.min AS room_env_pm25_min,
+  window.room_env_pm25.max AS room_env_pm25_max,
+  window.plant_pot_soil_moisture_top_median.min AS plant_pot_soil_moisture_top_median_min,
+  window.plant_pot_soil_moisture_top_median.max AS plant_pot_soil_moisture_top_median_max,
+  window.plant_pot_soil_moisture_top_mean.min AS plant_pot_soil_moisture_top_mean_min,
+  window.plant_pot_soil_moisture_top_mean.max AS plant_pot_soil_moisture_top_mean_max,
+  window.plant_pot_soil_moisture_top_stddev.min AS plant_pot_soil_moisture_top_stddev_min,
+  window.plant_pot_soil_moisture_top_stddev.max AS plant_pot_soil_moisture_top_stddev_max,
+  window.plant_pot_soil_moisture_middle_median.min AS plant_pot_soil_moisture_middle_median_min,
+  window.plant_pot_soil_moisture_middle_median.max AS plant_pot_soil_moisture_middle_median_max,
+  window.plant_pot_soil_moisture_middle_mean.min AS plant_pot_soil_moisture_middle_mean_min,
+  window.plant_pot_soil_moisture_middle_mean.max AS plant_pot_soil_moisture_middle_mean_max,
+  window.plant_pot_soil_moisture_middle_stddev.min AS plant_pot_soil_moisture_middle_stddev_min,
+  window.plant_pot_soil_moisture_middle_stddev.max AS plant_pot_soil_moisture_middle_stddev_max,
+  window.plant_pot_soil_moisture_bottom_median.min AS plant_pot_soil_moisture_bottom_median_min,
+  window.plant_pot_soil_moisture_bottom_median.max AS plant_pot_soil_moisture_bottom_median_max,
+  window.plant_pot_soil_moisture_bottom_mean.min AS plant_pot_soil_moisture_bottom_mean_min,
+  window.plant_pot_soil_moisture_bottom_mean.max AS plant_pot_soil_moisture_bottom_mean_max,
+  window.plant_pot_soil_moisture_bottom_stddev.min AS plant_pot_soil_moisture_bottom_stddev_min,
+  window.plant_pot_soil_moisture_bottom_stddev.max AS plant_pot_soil_moisture_bottom_stddev_max
+FROM
+  'succulentpi/readings'
+WHERE
+  isUndefined(window) = false
\ No newline at end of file
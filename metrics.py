@@ -0,0 +1,148 @@
+# SucculentPi Metrics
+## Timings of each part of taking and sending a reading (the Grove sensor
+## reads, the Awair API call, the camera, S3 uploads, MQTT publishing etc.),
+## and the GrovePi's I2C operation and retry counts, so it's possible to see
+## where the time in each reading goes.
+##
+## The metrics can be exported in the Prometheus text format, either written
+## to a file (e.g. for node_exporter's textfile collector) or served over
+## HTTP, and a summary of the latest reading's metrics can be added to the
+## reading itself under "diag". Each of the summary's names must be listed in
+## readings_schema.diag_names to be written to Timestream.
+##
+## Code being timed only needs to import this module:
+##   with metrics.timer("awair"):
+##     ...
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import grovepi
+import readings_schema
+
+logger = logging.getLogger()
+
+lock = threading.Lock()
+## {name: [number of times, total seconds, latest seconds]}
+timings = {}
+## {name: count}
+counters = {}
+## I2C counts as of the last diag summary, to report the change since then
+last_i2c_stats = {}
+## Diagnostics which have been logged as not being in readings_schema.diag_names
+unrouted_diag = set()
+
+
+def observe(name, seconds):
+  # Record how long something took
+  with lock:
+    timing = timings.setdefault(name, [0, 0.0, 0.0])
+    timing[0] += 1
+    timing[1] += seconds
+    timing[2] = seconds
+
+@contextmanager
+def timer(name):
+  # Time the code run within a 'with' block
+  ## The time is recorded even if the code raises an exception
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    observe(name, time.perf_counter() - start)
+
+def increment(name, count=1):
+  # Add to a counter
+  with lock:
+    counters[name] = counters.get(name, 0) + count
+
+def diag():
+  # Summary of the latest timings, in ms, and the I2C counts since the last
+  # summary, to add to a reading
+  global last_i2c_stats
+  summary = {}
+  with lock:
+    for name, (_, _, latest) in sorted(timings.items()):
+      summary[f"{name}_ms"] = round(latest * 1000, 1)
+  i2c_stats = grovepi.get_i2c_stats()
+  for name, count in i2c_stats.items():
+    summary[f"i2c_{name}"] = count - last_i2c_stats.get(name, 0)
+  last_i2c_stats = i2c_stats
+  ## Only the diagnostics in readings_schema.diag_names reach Timestream
+  unrouted = set(summary) - set(readings_schema.diag_names) - unrouted_diag
+  if unrouted:
+    logger.error(f"Diagnostics missing from readings_schema.diag_names, so not sent: {', '.join(sorted(unrouted))}")
+    unrouted_diag.update(unrouted)
+  return summary
+
+def prometheus_text():
+  # All of the metrics in the Prometheus text exposition format
+  lines = [
+    "# HELP succulentpi_duration_seconds Time taken by each part of taking and sending readings",
+    "# TYPE succulentpi_duration_seconds summary",
+  ]
+  with lock:
+    for name, (count, total, _) in sorted(timings.items()):
+      lines.append(f'succulentpi_duration_seconds_count{{stage="{name}"}} {count}')
+      lines.append(f'succulentpi_duration_seconds_sum{{stage="{name}"}} {total:.6f}')
+    lines += [
+      "# HELP succulentpi_last_duration_seconds Time taken by the latest run of each part",
+      "# TYPE succulentpi_last_duration_seconds gauge",
+    ]
+    for name, (_, _, latest) in sorted(timings.items()):
+      lines.append(f'succulentpi_last_duration_seconds{{stage="{name}"}} {latest:.6f}')
+    if counters:
+      lines += [
+        "# HELP succulentpi_events_total Count of events, e.g. readings queued",
+        "# TYPE succulentpi_events_total counter",
+      ]
+      for name, count in sorted(counters.items()):
+        lines.append(f'succulentpi_events_total{{event="{name}"}} {count}')
+  lines += [
+    "# HELP succulentpi_i2c_operations_total GrovePi I2C bus operations, by outcome",
+    "# TYPE succulentpi_i2c_operations_total counter",
+  ]
+  for name, count in sorted(grovepi.get_i2c_stats().items()):
+    lines.append(f'succulentpi_i2c_operations_total{{operation="{name}"}} {count}')
+  return "\n".join(lines) + "\n"
+
+def write_file(path):
+  # Write the metrics to a file, replacing it in one step so that nothing
+  # reading it sees a half written file
+  temp_path = path + ".tmp"
+  try:
+    with open(temp_path, "w") as metrics_file:
+      metrics_file.write(prometheus_text())
+    os.replace(temp_path, path)
+  except:
+    logger.error(f"Error writing metrics to {path}")
+
+
+def serve(port, address=""):
+  # Serve the metrics at /metrics over HTTP, on a background thread
+  ## http.server is only imported here, as the metrics are usually written
+  ## to a file instead
+  import http.server
+
+  class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+      if self.path != "/metrics":
+        self.send_error(404)
+        return
+      body = prometheus_text().encode()
+      self.send_response(200)
+      self.send_header("Content-Type", "text/plain; version=0.0.4")
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, format, *args):
+      logger.debug(f"Metrics request: {format % args}")
+
+  server = http.server.ThreadingHTTPServer((address, port), MetricsHandler)
+  threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+  logger.info(f"Serving metrics on port {port}")
+  return server
@@ -0,0 +1,231 @@
+# SucculentPi Payload Codec
+## Compact encodings of readings for sending over MQTT, and the matching
+## decoder for use in a Lambda function or rule action.
+##
+## The nested JSON readings sent by default repeat every key name in every
+## message. The flat layout instead sends each reading as an array of values,
+## in the order of a versioned list of fields, inside an envelope:
+##   {"v": schema version, "c": client ID, "r": [[timestamp, value, ...], ...]}
+## If the fields being sent don't match a known schema version, e.g. because
+## of a custom sensor map (see readings_schema.py), the envelope has version 0
+## and carries the field names itself in "f", so it can still be decoded.
+##
+## Values which only some readings have, and which go with the fields rather
+## than being fields of their own, are sent in a map after a record's values,
+## only when the reading has any of them:
+##   [timestamp, value, ..., {"a": [anomaly score of each field, ...],
+##                            "n": [window minimum of each field, ...],
+##                            "x": [window maximum of each field, ...],
+##                            "s": [value of each status field, ...],
+##                            "d": [value of each diagnostic, ...]}]
+## Each list is in the order of the fields, or of status_fields or diag_names
+## (see readings_schema.py), with null for those without a value and the nulls at
+## the end left off. Decoders which don't know about the map simply ignore it.
+##
+## The envelope can be serialised as JSON, or as the binary CBOR or
+## MessagePack formats, if the cbor2 or msgpack modules are installed.
+
+import json
+
+import readings_schema
+
+try:
+  import cbor2
+except ImportError:
+  cbor2 = None
+
+try:
+  import msgpack
+except ImportError:
+  msgpack = None
+
+# Known flat layouts; the measure names of the fields, in order
+## Never change an existing version, add a new one instead, so that messages
+## which are queued on a Raspberry Pi can still be decoded
+schemas = {
+  1: (
+    "plant_pot_soil_moisture_top",
+    "plant_pot_soil_moisture_middle",
+    "plant_pot_soil_moisture_bottom",
+    "plant_env_visiblelight",
+    "plant_env_uvlight",
+    "plant_env_irlight",
+    "plant_image_infrared",
+    "room_env_dewpoint",
+    "room_env_temperature",
+    "room_env_relativehumidity",
+    "room_env_absolutehumidty",
+    "room_env_co2",
+    "room_env_voctotal",
+    "room_env_voch2",
+    "room_env_vocethanol",
+    "room_env_pm25",
+  ),
+  ## Version 1 plus the statistics of oversampled moisture readings
+  2: (
+    "plant_pot_soil_moisture_top",
+    "plant_pot_soil_moisture_middle",
+    "plant_pot_soil_moisture_bottom",
+    "plant_env_visiblelight",
+    "plant_env_uvlight",
+    "plant_env_irlight",
+    "plant_image_infrared",
+    "room_env_dewpoint",
+    "room_env_temperature",
+    "room_env_relativehumidity",
+    "room_env_absolutehumidty",
+    "room_env_co2",
+    "room_env_voctotal",
+    "room_env_voch2",
+    "room_env_vocethanol",
+    "room_env_pm25",
+    "plant_pot_soil_moisture_top_median",
+    "plant_pot_soil_moisture_top_mean",
+    "plant_pot_soil_moisture_top_stddev",
+    "plant_pot_soil_moisture_middle_median",
+    "plant_pot_soil_moisture_middle_mean",
+    "plant_pot_soil_moisture_middle_stddev",
+    "plant_pot_soil_moisture_bottom_median",
+    "plant_pot_soil_moisture_bottom_mean",
+    "plant_pot_soil_moisture_bottom_stddev",
+  ),
+}
+
+
+def json_dumps(value):
+  return json.dumps(value, default=str, separators=(",", ":")).encode()
+
+def json_loads(payload):
+  return json.loads(payload)
+
+# Serialisers by name: (dumps, loads), or None if the module isn't installed
+serializers = {
+  "json": (json_dumps, json_loads),
+  "cbor": (cbor2.dumps, cbor2.loads) if cbor2 else None,
+  "msgpack": (msgpack.packb, msgpack.unpackb) if msgpack else None,
+}
+
+
+def is_available(payload_format):
+  # Whether a serialisation format can be used
+  return serializers.get(payload_format) is not None
+
+def extra_fields(field_names):
+  # The measure names sent in the map after a record's values, by their key
+  ## in the map, for the fields 'field_names'
+  ## a: the anomaly score of each field
+  ## n, x: the minimum and maximum of each field's window
+  ## s: the status fields, e.g. whether the Awair's readings are stale
+  ## d: the diagnostics, e.g. how long the reading took to capture
+  return {
+    "a": [readings_schema.anomaly_measure_name(name) for name in field_names],
+    "n": [readings_schema.window_measure_name(name, "min") for name in field_names],
+    "x": [readings_schema.window_measure_name(name, "max") for name in field_names],
+    "s": [measure_name for _, measure_name in readings_schema.status_fields],
+    "d": [measure_name for _, measure_name in readings_schema.diag_fields],
+  }
+
+def current_schema(readings=()):
+  # Schema version and field names for the readings being captured
+  ## Readings which have values (see readings_schema.flatten()) in neither
+  ## the fields nor the map after them are sent with version 0, with a field
+  ## for each
+  field_names = tuple(measure_name for _, measure_name in readings_schema.fields)
+  known = set(field_names).union(*extra_fields(field_names).values())
+  extra = []
+  for data_dict in readings:
+    for measure_name in readings_schema.flatten(data_dict):
+      if measure_name not in known and measure_name not in extra:
+        extra.append(measure_name)
+  if extra:
+    return 0, field_names + tuple(extra)
+  for version, schema_fields in schemas.items():
+    if schema_fields == field_names:
+      return version, field_names
+  return 0, field_names
+
+def flat_record(data_dict, field_names):
+  # A reading as [timestamp, value, ...], followed by the map of the values
+  # which go with the fields, if it has any; missing values are sent as null
+  flat = readings_schema.flatten(data_dict)
+  record = [data_dict.get('timestamp')] + [flat.get(name) for name in field_names]
+  extras = {}
+  for key, names in extra_fields(field_names).items():
+    values = [flat.get(name) for name in names]
+    while values and values[-1] is None:
+      values.pop()
+    if values:
+      extras[key] = values
+  if extras:
+    record.append(extras)
+  return record
+
+def envelope(records, client_id, version, field_names):
+  message = {"v": version, "c": client_id, "r": records}
+  if version == 0:
+    message["f"] = list(field_names)
+  return message
+
+def encode(readings, payload_format, client_id, max_bytes):
+  # Encode a list of readings into as few payloads as possible
+  ## Each payload is kept under max_bytes where possible; a single reading
+  ## which is larger than that on its own is sent in a payload by itself
+  dumps = serializers[payload_format][0]
+  version, field_names = current_schema(readings)
+  records = [flat_record(data_dict, field_names) for data_dict in readings]
+  overhead = len(dumps(envelope([], client_id, version, field_names)))
+
+  ## Estimate each payload's size from the sizes of its records, then check
+  ## the real size and split any payload which turns out too big
+  payloads = []
+  chunk = []
+  chunk_bytes = overhead
+  for record in records + [None]:
+    record_bytes = len(dumps(record)) + 1 if record is not None else 0
+    if chunk and (record is None or chunk_bytes + record_bytes > max_bytes):
+      payloads += encode_chunk(chunk, dumps, client_id, version, field_names, max_bytes)
+      chunk = []
+      chunk_bytes = overhead
+    if record is not None:
+      chunk.append(record)
+      chunk_bytes += record_bytes
+  return payloads
+
+def encode_chunk(records, dumps, client_id, version, field_names, max_bytes):
+  payload = dumps(envelope(records, client_id, version, field_names))
+  if len(payload) <= max_bytes or len(records) == 1:
+    return [payload]
+  middle = len(records) // 2
+  return (encode_chunk(records[:middle], dumps, client_id, version, field_names, max_bytes) +
+          encode_chunk(records[middle:], dumps, client_id, version, field_names, max_bytes))
+
+def decode(payload, payload_format):
+  # Decode a payload back into the client ID and a list of readings
+  ## Each reading is returned as (timestamp, {measure name: value}), with the
+  ## same measure names as iot_messge_routing_rule.sql selects. Null values
+  ## are left out, as the routing rule does.
+  message = serializers[payload_format][1](payload)
+  version = message["v"]
+  field_names = message["f"] if version == 0 else schemas[version]
+  extra_names = extra_fields(field_names)
+  readings = []
+  for record in message["r"]:
+    values = {name: value for name, value in zip(field_names, record[1:])
+              if value is not None}
+    extras = record[len(field_names) + 1] if len(record) > len(field_names) + 1 else {}
+    for key, names in extra_names.items():
+      values.update((name, value) for name, value in zip(names, extras.get(key, []))
+                    if value is not None)
+    readings.append((record[0], values))
+  return message["c"], readings
+
+def detect_format(payload):
+  # Work out which format a payload was serialised with
+  ## JSON envelopes start with '{', MessagePack maps with 0x80-0x8f and CBOR
+  ## maps with 0xa0-0xbf
+  first = payload[0]
+  if first == ord("{"):
+    return "json"
+  if 0x80 <= first <= 0x8f:
+    return "msgpack"
+  return "cbor"
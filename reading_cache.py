@@ -0,0 +1,223 @@
+# SucculentPi Reading Cache
+## Keeps the most recent readings on the Raspberry Pi, so that questions
+## about recent history (e.g. "what was the moisture over the last hour?")
+## can be answered without a round trip to Amazon Timestream.
+##
+## The readings are kept in a fixed-size ring buffer in a memory-mapped file,
+## with one column of doubles for the time of each reading and one for each
+## numeric field (see readings_schema.py). Fields which weren't read, or
+## couldn't be, are kept as NaN. Once the buffer is full, each new reading
+## overwrites the oldest. As the file is memory-mapped, the readings survive
+## data_capture.py being restarted; if the fields or the size of the buffer
+## have changed since the file was written, it is started afresh.
+##
+## The file is laid out as a header followed by the columns:
+##   magic (8 bytes), capacity, number of columns, readings written (all
+##   little endian unsigned 64 bit), then the JSON list of column names,
+##   padded to header_size bytes
+##
+## The cache can be queried over HTTP, on a TCP port or a Unix socket, e.g.
+##   curl 'http://localhost:8081/readings?measure=plant_pot_soil_moisture_top&last=3600&step=300'
+## /readings takes these optional parameters:
+##   measure  a measure name to return; may be given more than once, and
+##            defaults to every measure
+##   start    earliest time to return, in seconds since the epoch
+##   end      latest time to return, in seconds since the epoch
+##   last     return the last this many seconds, in place of start
+##   step     average the readings into buckets of this many seconds
+## and returns {"measures": [...], "rows": [[time, value, ...], ...]}, with
+## null for values which weren't read. /measures lists the measures kept.
+
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+import readings_schema
+from reporting import is_number
+
+logger = logging.getLogger()
+
+magic = b"SPICACHE"
+header_format = "<8sQQQ"
+header_size = 4096
+
+
+class ReadingCache:
+  # Ring buffer of recent readings, in a memory-mapped file
+  ## path:     location of the file
+  ## capacity: number of readings to keep
+
+  def __init__(self, path, capacity=10080):
+    self.capacity = capacity
+    ## The camera's field holds a URL, so it isn't kept
+    cameras = [sensor.path for sensor in readings_schema.sensors_of_type(readings_schema.sensors, "camera")]
+    self.fields = [(path, measure_name) for path, measure_name in readings_schema.fields
+                   if path not in cameras]
+    self.measures = [measure_name for _, measure_name in self.fields]
+    self.lock = threading.Lock()
+    names = json.dumps(["time"] + self.measures).encode()
+    if struct.calcsize(header_format) + len(names) > header_size:
+      raise ValueError("Too many measures to fit in the reading cache's header")
+    size = header_size + 8 * capacity * (len(self.measures) + 1)
+
+    self.file = open(path, "a+b")
+    self.file.seek(0)
+    header = self.file.read(header_size)
+    written = 0
+    if len(header) == header_size:
+      file_magic, file_capacity, file_columns, file_written = struct.unpack_from(header_format, header)
+      file_names = header[struct.calcsize(header_format):].rstrip(b"\0")
+      if file_magic == magic and file_capacity == capacity and file_names == names:
+        written = file_written
+      else:
+        logger.info(f"The reading cache {path} is for other measures or another size; starting afresh")
+    if written == 0:
+      self.file.truncate(0)
+    self.file.truncate(size)
+    self.map = mmap.mmap(self.file.fileno(), size)
+    self.map[struct.calcsize(header_format):header_size] = names.ljust(header_size - struct.calcsize(header_format), b"\0")
+    self.written = written
+    self.write_header()
+    ## One column for the time, and one for each measure
+    self.view = memoryview(self.map)
+    self.columns = [self.view[header_size + 8 * capacity * column:
+                              header_size + 8 * capacity * (column + 1)].cast("d")
+                    for column in range(len(self.measures) + 1)]
+    logger.debug(f"Opened reading cache {path} holding {len(self)} readings")
+
+  def __len__(self):
+    return min(self.written, self.capacity)
+
+  def write_header(self):
+    struct.pack_into(header_format, self.map, 0, magic, self.capacity,
+                     len(self.measures) + 1, self.written)
+
+  def append(self, data_dict, now=None):
+    # Add a reading, overwriting the oldest one if the buffer is full
+    ## The count of readings written is only updated once the reading is in
+    ## place, so a reader never sees a half written one
+    now = time.time() if now is None else now
+    with self.lock:
+      index = self.written % self.capacity
+      self.columns[0][index] = now
+      for column, (path, _) in enumerate(self.fields, 1):
+        value = readings_schema.get_field(data_dict, path)
+        self.columns[column][index] = value if is_number(value) else math.nan
+      self.written += 1
+      self.write_header()
+
+  def query(self, measures=None, start=None, end=None, step=None):
+    # Return the readings between 'start' and 'end', oldest first, as
+    # (measures, rows), where each row is [time, value, ...]
+    ## With 'step', the readings are averaged into buckets of that many
+    ## seconds, each given the time of its start
+    measures = self.measures if measures is None else measures
+    unknown = [measure for measure in measures if measure not in self.measures]
+    if unknown:
+      raise ValueError(f"Unknown measures: {', '.join(unknown)}")
+    columns = [self.measures.index(measure) + 1 for measure in measures]
+    rows = []
+    with self.lock:
+      for offset in range(len(self)):
+        index = (self.written - len(self) + offset) % self.capacity
+        reading_time = self.columns[0][index]
+        if (start is not None and reading_time < start) or (end is not None and reading_time > end):
+          continue
+        rows.append([reading_time] + [self.columns[column][index] for column in columns])
+    if step:
+      rows = downsample(rows, step)
+    return measures, [[row[0]] + [None if math.isnan(value) else value for value in row[1:]]
+                      for row in rows]
+
+  def close(self):
+    with self.lock:
+      for column in self.columns:
+        column.release()
+      self.view.release()
+      self.map.flush()
+      self.map.close()
+      self.file.close()
+
+
+def downsample(rows, step):
+  # Average rows of [time, value, ...] into buckets of 'step' seconds
+  ## NaN values are left out of the averages; a bucket with none is NaN
+  buckets = {}
+  for row in rows:
+    buckets.setdefault(math.floor(row[0] / step) * step, []).append(row[1:])
+  downsampled = []
+  for bucket_time, bucket_rows in buckets.items():
+    means = []
+    for values in zip(*bucket_rows):
+      values = [value for value in values if not math.isnan(value)]
+      means.append(sum(values) / len(values) if values else math.nan)
+    downsampled.append([bucket_time] + means)
+  return downsampled
+
+def serve(cache, port=0, socket_path="", address="localhost"):
+  # Serve queries of the cache over HTTP, on a TCP port or a Unix socket, on
+  # a background thread
+  import http.server
+  import socketserver
+  import urllib.parse
+
+  class CacheHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+      url = urllib.parse.urlsplit(self.path)
+      params = urllib.parse.parse_qs(url.query)
+      if url.path == "/measures":
+        self.send_json(200, {"measures": cache.measures})
+        return
+      if url.path != "/readings":
+        self.send_error(404)
+        return
+      try:
+        start = float(params["start"][0]) if "start" in params else None
+        if "last" in params:
+          start = time.time() - float(params["last"][0])
+        end = float(params["end"][0]) if "end" in params else None
+        step = float(params["step"][0]) if "step" in params else None
+        if step is not None and step <= 0:
+          raise ValueError("step must be positive")
+        measures, rows = cache.query(params.get("measure"), start, end, step)
+      except ValueError as e:
+        self.send_json(400, {"error": str(e)})
+        return
+      self.send_json(200, {"measures": measures, "rows": rows})
+
+    def send_json(self, status, body):
+      body = json.dumps(body).encode()
+      self.send_response(status)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, format, *args):
+      logger.debug(f"Reading cache request: {format % args}")
+
+  if socket_path:
+    ## Remove the socket left behind by an earlier run
+    if os.path.exists(socket_path):
+      os.remove(socket_path)
+
+    class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+      daemon_threads = True
+
+    class UnixCacheHandler(CacheHandler):
+      ## Requests over a Unix socket have no client address
+      def address_string(self):
+        return socket_path
+
+    server = UnixHTTPServer(socket_path, UnixCacheHandler)
+    logger.info(f"Serving the reading cache on {socket_path}")
+  else:
+    server = http.server.ThreadingHTTPServer((address, port), CacheHandler)
+    logger.info(f"Serving the reading cache on port {port}")
+  threading.Thread(target=server.serve_forever, name="reading-cache", daemon=True).start()
+  return server
@@ -0,0 +1,125 @@
+# SucculentPi Reading Queue
+## A small on-disk store-and-forward queue for readings which could not be
+## sent to AWS IoT Core, so that they can be sent later once the MQTT
+## connection is available again rather than being lost.
+##
+## Readings are stored in SQLite in WAL mode. With 'synchronous=NORMAL' a
+## commit in WAL mode only appends to the write-ahead log; the data is only
+## fsync'd to the SD card when the log is checkpointed. On top of this,
+## appended readings are committed in batches of 'sync_batch', so the card
+## isn't written to for every single reading.
+##
+## A queue is opened exclusively by default: an exclusive lock is held on
+## '<path>.lock' for as long as it is open, so that e.g. replay_readings.py
+## can't remove readings from under data_capture.py while it is running.
+
+import json
+import logging
+import sqlite3
+import threading
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+logger = logging.getLogger()
+
+
+class ReadingQueue:
+  # First-in, first-out queue of readings (the 'data_dict' Python dictionaries)
+  ## path:         location of the SQLite database file
+  ## max_readings: once the queue holds this many readings, the oldest are
+  ##               evicted to make room for new ones
+  ## sync_batch:   number of appended readings to hold before committing
+  ## exclusive:    hold a lock on the queue while it is open
+  ## wait:         wait for another process holding the lock to let go of
+  ##               it, rather than raising BlockingIOError
+
+  def __init__(self, path, max_readings=10000, sync_batch=10, exclusive=True, wait=True):
+    self.max_readings = max_readings
+    self.lock_file = None
+    if exclusive and fcntl is not None:
+      self.lock_file = open(path + ".lock", "a")
+      try:
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except OSError:
+        self.lock_file.close()
+        raise BlockingIOError(f"The reading queue {path} is in use by another process")
+    self.sync_batch = sync_batch
+    self.pending = 0
+    ## The queue may be used from the main loop and from MQTT callbacks, so
+    ## access to the connection is serialised
+    self.lock = threading.RLock()
+    self.db = sqlite3.connect(path, check_same_thread=False)
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("PRAGMA synchronous=NORMAL")
+    self.db.execute(
+      "CREATE TABLE IF NOT EXISTS readings ("
+      "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+      "payload TEXT NOT NULL)"
+    )
+    self.db.commit()
+    self.count = self.db.execute("SELECT count(*) FROM readings").fetchone()[0]
+    logger.debug(f"Opened reading queue {path} containing {self.count} readings")
+
+  def __len__(self):
+    return self.count
+
+  def append(self, data_dict):
+    # Add a reading to the end of the queue, evicting the oldest readings if
+    # the queue is full
+    with self.lock:
+      self.db.execute("INSERT INTO readings (payload) VALUES (?)",
+                      (json.dumps(data_dict, default=str),))
+      self.count += 1
+      if self.count > self.max_readings:
+        excess = self.count - self.max_readings
+        logger.error(f"Reading queue is full; discarding the oldest {excess} readings")
+        self.db.execute(
+          "DELETE FROM readings WHERE id IN "
+          "(SELECT id FROM readings ORDER BY id LIMIT ?)", (excess,))
+        self.count = self.max_readings
+      self.pending += 1
+      if self.pending >= self.sync_batch:
+        self.flush()
+
+  def peek(self, limit, after=0):
+    # Return up to 'limit' of the oldest readings as (id, data_dict) tuples
+    ## The readings stay in the queue until they are removed with remove(),
+    ## so nothing is lost if sending them fails part way through. Only
+    ## readings with an id above 'after' are returned, to page through them.
+    with self.lock:
+      rows = self.db.execute(
+        "SELECT id, payload FROM readings WHERE id > ? ORDER BY id LIMIT ?", (after, limit)
+      ).fetchall()
+      ## With nothing left at all, the count is brought up to date, in case
+      ## readings were removed by another connection to the database
+      if not rows and not after:
+        self.count = 0
+    return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+  def remove(self, ids):
+    # Remove readings which have been sent successfully
+    if not ids:
+      return
+    with self.lock:
+      self.db.executemany("DELETE FROM readings WHERE id = ?",
+                          [(row_id,) for row_id in ids])
+      self.db.commit()
+      self.pending = 0
+      self.count = self.db.execute("SELECT count(*) FROM readings").fetchone()[0]
+
+  def flush(self):
+    # Commit any readings which have been appended but not yet committed
+    with self.lock:
+      self.db.commit()
+      self.pending = 0
+
+  def close(self):
+    # Commit outstanding readings and close the database
+    with self.lock:
+      self.flush()
+      self.db.close()
+      if self.lock_file is not None:
+        self.lock_file.close()
@@ -0,0 +1,387 @@
+# SucculentPi Readings Schema
+## The fields of a reading (the 'data_dict' Python dictionary built by
+## data_capture.py), where each one's value comes from, and the names they
+## are stored under in Amazon Timestream.
+##
+## The fields are declared in a sensor map, in the same INI format as
+## config.ini. Each section is the path of a group of fields in the reading,
+## e.g. a pot's soil, and each line in it declares one field:
+##   field name = sensor type [pin=...] [key=...] [measure=...]
+## The sensor types are:
+##   moisture  a Grove moisture sensor on an analog pin, e.g. pin=A0
+##   analog    any other sensor read with analogRead(), e.g. pin=A3
+##   si114x    the Grove sunlight sensor; key is visible, uv or ir
+##   awair     a value from the Awair's local API; key is its name there
+##   camera    the S3 URL of the camera image
+##   pulse     pulses counted on a digital pin, e.g. a rain gauge on pin=D3
+##   flow      a Grove water flow sensor on a digital pin
+##   dust      the Grove dust sensor on a digital pin
+## A field's measure name defaults to its path with "." replaced by "_", e.g.
+## a second pot could be added with:
+##   [pots.basil.soil]
+##   moisture = moisture pin=A3
+## giving a field pots.basil.soil.moisture with the measure name
+## pots_basil_soil_moisture. Moisture sensors also get fields for the
+## statistics of their samples when oversampling (see data_capture.py).
+## Counter sensors (pulse, flow and dust, see counter_sensors.py) give
+## several values, each a field of its own under the sensor's path, e.g.
+##   [garden.env]
+##   rain = pulse pin=D3
+## gives the fields garden.env.rain.pulses, garden.env.rain.total and
+## garden.env.rain.rate, with the measure names garden_env_rain_pulses etc.
+##
+## Without a sensor map file, the default below is used. It matches the
+## routing rule in iot_messge_routing_rule.sql, which can be regenerated from
+## any sensor map with:
+##   python3 readings_schema.py [--map sensor_map.ini] > iot_messge_routing_rule.sql
+## sensor_map.ini.sample is the default map too, regenerated with:
+##   python3 readings_schema.py --sample > sensor_map.ini.sample
+##
+## Readings scored by anomaly_detection.py carry each field's score under
+## "anomaly", by measure name. The scores are written to Timestream under
+## the field's measure name followed by "_anomaly", by a second routing rule
+## in iot_messge_routing_rule_anomaly.sql, regenerated with:
+##   python3 readings_schema.py [--map sensor_map.ini] --anomaly > iot_messge_routing_rule_anomaly.sql
+##
+## Readings whose fields are summarised over a window (see reporting.py)
+## carry each field's minimum and maximum under "window", by measure name,
+## written to Timestream under the field's measure name followed by "_min"
+## and "_max" by the routing rule in iot_messge_routing_rule_window.sql,
+## regenerated with:
+##   python3 readings_schema.py [--map sensor_map.ini] --window > iot_messge_routing_rule_window.sql
+##
+## When the Awair can't be read and its last good readings are used instead,
+## the reading says so under "awair", and iot_messge_routing_rule_awair.sql
+## writes that to Timestream too (see 'status_fields').
+##
+## Readings which reach Timestream by another route (e.g. batched messages
+## fanned out by timestream-ingest-lambda.py) end up with the same measure
+## names as those written by the routing rule, as long as the same sensor map
+## is used there too.
+
+import argparse
+import configparser
+import os
+from collections import namedtuple
+from datetime import datetime, timezone
+
+# Format of the 'timestamp' field of each reading
+timestamp_format = '%Y-%m-%d-%H%M%S'
+
+# Sensor map for the original single pot SucculentPi
+default_sensor_map = """
+# Moisture sensor values reference table, for ease of future use:
+## Min  Typ  Max  Condition
+## ---  ---  ---  ---------
+## 0    0    0    sensor in open air
+## 0    20   300  sensor in dry soil
+## 300  580  700  sensor in humid soil
+## 700  940  950  sensor in water
+[plant.pot.soil]
+moisture_top_a0 = moisture pin=A0 measure=plant_pot_soil_moisture_top
+moisture_middle_a1 = moisture pin=A1 measure=plant_pot_soil_moisture_middle
+moisture_bottom_a2 = moisture pin=A2 measure=plant_pot_soil_moisture_bottom
+
+[plant.env]
+visible_light = si114x key=visible measure=plant_env_visiblelight
+uv_light = si114x key=uv measure=plant_env_uvlight
+ir_light = si114x key=ir measure=plant_env_irlight
+
+[plant.images]
+infrared = camera measure=plant_image_infrared
+
+[room.env]
+# Dew point in ºC
+dew_point = awair key=dew_point measure=room_env_dewpoint
+# Temperature in ºC
+temp = awair key=temp measure=room_env_temperature
+# Relative humidity in %
+rel_humid = awair key=humid measure=room_env_relativehumidity
+# Absolute humidity in g/m³
+abs_humid = awair key=abs_humid measure=room_env_absolutehumidty
+# CO2 in ppm
+co2 = awair key=co2 measure=room_env_co2
+# Total VOCs in ppb
+voc_total = awair key=voc measure=room_env_voctotal
+# Hydrogen sensor signal (unitless)
+voc_h2 = awair key=voc_h2_raw measure=room_env_voch2
+# Ethanol sensor signal (unitless)
+voc_ethanol = awair key=voc_ethanol_raw measure=room_env_vocethanol
+# Particulates < 2.5 microns in size in µg/m³
+pm25 = awair key=pm25 measure=room_env_pm25
+
+# Counter sensors on the GrovePi's digital pins (D2-D8), each giving several
+# fields, e.g. garden.env.rain.total; see readings_schema.py
+#[garden.env]
+## Tipping bucket rain gauge; pulses, total in mm and rate in mm/minute
+#rain = pulse pin=D3
+## Grove water flow sensor; pulses, total in litres and rate in litres/minute
+#water_flow = flow pin=D4
+## Grove dust sensor; low pulse occupancy, ratio and concentration
+#dust = dust pin=D2
+"""
+
+sensor_types = ["moisture", "analog", "si114x", "awair", "camera", "pulse", "flow", "dust"]
+
+# The values given by each type of counter sensor, in the order of their fields
+counter_readings = {
+  "pulse": ["pulses", "total", "rate"],
+  "flow": ["pulses", "total", "rate"],
+  "dust": ["low_pulse_occupancy", "ratio", "concentration"],
+}
+
+# Statistics published for each moisture sensor when oversampling
+moisture_statistics = ["median", "mean", "stddev"]
+
+# A field of a reading, and the sensor its value comes from
+## path: dotted path of the field in the reading
+## measure_name: Timestream measure name
+## sensor_type: one of sensor_types
+## pin: analog pin number, for moisture and analog sensors, or digital pin
+##      number, for counter sensors
+## key: which of the sensor's values, for si114x and awair sensors
+Sensor = namedtuple("Sensor", ["path", "measure_name", "sensor_type", "pin", "key"])
+
+
+def parse_sensor_map(text):
+  # Parse a sensor map into a list of Sensors, in the order they're declared
+  parser = configparser.RawConfigParser()
+  ## Keep the case of field names
+  parser.optionxform = str
+  parser.read_string(text)
+  sensors = []
+  for group in parser.sections():
+    for name, declaration in parser.items(group):
+      sensor_type, *options = declaration.split()
+      if sensor_type not in sensor_types:
+        raise ValueError(f"Unknown sensor type {sensor_type} for {group}.{name}")
+      options = dict(option.split("=", 1) for option in options)
+      path = f"{group}.{name}"
+      pin = options.get("pin")
+      if pin is not None:
+        pin = int(pin.upper().lstrip("AD"))
+      elif sensor_type in ["moisture", "analog"] + list(counter_readings):
+        raise ValueError(f"No pin given for {path}")
+      if sensor_type == "si114x" and options.get("key") not in ("visible", "uv", "ir"):
+        raise ValueError(f"The key for {path} must be visible, uv or ir")
+      if sensor_type == "awair" and "key" not in options:
+        raise ValueError(f"No key given for {path}")
+      sensors.append(Sensor(path, options.get("measure", path.replace(".", "_")),
+                            sensor_type, pin, options.get("key")))
+  if len(sensors_of_type(sensors, "camera")) > 1:
+    raise ValueError("Only one camera field can be declared")
+  return sensors
+
+def load_sensor_map(path):
+  # Use the sensor map in a file in place of the default
+  global sensors, fields
+  with open(path) as map_file:
+    sensors = parse_sensor_map(map_file.read())
+  fields = schema_fields(sensors)
+
+def sensors_of_type(sensors, *types):
+  return [sensor for sensor in sensors if sensor.sensor_type in types]
+
+def statistics_path(sensor, statistic):
+  # Path of one of the statistics of an oversampled moisture sensor
+  group, name = sensor.path.rsplit(".", 1)
+  return f"{group}.filtering.{name}.{statistic}"
+
+def counter_path(sensor, reading):
+  # Path of one of the values of a counter sensor
+  return f"{sensor.path}.{reading}"
+
+def schema_fields(sensors):
+  # (path of the field in the reading, Timestream measure name) for each field
+  ## The statistics of moisture sensors come after all of the other fields,
+  ## so that adding them didn't change the order of the fields before them
+  schema = []
+  for sensor in sensors:
+    if sensor.sensor_type in counter_readings:
+      schema += [(counter_path(sensor, reading), f"{sensor.measure_name}_{reading}")
+                 for reading in counter_readings[sensor.sensor_type]]
+    else:
+      schema.append((sensor.path, sensor.measure_name))
+  for sensor in sensors_of_type(sensors, "moisture"):
+    for statistic in moisture_statistics:
+      schema.append((statistics_path(sensor, statistic), f"{sensor.measure_name}_{statistic}"))
+  return schema
+
+def routing_rule_sql(topic="succulentpi/readings"):
+  # The AWS IoT Core routing rule selecting every field under its measure name
+  selects = ",\n".join(f"  {path} AS {measure_name}" for path, measure_name in fields)
+  return f"SELECT\n{selects}\nFROM\n  '{topic}'"
+
+# Fields about how a reading was taken, rather than from a sensor, which are
+# only there some of the time, as (path, measure name)
+## payload_codec.py sends these by their position in this list, so only ever
+## add to the end of it
+## awair.stale: true when the Awair's readings are its last good ones
+## awair.age:   how old those readings are, in seconds
+status_fields = [
+  ("awair.stale", "awair_stale"),
+  ("awair.age", "awair_age"),
+]
+
+# The diagnostics added to readings under "diag" (see metrics.py)
+## They are written to Timestream prefixed with "diag_" by the routing rule
+## in iot_messge_routing_rule_diag.sql, regenerated with:
+##   python3 readings_schema.py --diag > iot_messge_routing_rule_diag.sql
+## payload_codec.py sends these by their position in this list, so only ever
+## add to the end of it
+diag_names = [
+  "capture_ms",
+  "stage_grove_ms",
+  "stage_awair_ms",
+  "stage_camera_ms",
+  "grove_moisture_ms",
+  "grove_si114x_ms",
+  "awair_api_ms",
+  "camera_capture_ms",
+  "s3_upload_ms",
+  "mqtt_publish_ms",
+  "i2c_writes",
+  "i2c_reads",
+  "i2c_write_errors",
+  "i2c_write_failures",
+  "i2c_read_errors",
+  "i2c_not_ready",
+  "i2c_response_failures",
+  "stage_counters_ms",
+  "camera_convert_ms",
+]
+diag_fields = [(f"diag.{name}", f"diag_{name}") for name in diag_names]
+
+def diag_rule_sql(topic="succulentpi/readings"):
+  # The AWS IoT Core routing rule selecting the diagnostics, for readings
+  # which have them
+  selects = ",\n".join(f"  {path} AS {measure_name}" for path, measure_name in diag_fields)
+  return f"SELECT\n{selects}\nFROM\n  '{topic}'\nWHERE\n  isUndefined(diag) = false"
+
+sensors = parse_sensor_map(default_sensor_map)
+fields = schema_fields(sensors)
+
+## The sensor map can also be given by environment variable, e.g. for
+## timestream-ingest-lambda.py
+if os.environ.get("SUCCULENTPI_SENSOR_MAP"):
+  load_sensor_map(os.environ["SUCCULENTPI_SENSOR_MAP"])
+
+
+def anomaly_measure_name(measure_name):
+  # Measure name of the anomaly score of a field
+  return f"{measure_name}_anomaly"
+
+def anomaly_rule_sql(topic="succulentpi/readings"):
+  # The AWS IoT Core routing rule selecting the anomaly score of every
+  # numeric field, for readings which have been scored
+  cameras = [sensor.path for sensor in sensors_of_type(sensors, "camera")]
+  selects = ",\n".join(f"  anomaly.{measure_name} AS {anomaly_measure_name(measure_name)}"
+                       for path, measure_name in fields if path not in cameras)
+  return f"SELECT\n{selects}\nFROM\n  '{topic}'\nWHERE\n  isUndefined(anomaly) = false"
+
+# Statistics of the values of a field summarised over a window
+window_statistics = ["min", "max"]
+
+def window_measure_name(measure_name, statistic):
+  # Measure name of a statistic of a field's window
+  return f"{measure_name}_{statistic}"
+
+def window_rule_sql(topic="succulentpi/readings"):
+  # The AWS IoT Core routing rule selecting the minimum and maximum of every
+  # numeric field, for readings which have been summarised over a window
+  cameras = [sensor.path for sensor in sensors_of_type(sensors, "camera")]
+  selects = ",\n".join(f"  window.{measure_name}.{statistic} AS {window_measure_name(measure_name, statistic)}"
+                       for path, measure_name in fields if path not in cameras
+                       for statistic in window_statistics)
+  return f"SELECT\n{selects}\nFROM\n  '{topic}'\nWHERE\n  isUndefined(window) = false"
+
+def get_field(data_dict, path):
+  # Look up a dotted path in a reading, returning None if it isn't there
+  value = data_dict
+  for key in path.split("."):
+    if not isinstance(value, dict) or key not in value:
+      return None
+    value = value[key]
+  return value
+
+def set_field(data_dict, path, value):
+  # Set a dotted path in a reading, creating any dictionaries on the way
+  keys = path.split(".")
+  for key in keys[:-1]:
+    data_dict = data_dict.setdefault(key, {})
+  data_dict[keys[-1]] = value
+
+def flatten(data_dict):
+  # Map a reading to {measure name: value}, as selected by the routing rule
+  ## Like the routing rule, fields which are missing or null are left out.
+  ## Anomaly scores, window statistics, status fields and diagnostics are
+  ## included, as selected by their own routing rules.
+  flat = {}
+  for path, measure_name in fields + status_fields + diag_fields:
+    value = get_field(data_dict, path)
+    if value is not None:
+      flat[measure_name] = value
+  for measure_name, score in (data_dict.get("anomaly") or {}).items():
+    flat[anomaly_measure_name(measure_name)] = score
+  for measure_name, summary in (data_dict.get("window") or {}).items():
+    for statistic in window_statistics:
+      if summary.get(statistic) is not None:
+        flat[window_measure_name(measure_name, statistic)] = summary[statistic]
+  return flat
+
+def reading_time(timestamp, tz=timezone.utc):
+  # Time of a reading, in milliseconds since the epoch
+  ## The timestamp in the reading has no time zone; 'tz' is the time zone of
+  ## the Raspberry Pi which took it
+  reading_datetime = datetime.strptime(timestamp, timestamp_format)
+  return int(reading_datetime.replace(tzinfo=tz).timestamp() * 1000)
+
+def measure_type(value):
+  # Timestream measure value type for a value
+  if isinstance(value, bool):
+    return "BOOLEAN"
+  if isinstance(value, int):
+    return "BIGINT"
+  if isinstance(value, float):
+    return "DOUBLE"
+  return "VARCHAR"
+
+def flat_records(timestamp, flat, tz=timezone.utc):
+  # Build the Timestream records for a flattened reading, one per measure
+  time_ms = str(reading_time(timestamp, tz))
+  return [
+    {
+      "MeasureName": measure_name,
+      "MeasureValue": str(value).lower() if isinstance(value, bool) else str(value),
+      "MeasureValueType": measure_type(value),
+      "Time": time_ms,
+      "TimeUnit": "MILLISECONDS",
+    }
+    for measure_name, value in flat.items()
+  ]
+
+def timestream_records(data_dict, tz=timezone.utc):
+  # Build the Timestream records for a reading, one per measure
+  return flat_records(data_dict['timestamp'], flatten(data_dict), tz)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Generate the AWS IoT Core routing rule for a sensor map")
+  parser.add_argument("--map", help="Sensor map file (default: the built in map)")
+  parser.add_argument("--topic", default="succulentpi/readings", help="MQTT topic the readings are sent to")
+  parser.add_argument("--anomaly", action="store_true", help="Generate the rule for the anomaly scores")
+  parser.add_argument("--window", action="store_true", help="Generate the rule for the window statistics")
+  parser.add_argument("--diag", action="store_true", help="Generate the rule for the diagnostics")
+  parser.add_argument("--sample", action="store_true", help="Print the default sensor map")
+  args = parser.parse_args()
+  if args.map:
+    load_sensor_map(args.map)
+  if args.sample:
+    print(default_sensor_map.lstrip("\n"), end="")
+  elif args.anomaly:
+    print(anomaly_rule_sql(args.topic), end="")
+  elif args.window:
+    print(window_rule_sql(args.topic), end="")
+  elif args.diag:
+    print(diag_rule_sql(args.topic), end="")
+  else:
+    print(routing_rule_sql(args.topic), end="")
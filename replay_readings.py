@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# SucculentPi Reading Replay
+## Writes readings which never reached Amazon Timestream, e.g. after an
+## outage, straight into it, rather than sending them one MQTT message at a
+## time through the routing rule.
+##
+## The readings can come from the local reading queue (see reading_queue.py)
+## and from archive files of readings (the 'data_dict' Python dictionaries),
+## as either JSON lines, a JSON array, or batch messages as sent on the batch
+## topic. Each reading's fields are written with the same measure names as
+## iot_messge_routing_rule.sql (see readings_schema.py), at the time in the
+## reading's timestamp rather than the time they are written, in batches of
+## up to 100 records, several batches at a time. For example:
+##   replay_readings.py --database succulentpi --table sensordata \
+##     --queue reading_queue.db --remove --timezone Europe/Zurich
+##   replay_readings.py --database succulentpi --table sensordata readings.jsonl
+##
+## With --remove, queued readings are removed from the queue once written, so
+## that data_capture.py doesn't send them again. Timestream rejects records
+## older than its memory store retention; these are logged and counted, and
+## are removed too, as writing them again would never succeed. Removing
+## readings needs the queue to itself, so --remove refuses to run while
+## data_capture.py has the queue open (e.g. in daemon mode); stop it first.
+## Without --remove, the queue is only read and can be replayed at any time.
+## Readings which are written twice are written with the same time and values,
+## so replaying the same readings again is harmless.
+
+import argparse
+import concurrent.futures
+import configparser
+import json
+import logging
+import sys
+from zoneinfo import ZoneInfo
+
+import readings_schema
+from reading_queue import ReadingQueue
+
+logger = logging.getLogger()
+
+# Timestream accepts at most 100 records per WriteRecords call
+MAX_RECORDS_PER_WRITE = 100
+
+
+def load_archive(path):
+  # Return the readings in an archive file
+  with open(path) as archive_file:
+    text = archive_file.read()
+  try:
+    documents = [json.loads(text)]
+  except json.JSONDecodeError:
+    ## JSON lines, one reading or batch message per line
+    documents = [json.loads(line) for line in text.splitlines() if line.strip()]
+  readings = []
+  for document in documents:
+    if isinstance(document, list):
+      readings += document
+    elif "readings" in document:
+      readings += document["readings"]
+    else:
+      readings.append(document)
+  return readings
+
+def reading_records(readings, tz):
+  # Build the Timestream records for a list of readings
+  ## Readings without a timestamp can't be placed in time, so are skipped
+  records = []
+  for data_dict in readings:
+    if "timestamp" not in data_dict:
+      logger.error(f"Skipping a reading without a timestamp: {json.dumps(data_dict, default=str)}")
+      continue
+    records += readings_schema.timestream_records(data_dict, tz)
+  return records
+
+
+class Replayer:
+  # Writes records to a Timestream table, several batches at a time
+  ## client:      boto3 timestream-write client to use
+  ## concurrency: number of WriteRecords calls to make at once
+
+  def __init__(self, client, database, table, client_id, concurrency=4):
+    self.client = client
+    self.database = database
+    self.table = table
+    self.dimensions = [{"Name": "client_id", "Value": str(client_id)}]
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency,
+                                                          thread_name_prefix="replay")
+    self.written = 0
+    self.rejected = 0
+
+  def write_batch(self, records):
+    # Write up to 100 records, returning how many Timestream rejected
+    try:
+      self.client.write_records(
+        DatabaseName=self.database,
+        TableName=self.table,
+        CommonAttributes={"Dimensions": self.dimensions},
+        Records=records
+      )
+    except self.client.exceptions.RejectedRecordsException as e:
+      rejected = e.response.get("RejectedRecords", [])
+      for record in rejected:
+        logger.error(f"Rejected record {records[record['RecordIndex']]}: {record['Reason']}")
+      return len(rejected)
+    return 0
+
+  def write(self, records):
+    # Write a list of records in batches, returning True if every batch was
+    # written, even if some of their records were rejected
+    futures = [self.executor.submit(self.write_batch, records[start:start + MAX_RECORDS_PER_WRITE])
+               for start in range(0, len(records), MAX_RECORDS_PER_WRITE)]
+    succeeded = True
+    for future, start in zip(futures, range(0, len(records), MAX_RECORDS_PER_WRITE)):
+      try:
+        rejected = future.result()
+      except Exception as e:
+        logger.error(f"Error writing records: {e}")
+        succeeded = False
+        continue
+      self.rejected += rejected
+      self.written += len(records[start:start + MAX_RECORDS_PER_WRITE]) - rejected
+    return succeeded
+
+  def close(self):
+    self.executor.shutdown()
+
+def replay_queue(replayer, queue, tz, page, remove):
+  # Replay the readings in the reading queue, 'page' readings at a time
+  ## Returns True if every page was written
+  try:
+    reading_queue = ReadingQueue(queue, exclusive=remove, wait=False)
+  except BlockingIOError as e:
+    logger.error(f"{e}; stop data_capture.py to replay with --remove")
+    return False
+  succeeded = True
+  last_id = 0
+  try:
+    while True:
+      queued = reading_queue.peek(page, after=last_id)
+      if not queued:
+        return succeeded
+      logger.info(f"Replaying {len(queued)} of {len(reading_queue)} queued readings")
+      if not replayer.write(reading_records([data_dict for _, data_dict in queued], tz)):
+        ## Failed pages are left in the queue, to be sent by data_capture.py
+        ## or replayed again
+        succeeded = False
+      elif remove:
+        reading_queue.remove([row_id for row_id, _ in queued])
+      last_id = queued[-1][0]
+  finally:
+    reading_queue.close()
+
+def main():
+  parser = argparse.ArgumentParser(description="Write queued or archived SucculentPi readings to Amazon Timestream")
+  parser.add_argument("archives", nargs="*", help="Archive files of readings to replay")
+  parser.add_argument("--queue", help="Reading queue database to replay, e.g. reading_queue.db")
+  parser.add_argument("--remove", action="store_true",
+                      help="Remove queued readings from the queue once written")
+  parser.add_argument("--database", required=True, help="Timestream database")
+  parser.add_argument("--table", required=True, help="Timestream table")
+  parser.add_argument("--region", help="AWS region of the Timestream database")
+  parser.add_argument("--client-id",
+                      help="client_id dimension to write (default: the client_id in config.ini)")
+  parser.add_argument("--timezone", default="UTC",
+                      help="Time zone of the Raspberry Pi which took the readings")
+  parser.add_argument("--sensor-map", help="Sensor map the readings were taken with")
+  parser.add_argument("--concurrency", type=int, default=4,
+                      help="Number of batches of records to write at once")
+  parser.add_argument("--page", type=int, default=1000,
+                      help="Number of queued readings to replay at a time")
+  parser.add_argument("--verbose", action="store_true", help="Enable debug logging")
+  args = parser.parse_args()
+
+  logging.basicConfig(format='%(asctime)s %(message)s',
+                      level=logging.DEBUG if args.verbose else logging.INFO)
+  if not args.archives and not args.queue:
+    parser.error("give archive files and/or --queue to replay")
+  if args.sensor_map:
+    readings_schema.load_sensor_map(args.sensor_map)
+  client_id = args.client_id
+  if client_id is None:
+    config = configparser.RawConfigParser()
+    config.read("config.ini")
+    client_id = config.get('AWS_IOT_MQTT', 'client_id', fallback=None)
+    if client_id is None:
+      parser.error("no --client-id given, and no client_id in config.ini")
+  tz = ZoneInfo(args.timezone)
+
+  import boto3
+  from botocore.config import Config
+  ## Allow a connection for each batch being written at once
+  client = boto3.client('timestream-write', region_name=args.region,
+                        config=Config(max_pool_connections=max(10, args.concurrency)))
+  replayer = Replayer(client, args.database, args.table, client_id, args.concurrency)
+  succeeded = True
+  try:
+    for archive in args.archives:
+      readings = load_archive(archive)
+      logger.info(f"Replaying {len(readings)} readings from {archive}")
+      succeeded = replayer.write(reading_records(readings, tz)) and succeeded
+    if args.queue:
+      succeeded = replay_queue(replayer, args.queue, tz, args.page, args.remove) and succeeded
+  finally:
+    replayer.close()
+  logger.info(f"Wrote {replayer.written} records; {replayer.rejected} were rejected")
+  return 0 if succeeded else 1
+
+if __name__ == "__main__":
+  sys.exit(main())
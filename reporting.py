@@ -0,0 +1,178 @@
+# SucculentPi Change Reporting
+## Cuts down the readings which are sent to AWS IoT Core, and so written to
+## Amazon Timestream, for sensors whose values barely change between readings.
+##
+## Each field (see readings_schema.py) can be given a deadband: a new value
+## is only sent if it differs from the last value sent by at least that much.
+## Every field is still sent at least once every 'heartbeat' seconds, so that
+## Timestream always has recent data and the missing data alarm keeps working.
+## The heartbeat is checked against the time each reading is filtered, so a
+## field which just misses it is only sent with the next reading, a sample
+## interval later, and the time taken to capture a reading varies. It must
+## therefore be shorter than the window the alerter looks for data in (see
+## timestream-alerter-lambda.py, 5 minutes by default) by at least the sample
+## interval, plus some slack, or the alerter reports steady sensors as
+## missing. data_capture.py defaults it to exactly that, which with the
+## default 5 minute window and sample interval is 0, i.e. every field is sent
+## with every reading; deadbands only save anything with a longer window.
+##
+## Optionally, each numeric field's values can be collected over a window of
+## several readings, with their mean sent in the field once the window is
+## full, and their minimum and maximum under "window", by measure name (see
+## readings_schema.py). A field due a heartbeat is sent with whatever values
+## its window holds, so windows never keep a field from Timestream for longer
+## than the heartbeat.
+
+import copy
+import json
+import logging
+import os
+import threading
+import time
+
+import readings_schema
+
+logger = logging.getLogger()
+
+
+def remove_field(data_dict, path):
+  # Remove a dotted path from a reading, along with any dictionaries left empty
+  keys = path.split(".")
+  parents = [data_dict]
+  for key in keys[:-1]:
+    if not isinstance(parents[-1].get(key), dict):
+      return
+    parents.append(parents[-1][key])
+  parents[-1].pop(keys[-1], None)
+  for parent, key in zip(reversed(parents[:-1]), reversed(keys[:-1])):
+    if parent[key]:
+      break
+    del parent[key]
+
+def is_number(value):
+  return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+# State which has to outlast a single reading, e.g. the last values sent, is
+# kept in small JSON files, so that it works the same when data_capture.py is
+# run once per reading (e.g. from cron) as it does in daemon mode
+
+def read_json(path, default):
+  # Read a JSON file, returning 'default' if there isn't one yet, or if it
+  # can't be read, in which case the state starts afresh
+  try:
+    with open(path) as json_file:
+      return json.load(json_file)
+  except FileNotFoundError:
+    return default
+  except:
+    logger.error(f"Error loading {path}; starting afresh")
+    return default
+
+def write_json(path, data):
+  # Write data to a JSON file via a temporary file which then replaces the
+  # old one, so that a power cut can't leave a half written file behind
+  temp_path = path + ".tmp"
+  with open(temp_path, "w") as json_file:
+    json.dump(data, json_file, default=str)
+  os.replace(temp_path, path)
+
+
+class ChangeReporter:
+  # Decides which of the fields of each reading need to be sent
+  ## state_path: location of the JSON file holding the last values sent
+  ## deadbands:  {measure name: smallest change worth sending}; fields with
+  ##             no deadband are sent every time they are read
+  ## heartbeat:  seconds after which a field is sent even if it hasn't changed
+  ## window:     number of values of each numeric field to summarise into
+  ##             their mean, minimum and maximum; 1 sends every value as it is
+  ##             read
+
+  def __init__(self, state_path, deadbands=None, heartbeat=0, window=1):
+    self.state_path = state_path
+    self.deadbands = deadbands or {}
+    self.heartbeat = heartbeat
+    self.window = max(1, window)
+    self.lock = threading.Lock()
+    ## {measure name: {"value": last value sent, "sent": epoch seconds it was
+    ## sent, "window": values waiting to be summarised}}
+    self.state = read_json(self.state_path, {})
+
+  def save(self):
+    try:
+      write_json(self.state_path, self.state)
+    except:
+      logger.error(f"Error saving reporting state to {self.state_path}")
+
+  def heartbeat_due(self, field_state, now):
+    return "sent" not in field_state or now - field_state["sent"] >= self.heartbeat
+
+  def window_summary(self, field_state, value, now):
+    # Add a value to a field's window, returning the (mean, minimum, maximum)
+    # of its values once it is full or the field is due a heartbeat, or None
+    # until then
+    values = field_state.setdefault("window", [])
+    values.append(value)
+    if len(values) < self.window and not self.heartbeat_due(field_state, now):
+      return None
+    field_state["window"] = []
+    mean = sum(values) / len(values)
+    ## Keep whole number fields whole, so Timestream keeps their type
+    if all(isinstance(window_value, int) for window_value in values):
+      mean = int(round(mean))
+    return mean, min(values), max(values)
+
+  def changed(self, measure_name, field_state, value, now):
+    # Whether a value needs to be sent
+    if "value" not in field_state or self.heartbeat_due(field_state, now):
+      return True
+    deadband = self.deadbands.get(measure_name)
+    if deadband is None:
+      return True
+    if not is_number(value) or not is_number(field_state["value"]):
+      return value != field_state["value"]
+    return abs(value - field_state["value"]) >= deadband
+
+  def filter(self, data_dict, always=()):
+    # Return the reading with the fields which don't need to be sent removed,
+    # or None if there is nothing left in it worth sending
+    ## Works on partial readings too, e.g. the message sent once a camera
+    ## image has been uploaded; only the fields present are looked at.
+    ## The fields whose measure names are in 'always', e.g. anomalous values,
+    ## are sent as they are, bypassing the window and deadband.
+    now = time.time()
+    reading = copy.deepcopy(data_dict)
+    with self.lock:
+      for path, measure_name in readings_schema.fields:
+        value = readings_schema.get_field(reading, path)
+        if value is None:
+          ## Missing fields, and those which couldn't be read, are passed on
+          ## as they are
+          continue
+        field_state = self.state.setdefault(measure_name, {})
+        if measure_name in always:
+          field_state["value"] = value
+          field_state["sent"] = now
+          continue
+        if self.window > 1 and is_number(value):
+          summary = self.window_summary(field_state, value, now)
+          if summary is None:
+            remove_field(reading, path)
+            continue
+          value, minimum, maximum = summary
+          readings_schema.set_field(reading, path, value)
+          reading.setdefault("window", {})[measure_name] = {"min": minimum, "max": maximum}
+        if not self.changed(measure_name, field_state, value, now):
+          remove_field(reading, path)
+          remove_field(reading, f"window.{measure_name}")
+          continue
+        field_state["value"] = value
+        field_state["sent"] = now
+      self.save()
+
+    remaining = [path for path, _ in readings_schema.fields
+                 if readings_schema.get_field(reading, path) is not None]
+    if not remaining:
+      logger.info("No readings have changed enough to be sent")
+      return None
+    logger.debug(f"Sending {len(remaining)} of {len(readings_schema.fields)} fields")
+    return reading
@@ -0,0 +1,59 @@
+# SucculentPi Scheduler
+## Decides when each group of sensors is next due to be read in daemon mode,
+## so that e.g. the soil moisture can be read every minute while the camera
+## only takes a picture every hour.
+##
+## The groups are kept in a priority queue (a heap) ordered by when each is
+## next due. Groups which fall due within 'coalesce' seconds of each other
+## are returned together, so that they're read as part of the same reading
+## and, for sensors on the I2C bus, in the same bus transaction.
+##
+## Each time a group is read its next reading is scheduled 'period' seconds
+## after the last one was due, plus a random delay of up to its jitter in
+## seconds, so that several Raspberry Pis started at the same time don't all
+## read and send at the same moment. Each group can have its own jitter.
+
+import heapq
+import random
+import time
+
+
+class Scheduler:
+  # Priority queue of sensor groups by the time they are next due
+  ## periods:  {group name: seconds between readings}
+  ## jitter:   largest random delay added to each reading, in seconds
+  ## jitters:  {group name: largest random delay}, for groups whose jitter
+  ##           isn't 'jitter'
+  ## coalesce: groups due within this many seconds are read together
+
+  def __init__(self, periods, jitter=0, coalesce=1, jitters=None):
+    self.periods = periods
+    self.coalesce = coalesce
+    jitters = jitters or {}
+    ## Every group is due straight away, so that the first reading has all
+    ## of them. Entries are (time due, group, time due without jitter,
+    ## the group's jitter).
+    now = time.monotonic()
+    self.queue = [(now, group, now, jitters.get(group, jitter)) for group in periods]
+    heapq.heapify(self.queue)
+
+  def wait_time(self):
+    # Seconds until the next group is due
+    return max(0, self.queue[0][0] - time.monotonic())
+
+  def due(self):
+    # Return the groups which are due now, or within 'coalesce' seconds, and
+    # schedule their next readings
+    now = time.monotonic()
+    groups = set()
+    while self.queue and self.queue[0][0] <= now + self.coalesce and self.queue[0][1] not in groups:
+      _, group, scheduled, jitter = heapq.heappop(self.queue)
+      groups.add(group)
+      ## The jitter isn't carried forward, so readings don't drift later
+      scheduled += self.periods[group]
+      ## After falling behind, e.g. a reading which overran, carry on from
+      ## now rather than trying to catch up with every missed reading
+      if scheduled <= now:
+        scheduled = now + self.periods[group]
+      heapq.heappush(self.queue, (scheduled + random.uniform(0, jitter), group, scheduled, jitter))
+    return groups
@@ -19,4 +19,13 @@ sudo pip3 install seeed-python-si114x
 
 # Install AWS SDKs
 sudo apt-get install python3-boto3 cmake libssl-dev -y
-sudo pip3 install awsiotsdk
\ No newline at end of file
+sudo pip3 install awsiotsdk
+# Install the Awair local API client
+sudo apt-get install python3-requests -y
+
+# Optional extras; without them data_capture.py falls back to slower paths
+## Pillow: WebP camera images and skipping unchanged images ([CAMERA] format
+## and dedup_threshold)
+sudo apt-get install python3-pil -y
+## cbor2 and msgpack: the binary payload formats ([PUBLISHING] payload_format)
+sudo pip3 install cbor2 msgpack
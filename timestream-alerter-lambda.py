@@ -2,11 +2,31 @@
 # Adapted from the AWS blog post "Trigger notifications on time series data with Amazon Timestream"
 # https://aws.amazon.com/blogs/database/trigger-notifications-on-time-series-data-with-amazon-timestream/
 #
+# Checks every measure in a table of alert rules with one query. The rules are
+# given as JSON in the ALERT_RULES environment variable, e.g.
+#   [{"measure": "plant_pot_soil_moisture_top", "min": 0, "max": 950, "window": "5m"},
+#    {"measure": "room_env_temperature", "min": 5, "max": 35, "window": "15m"}]
+# A rule is broken if the measure has no data within its window, or any value
+# within its window is below "min" or above "max". "min" and "max" are both
+# optional, and "window" defaults to 5m. Without ALERT_RULES, the single
+# measure given by VALUE_NAME is checked against 0-950 over 5m, as before.
+#
+# A single SNS message is only sent when measures start or stop breaking
+# their rules, covering all of them; see alert_state.py. The alerts which are
+# open are kept in the DynamoDB table named by ALERT_STATE_TABLE, or without
+# it in the SQLite file at ALERT_STATE_PATH, which in Lambda only lasts as
+# long as the container does.
+# Deploy together with alert_state.py.
+#
 
 import boto3
 import json
 import logging
 import os
+import re
+import time
+
+import alert_state
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -14,56 +34,161 @@ logger.setLevel(logging.INFO)
 SUCCULENTPI_DATABASE = os.environ.get("SUCCULENTPI_DATABASE", "")
 SUCCULENTPI_TABLE = os.environ.get("SUCCULENTPI_TABLE", "")
 VALUE_NAME = os.environ.get("VALUE_NAME", "")
+ALERT_RULES = os.environ.get("ALERT_RULES", "")
 SNS_TOPIC = os.environ.get("SNS_TOPIC", "")
-
+ALERT_STATE_TABLE = os.environ.get("ALERT_STATE_TABLE", "")
+ALERT_STATE_PATH = os.environ.get("ALERT_STATE_PATH", "/tmp/succulentpi-alert-state.db")
 logger.info("SUCCULENTPI_DATABASE: {} SUCCULENTPI_TABLE: {} ".format(SUCCULENTPI_DATABASE, SUCCULENTPI_TABLE))
 
-QUERY =  f'SELECT * FROM "{SUCCULENTPI_DATABASE}"."{SUCCULENTPI_TABLE}" WHERE (time between ago(5m) and now()) and (measure_name = \'{VALUE_NAME}\')'
- 
+DEFAULT_WINDOW = "5m"
+
+# Measure names and windows are put into the query as they are, so only
+# allow the characters they can really contain
+MEASURE_PATTERN = re.compile(r"^[A-Za-z0-9_.\-]+$")
+WINDOW_PATTERN = re.compile(r"^[0-9]+(ns|us|ms|s|m|h|d)$")
+WINDOW_SECONDS = {"ns": 1e-9, "us": 1e-6, "ms": 1e-3, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# Clients are created once per Lambda container and reused by every
+# invocation it handles, rather than once per invocation
+## The Timestream query client discovers its endpoint itself, and caches it
+## for as long as Timestream allows, so describe_endpoints() isn't called here
+c_ts_query = boto3.client('timestream-query')
+sns = boto3.client('sns')
+
+if ALERT_STATE_TABLE:
+    alert_store = alert_state.DynamoDBAlertState(ALERT_STATE_TABLE, boto3.client('dynamodb'))
+else:
+    logger.warning(f"ALERT_STATE_TABLE not defined; keeping alert state in {ALERT_STATE_PATH}")
+    alert_store = alert_state.SQLiteAlertState(ALERT_STATE_PATH)
+
+def window_seconds(window):
+    unit = WINDOW_PATTERN.match(window).group(1)
+    return int(window[:-len(unit)]) * WINDOW_SECONDS[unit]
+
+def load_rules():
+    if ALERT_RULES:
+        rules = json.loads(ALERT_RULES)
+    elif VALUE_NAME:
+        rules = [{"measure": VALUE_NAME, "min": 0, "max": 950}]
+    else:
+        return []
+    for rule in rules:
+        rule.setdefault("min", None)
+        rule.setdefault("max", None)
+        rule.setdefault("window", DEFAULT_WINDOW)
+        if not MEASURE_PATTERN.match(rule["measure"]):
+            raise ValueError(f"invalid measure name in alert rules: {rule['measure']}")
+        if not WINDOW_PATTERN.match(rule["window"]):
+            raise ValueError(f"invalid window for {rule['measure']} in alert rules: {rule['window']}")
+    return rules
+
+def build_query(rules):
+    # One query returning the minimum, maximum and number of values of each
+    # measure within its own window
+    ## Only the longest window is scanned, and each measure's rows are then
+    ## limited to its own window
+    longest = max((rule["window"] for rule in rules), key=window_seconds)
+    measures = ", ".join(f"'{rule['measure']}'" for rule in rules)
+    windows = " ".join(f"WHEN '{rule['measure']}' THEN ago({rule['window']})" for rule in rules)
+    value = "coalesce(measure_value::double, CAST(measure_value::bigint AS double))"
+    return (f'SELECT measure_name, min({value}) AS min_value, max({value}) AS max_value, count(*) AS value_count '
+            f'FROM "{SUCCULENTPI_DATABASE}"."{SUCCULENTPI_TABLE}" '
+            f'WHERE time between ago({longest}) and now() '
+            f'AND measure_name IN ({measures}) '
+            f'AND time >= CASE measure_name {windows} END '
+            f'GROUP BY measure_name')
+
+def run_query(query):
+    # Run a query, following NextToken through every page of results, and
+    # return the rows as dictionaries keyed by column name
+    rows = []
+    kwargs = {"QueryString": query}
+    while True:
+        response = c_ts_query.query(**kwargs)
+        columns = [column['Name'] for column in response['ColumnInfo']]
+        for row in response['Rows']:
+            rows.append({column: datum.get('ScalarValue') for column, datum in zip(columns, row['Data'])})
+        if not response.get('NextToken'):
+            return rows
+        kwargs["NextToken"] = response['NextToken']
+
+def check_rules(rules, rows):
+    # Return a description of how each rule is broken, as {measure: [alerts]}
+    results = {row['measure_name']: row for row in rows}
+    violations = {}
+    for rule in rules:
+        measure = rule["measure"]
+        row = results.get(measure)
+        if row is None or int(row['value_count']) == 0:
+            violations[measure] = [f"{measure}: no data in the last {rule['window']}"]
+            continue
+        if row['min_value'] is None:
+            ## Not a number (e.g. a boolean), so there is no range to check
+            continue
+        min_value = float(row['min_value'])
+        max_value = float(row['max_value'])
+        if rule["min"] is not None and min_value < rule["min"]:
+            violations.setdefault(measure, []).append(f"{measure}: {min_value:g} is below the minimum of {rule['min']:g} in the last {rule['window']}")
+        if rule["max"] is not None and max_value > rule["max"]:
+            violations.setdefault(measure, []).append(f"{measure}: {max_value:g} is above the maximum of {rule['max']:g} in the last {rule['window']}")
+    return violations
+
 def lambda_handler(event, context):
     logger.debug("event:\n{}".format(json.dumps(event, indent=2)))
 
-    records_sensordata = []
-    records_ggmetrics = []
-
     try:
-        c_ts_query = boto3.client('timestream-query')
-        sns = boto3.client('sns')
-
-        response = c_ts_query.describe_endpoints()
-        logger.info("response describe_endpoints: {}".format(response))
         if not SUCCULENTPI_DATABASE or not SUCCULENTPI_TABLE or len(SUCCULENTPI_DATABASE)==0 or len(SUCCULENTPI_TABLE)==0:
-            logger.warn(f"database or table for SucculentPi not defined: SUCCULENTPI_DATABASE: {SUCCULENTPI_DATABASE} SUCCULENTPI_TABLE: {SUCCULENTPI_TABLE}")
+            logger.warning(f"database or table for SucculentPi not defined: SUCCULENTPI_DATABASE: {SUCCULENTPI_DATABASE} SUCCULENTPI_TABLE: {SUCCULENTPI_TABLE}")
             return {"status": "warn", "message": "database or table for succulentpi not defined"}
-        response = c_ts_query.query(QueryString=QUERY)
-        if not response :
-            return {"status": "error", "message": "Empty response"}
-        ret_val = {"status": "success"}
-        ret_val["records size"] = "{}" .format(len(response['Rows']))
-        result = int(ret_val["records size"]);
-    
+        rules = load_rules()
+        if not rules:
+            logger.warning("no alert rules defined: set ALERT_RULES or VALUE_NAME")
+            return {"status": "warn", "message": "no alert rules defined"}
+        rows = run_query(build_query(rules))
+        logger.info(f"Number of Rows: {len(rows)}")
+        violations = check_rules(rules, rows)
+        incidents = alert_store.open_incidents()
+        opened, ongoing, recovered, dropped = alert_state.transitions(
+            incidents, violations, {rule["measure"] for rule in rules}, time.time())
+
     except Exception as e:
         logger.error("{}".format(e))
-        return {"status": "query error", "message": "{}".format(e)}   
+        return {"status": "query error", "message": "{}".format(e)}
 
-    try:
-        logger.info(f"Number of Rows: {result}")
-        logger.info(f"Value of {VALUE_NAME}: {response['Rows'][0]['Data'][4]['ScalarValue']}")
-        
-        if result < 1:
-            logger.info("Sending Missing Data SNS Message...")
-            sns.publish(TopicArn=SNS_TOPIC, Message="ALERT: The latest SucculentPi sensor data is missing", Subject="Alert: Sensor Data Missing")
-            
-        elif result > 0 and (int(response['Rows'][0]['Data'][4]['ScalarValue']) < 0 or int(response['Rows'][0]['Data'][4]['ScalarValue']) > 950):
-            logger.info("Sending Data Out Of Range SNS Message...")
-            sns.publish(TopicArn=SNS_TOPIC, Message=f"ALERT: The SucculentPi sensor data is out of range: {VALUE_NAME} = {response['Rows'][0]['Data'][4]['ScalarValue']}", Subject="Alert: Sensor Data Out of Range")
-        
-        elif result > 0:
+    result = {"status": "success", "alerts": list(opened), "ongoing": list(ongoing), "recovered": list(recovered)}
+    if not opened and not recovered:
+        if dropped:
+            try:
+                alert_store.update({}, dropped)
+
+            except Exception as e:
+                logger.error("{}".format(e))
+                return {"status": "error saving alert state", "message": "{}".format(e)}
+        if ongoing:
+            logger.info(f"{len(ongoing)} alerts already sent are still open")
+            result["message"] = "No change in alerts"
+        else:
             logger.info("Results OK")
-            return {"status": "success", "message": "Results OK"}
+            result["message"] = "Results OK"
+        return result
+
+    try:
+        logger.info(f"Sending SNS Message for {len(opened)} new and {len(recovered)} recovered alerts...")
+        subject, message = alert_state.digest(opened, ongoing, recovered)
+        sns.publish(TopicArn=SNS_TOPIC, Message=message, Subject=subject)
 
     except Exception as e:
+        ## The incidents aren't updated, so the message is tried again by the
+        ## next run
         logger.error("{}".format(e))
         return {"status": "error sending notification", "message": "{}".format(e)}
-        
-     
\ No newline at end of file
+
+    try:
+        alert_store.update(opened, list(recovered) + dropped)
+
+    except Exception as e:
+        logger.error("{}".format(e))
+        return {"status": "error saving alert state", "message": "{}".format(e)}
+
+    result["message"] = "Alerts sent"
+    return result
@@ -0,0 +1,79 @@
+#
+# Fans out batches of SucculentPi readings into Amazon Timestream.
+# Triggered by the AWS IoT Core rules in iot_messge_routing_rule_batch.sql
+# (batched JSON readings) and iot_messge_routing_rule_encoded.sql (compact
+# flat/binary payloads, see payload_codec.py). Each reading is written with
+# the same measure names as iot_messge_routing_rule.sql, so all of the routes
+# can feed the same table.
+# Deploy together with readings_schema.py and payload_codec.py, plus the cbor2
+# and/or msgpack modules if those formats are used. If the Raspberry Pi uses
+# its own sensor map, deploy that too and set SUCCULENTPI_SENSOR_MAP to its
+# path, so batched JSON readings are flattened with the same fields.
+#
+
+import base64
+import boto3
+import json
+import logging
+import os
+from zoneinfo import ZoneInfo
+
+import payload_codec
+import readings_schema
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+SUCCULENTPI_DATABASE = os.environ.get("SUCCULENTPI_DATABASE", "")
+SUCCULENTPI_TABLE = os.environ.get("SUCCULENTPI_TABLE", "")
+# Time zone of the Raspberry Pi, used to interpret the readings' timestamps
+SUCCULENTPI_TIMEZONE = os.environ.get("SUCCULENTPI_TIMEZONE", "UTC")
+
+# Timestream accepts at most 100 records per WriteRecords call
+MAX_RECORDS_PER_WRITE = 100
+
+c_ts_write = boto3.client('timestream-write')
+
+
+def write_records(records, dimensions):
+    for start in range(0, len(records), MAX_RECORDS_PER_WRITE):
+        c_ts_write.write_records(
+            DatabaseName=SUCCULENTPI_DATABASE,
+            TableName=SUCCULENTPI_TABLE,
+            CommonAttributes={"Dimensions": dimensions},
+            Records=records[start:start + MAX_RECORDS_PER_WRITE]
+        )
+
+def lambda_handler(event, context):
+    logger.debug("event:\n{}".format(json.dumps(event, indent=2)))
+
+    if not SUCCULENTPI_DATABASE or not SUCCULENTPI_TABLE:
+        logger.warning(f"database or table for SucculentPi not defined: SUCCULENTPI_DATABASE: {SUCCULENTPI_DATABASE} SUCCULENTPI_TABLE: {SUCCULENTPI_TABLE}")
+        return {"status": "warn", "message": "database or table for succulentpi not defined"}
+
+    tz = ZoneInfo(SUCCULENTPI_TIMEZONE)
+
+    try:
+        records = []
+        if "data" in event:
+            # Encoded payload, passed on by the rule as base64
+            payload = base64.b64decode(event["data"])
+            client_id, readings = payload_codec.decode(payload, payload_codec.detect_format(payload))
+            for timestamp, flat in readings:
+                records += readings_schema.flat_records(timestamp, flat, tz)
+        else:
+            client_id = event.get("client_id", "unknown")
+            readings = event.get("readings", [])
+            for reading in readings:
+                records += readings_schema.timestream_records(reading, tz)
+        dimensions = [{"Name": "client_id", "Value": str(client_id)}]
+        write_records(records, dimensions)
+    except c_ts_write.exceptions.RejectedRecordsException as e:
+        logger.error("Rejected records: {}".format(e.response.get("RejectedRecords")))
+        return {"status": "error", "message": "{}".format(e)}
+    except Exception as e:
+        logger.error("{}".format(e))
+        return {"status": "error", "message": "{}".format(e)}
+
+    logger.info(f"Wrote {len(records)} records from {len(readings)} readings")
+    return {"status": "success", "readings": len(readings), "records": len(records)}